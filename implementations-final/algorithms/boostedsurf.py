@@ -4,6 +4,11 @@ from functools import partial
 from nptyping import Array
 from sklearn.metrics import pairwise_distances
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import WeightedMetric, get_metric
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.group_sums import group_sums
+from algorithms.utils.class_diff_sums import ClassDiffSums
+from algorithms.utils.precomputed import resolve_precomputed
 
 class BoostedSURF(BaseEstimator, TransformerMixin):
 
@@ -17,15 +22,19 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
     """
 
     def __init__(self, n_features_to_select=10, phi=5, 
-            dist_func=lambda w, x1, x2: np.sum(w*np.logical_xor(x1, x2), 1), learned_metric_func=None):
+            dist_func=lambda w, x1, x2: np.sum(w*np.logical_xor(x1, x2), 1), learned_metric_func=None, dtype=np.float64,
+            max_terms_bytes=2**27, max_sums_bytes=2**28):
 
         self.n_features_to_select = n_features_to_select  # Number of features to select.
         self.phi = phi                                    # the phi parameter (update weights when iteration_counter mod phi == 0)
         self.dist_func = dist_func                        # Distance function to use.
         self.learned_metric_func = learned_metric_func    # learned metric function.
+        self.dtype = dtype                                # floating point type used for computing distances.
+        self.max_terms_bytes = max_terms_bytes            # maximal number of bytes of cached per-feature distance terms (0 to recompute distances)
+        self.max_sums_bytes = max_sums_bytes              # maximal number of bytes of numbers of differences to all examples of each class (0 to enumerate all neighbours)
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using BoostedSURF feature selection algorithm
@@ -33,17 +42,25 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run Boosted SURF feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._boostedSURF(data, target, self.phi, self.dist_func, 
-                    learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._boostedSURF(data, target, self.phi, dist_func, 
+                    learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._boostedSURF(data, target, self.phi, self.dist_func)
+            self.rank, self.weights = self._boostedSURF(data, target, self.phi, dist_func)
 
         return self
 
@@ -64,19 +81,21 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)
+        self.fit(data, target, distances)
         return self.transform(data)
 
 
@@ -88,8 +107,10 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
             data : Array[np.float64] -- Matrix containing examples' data as rows
             target : Array[np.int] -- matrix containing the example's target variable value
             phi: int -- parameter specifying number of iterations before recomputing distance weights
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a weighted metric from the metrics registry ('weighted_manhattan', 'weighted_euclidean',
+            'weighted_sqeuclidean', 'weighted_chebyshev' or 'weighted_hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -98,9 +119,12 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
             Array[np.int], Array[np.float64] -- Array of feature enumerations based on the scores, array of feature scores
 
         """
+
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func, weighted=True)
         
         # Initialize distance weights.
-        dist_weights = np.ones(data.shape[1], dtype=np.float)
+        dist_weights = np.ones(data.shape[1], dtype=data.dtype)
 
         # weighted distance function
         dist_func_w = partial(dist_func, dist_weights)
@@ -108,26 +132,54 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         # Initialize weights.
         weights = np.zeros(data.shape[1], dtype=np.int)
 
+        # If distances are linear in distance weights, get number of examples for which the unweighted per-feature
+        # distance terms to all examples fit in the memory budget (0 if distances are recomputed for each example).
+        if 'learned_metric_func' not in kwargs and isinstance(dist_func, WeightedMetric) and dist_func.linear_terms is not None:
+            tile_rows = min(phi, self.max_terms_bytes//max(data.nbytes, 1))
+        else:
+            tile_rows = 0
+
+        # If numbers of examples of each class with different feature values fit in the memory budget, the numbers for
+        # the most numerous of close, far and remaining examples are computed from the numbers for all examples.
+        classes, class_idx = np.unique(target, return_inverse=True)
+        if ClassDiffSums.nbytes(data, classes.size) <= self.max_sums_bytes:
+            class_diff_sums = ClassDiffSums(data, class_idx, classes.size)
+        else:
+            class_diff_sums = None
+
         for idx in np.arange(data.shape[0]):
             
             # Recompute distance matrix.
             if np.mod(idx, phi) == 0:
-                dist_weights = np.maximum(weights, np.ones(data.shape[1], dtype=np.float))
+                dist_weights = np.maximum(weights, np.ones(data.shape[1], dtype=np.float)).astype(data.dtype)
                 dist_func_w = partial(dist_func, dist_weights)
                 if 'learned_metric_func' in kwargs:
                     dist_func_w_learned = partial(kwargs['learned_metric_func'], dist_func_w)
            
 
             # Compute distances from current examples to all other examples.
-            if 'learned_metric_func' in kwargs:
-                dists = dist_func_w_learned(idx, np.arange(data.shape[0]))
+            if tile_rows > 0:
+
+                # Compute per-feature distance terms for tile of examples sharing the distance weights and weight
+                # them with a single matrix-vector product.
+                if np.mod(idx, phi) == 0 or idx == tile_end:
+                    tile_start = idx
+                    tile_end = min(idx + tile_rows, idx - np.mod(idx, phi) + phi, data.shape[0])
+                    terms = dist_func.linear_terms(data[tile_start:tile_end, np.newaxis, :], data)
+                    dists_tile = np.dot(terms.reshape(-1, data.shape[1]), dist_weights).reshape(tile_end - tile_start, data.shape[0])
+                dists = dists_tile[idx - tile_start]
+                msk_diff = terms[idx - tile_start] != 0
             else:
-                dists = dist_func_w(data[idx, :], data)
+                if 'learned_metric_func' in kwargs:
+                    dists = dist_func_w_learned(idx, np.arange(data.shape[0]))
+                else:
+                    dists = dist_func_w(data[idx, :], data)
+                msk_diff = data[idx, :] != data
 
 
             # Compute mean and standard deviation of distances and set thresholds.
-            t_next = np.mean(dists[np.arange(data.shape[0]) != idx])
-            sigma_nxt = np.std(dists[np.arange(data.shape[0]) != idx])
+            t_next = np.mean(dists[np.arange(data.shape[0]) != idx], dtype=np.float64)
+            sigma_nxt = np.std(dists[np.arange(data.shape[0]) != idx], dtype=np.float64)
             thresh_near = t_next - sigma_nxt/2.0
             thresh_far = t_next + sigma_nxt/2.0
 
@@ -138,40 +190,36 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
             # Get mask of examples that are far.
             msk_far = dists > thresh_far
 
-            # Get examples that are close.
-            examples_close = data[msk_close, :]
-            target_close = target[msk_close]
-            
-            # Get examples that are far.
-            examples_far = data[msk_far, :]
-            target_far = target[msk_far]
+            if class_diff_sums is not None:
+
+                # Count features with different values for neighbours in bands of close (0), remaining (1) and far (2)
+                # examples by class and sum counts to get groups of close hits (0), close misses (1), far hits (2) and far misses (3).
+                bands = np.where(msk_close, 0, np.where(msk_far, 2, 1))
+                bands[idx] = -1
+                features_diff_bands, counts_bands = class_diff_sums.band_sums(idx, bands, 3,
+                        lambda rows, groups, n_groups: group_sums(msk_diff[rows], groups, n_groups), counts=True, unused=1)
+                features_diff_bands = features_diff_bands.reshape(3, classes.size, -1)[[0, 2]]
+                counts_bands = counts_bands.reshape(3, classes.size)[[0, 2]]
+                features_diff = np.vstack((features_diff_bands[:, class_idx[idx]], np.sum(features_diff_bands, 1) - features_diff_bands[:, class_idx[idx]]))[[0, 2, 1, 3]]
+                counts = np.hstack((counts_bands[:, class_idx[idx]], np.sum(counts_bands, 1) - counts_bands[:, class_idx[idx]]))[[0, 2, 1, 3]]
+            else:
 
-            # Get considered features of close examples.
-            features_close = data[idx, :] != examples_close
-            # Get considered features of far examples.
-            features_far = data[idx, :] == examples_far 
+                # Get groups of neighbours: close hits (0), close misses (1), far hits (2) and far misses (3).
+                msk_miss = target != target[idx]
+                groups = np.where(msk_close, msk_miss, np.where(msk_far, 2 + msk_miss, -1))
 
-            # Get mask for close examples with same class.
-            msk_same_close = target_close == target[idx]
+                # Count features with different values for neighbours in each group in a single pass.
+                features_diff, counts = group_sums(msk_diff, groups, 4)
 
-            # Get mask for far examples with same class.
-            msk_same_far = target_far == target[idx]
+            # Features with different values are considered for close examples and features with equal values for far examples.
+            features_diff = features_diff.astype(weights.dtype)
+            features_same = counts[np.newaxis].T - features_diff
 
 
             ### WEIGHTS UPDATE ###
 
-            # Get penalty weights update values for close examples. 
-            wu_close_penalty = np.sum(features_close[msk_same_close, :], 0)
-            # Get reward weights update values for close examples. 
-            wu_close_reward = np.sum(features_close[np.logical_not(msk_same_close), :], 0)
-
-            # Get penalty weights update values for far examples.
-            wu_far_penalty = np.sum(features_far[msk_same_far, :], 0)
-            # Get reward weights update values for close examples. 
-            wu_far_reward = np.sum(features_far[np.logical_not(msk_same_far), :], 0)
-
-            # Update weights.
-            weights = weights - (wu_close_penalty + wu_far_penalty) + (wu_close_reward + wu_far_reward)
+            # Penalize close hits and far hits and reward close misses and far misses.
+            weights = weights - (features_diff[0] + features_same[2]) + (features_diff[1] + features_same[3])
 
             ### /WEIGHTS UPDATE ###
 
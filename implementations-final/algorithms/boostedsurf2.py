@@ -5,7 +5,9 @@ from functools import partial
 from nptyping import Array
 from sklearn.metrics import pairwise_distances
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import get_metric
 from julia import Julia
+from algorithms.utils.precomputed import resolve_precomputed
 jl = Julia(compiled_modules=False)
 
 
@@ -28,10 +30,10 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
 
         # Use function written in Julia programming language to update feature weights.
         script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_boostedsurf3.jl")
+        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_boostedsurf_fused.jl")
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using BoostedSURF feature selection algorithm
@@ -39,16 +41,21 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
         # Run BoostedSURF feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._boostedSURF(data, target, self.phi, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._boostedSURF(data, target, self.phi, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._boostedSURF(data, target, self.phi, self.dist_func)
+            self.rank, self.weights = self._boostedSURF(data, target, self.phi, dist_func)
 
         return self
 
@@ -68,18 +75,20 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)
+        self.fit(data, target, distances)
         return self.transform(data)
 
 
@@ -91,8 +100,10 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
             data : Array[np.float64] -- Matrix containing examples' data as rows
             target : Array[np.int] -- matrix containing the example's target variable value
             phi: int -- parameter specifying number of iterations before recomputing distance weights
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a weighted metric from the metrics registry ('weighted_manhattan', 'weighted_euclidean',
+            'weighted_sqeuclidean', 'weighted_chebyshev' or 'weighted_hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -102,6 +113,9 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
 
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func, weighted=True)
+
         # Initialize weights.
         weights = np.zeros(data.shape[1], dtype=np.float)
 
@@ -119,6 +133,9 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
         if 'learned_metric_func' in kwargs:
             dist_func_w_learned = partial(kwargs['learned_metric_func'], dist_func_w)
 
+        # Get indices of classes of examples.
+        classes, class_idx = np.unique(target, return_inverse=True)
+
         for idx in np.arange(data.shape[0]):
 
             # Recompute distance matrix.
@@ -152,49 +169,16 @@ class BoostedSURF(BaseEstimator, TransformerMixin):
             # Get mask of examples that are far.
             msk_far = dists > thresh_far
 
-            # Get target values for considered regions.
-            target_close = target[msk_near]
-            target_far = target[msk_far]
-
-            # Get class values of miss neighbours.
-            classes_other_near = target[np.logical_and(msk_near, target != target[idx])]
-            classes_other_far = target[np.logical_and(msk_far, target != target[idx])]
-
-            # Get masks for considered regions.
-            hit_neigh_mask_near = np.logical_and(msk_near, target == target[idx])
-            hit_neigh_mask_far = np.logical_and(msk_far, target == target[idx])
-            miss_neigh_mask_near = np.logical_and(msk_near, target != target[idx])
-            miss_neigh_mask_far = np.logical_and(msk_far, target != target[idx])
-
-
-            # Compute probability weights for misses in considered regions.            
-            weights_mult1 = np.empty(classes_other_near.size, dtype=np.float)
-            u, c = np.unique(classes_other_near, return_counts=True)
-            neighbour_weights = c/classes_other_near.size
-            for i, val in enumerate(u):
-                weights_mult1[np.where(classes_other_near == val)] = neighbour_weights[i]
-
-            weights_mult2 = np.empty(classes_other_far.size, dtype=np.float)
-            u, c = np.unique(classes_other_far, return_counts=True)
-            neighbour_weights = c/classes_other_far.size
-            for i, val in enumerate(u):
-                weights_mult2[np.where(classes_other_far == val)] = neighbour_weights[i]
+            # Get groups of neighbours. Near neighbours are grouped by class and far neighbours are grouped
+            # by class in groups following the groups of near neighbours.
+            groups = np.where(msk_near, class_idx, np.where(msk_far, classes.size + class_idx, -1))
 
 
             ### WEIGHTS UPDATE ###
 
-            # Update feature weights for near examples.
-            weights_near = self._update_weights(data, e[np.newaxis], data[hit_neigh_mask_near, :], 
-                    data[miss_neigh_mask_near, :], weights[np.newaxis], weights_mult1[np.newaxis].T,
-                    max_f_vals[np.newaxis], min_f_vals[np.newaxis])
-            
-            # Update feature weights for far examples.
-            weights_far = self._update_weights(data, e[np.newaxis], data[hit_neigh_mask_far, :], 
-                    data[miss_neigh_mask_far, :], weights[np.newaxis], weights_mult2[np.newaxis].T,
-                    max_f_vals[np.newaxis], min_f_vals[np.newaxis])
-
-            # Subtract scoring for far examples. Subtract previous value of weights to get delta.
-            weights = weights_near - (weights_far - weights)
+            # Update feature weights for near and far examples in a single pass. The scoring for far examples is subtracted.
+            weights = self._update_weights(data, e, groups, int(class_idx[idx]), int(classes.size), weights,
+                    max_f_vals, min_f_vals)
 
             ### /WEIGHTS UPDATE ###
 
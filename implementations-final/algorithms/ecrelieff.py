@@ -1,14 +1,19 @@
 import numpy as np
 import numba as nb
 from scipy.stats import rankdata
-from functools import partial
 
 import os
 import sys
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.class_partition import ClassPartition
+from algorithms.utils.neighbours import get_neighbours, measure_recall
+from algorithms.utils.parallel import accumulate_shards
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype
 
 from julia import Julia
+from algorithms.utils.precomputed import resolve_precomputed
 jl = Julia(compiled_modules=False)
 
 
@@ -22,36 +27,49 @@ class ECRelieff(BaseEstimator, TransformerMixin):
     Author: Jernej Vivod
     """
    
-    def __init__(self, n_features_to_select=10, m=-1, k=5, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, m=-1, k=5, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None,
+            neighbour_backend='brute', neighbour_params=None, block_size=256, n_jobs=1, dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.m = m                                        # example sample size
         self.k = k                                        # the k parameter
         self.dist_func = dist_func                        # distance function
         self.learned_metric_func = learned_metric_func    # learned distance function
+        self.neighbour_backend = neighbour_backend        # nearest neighbours search backend ('brute', 'tree', 'approximate', 'early_abandon', 'pivot' or 'quantised')
+        self.neighbour_params = neighbour_params          # additional parameters of nearest neighbours search
+        self.block_size = block_size                      # number of sampled examples processed together
+        self.n_jobs = n_jobs                              # number of worker processes (-1 to use all processors)
+        self.dtype = dtype                                # floating point type used for computing distances and differences
 
-        # Use function written in Julia programming language to update feature weights.
+        # Use function written in Julia programming language to perform evaporative cooling feature selection.
         script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_relieff2.jl")
         self._perform_ec_ranking = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/ec_ranking.jl")
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using ReliefF feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run ECRelief feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank = self._ecrelieff(data, target, self.m, self.k, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank = self._ecrelieff(data, target, self.m, self.k, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank = self._ecrelieff(data, target, self.m, self.k, self.dist_func)
+            self.rank = self._ecrelieff(data, target, self.m, self.k, dist_func)
         return self
 
 
@@ -70,17 +88,19 @@ class ECRelieff(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -152,8 +172,11 @@ class ECRelieff(BaseEstimator, TransformerMixin):
             target : Array[np.int] -- matrix containing the example's target variable value
             m : int -- Sample size to use when evaluating the feature scores
             k : int -- Number of closest examples from each class to use
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming'). Minkowski metrics ('manhattan', 'euclidean' and 'chebyshev') allow the use of spatial indices for
+            finding nearest neighbours.
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -162,9 +185,6 @@ class ECRelieff(BaseEstimator, TransformerMixin):
             Array[np.int], Array[np.float64] -- Array of feature enumerations based on the scores, array of feature scores
         """
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
-
         # Get indices of examples in sample.
         idx_sampled = np.random.choice(np.arange(data.shape[0]), data.shape[0] if m == -1 else m, replace=False)
         
@@ -175,85 +195,55 @@ class ECRelieff(BaseEstimator, TransformerMixin):
         max_f_vals = np.amax(data, 0)
         min_f_vals = np.amin(data, 0)
 
-        # Get all unique classes.
-        classes = np.unique(target)
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
 
-        # Get probabilities of classes in training set.
-        p_classes = (np.vstack(np.unique(target, return_counts=True)).T).astype(np.float)
-        p_classes[:, 1] = p_classes[:, 1] / np.sum(p_classes[:, 1])
+        # Group examples by class into contiguous blocks and get class probabilities.
+        partition = ClassPartition(data, target)
 
         # Compute mu values.
         mu_vals = self._mu_vals(data, target)
 
-        # Go over sampled examples' indices.
-        for idx in idx_sampled:
-
-            # Get next example.
-            e = data[idx, :]
-
-            # Get index of next sampled example in group of examples with same class.
-            idx_class = idx - np.sum(target[:idx] != target[idx])
-          
-            # If keyword argument with keyword 'learned_metric_func' exists...
-            if 'learned_metric_func' in kwargs:
-
-                # Partially apply distance function.
-                dist = partial(kwargs['learned_metric_func'], dist_func, np.int(idx))
+        # Initialize search for nearest neighbours from each class.
+        neighbours = get_neighbours(self.neighbour_backend, partition, dist_func, self.neighbour_params, **kwargs)
 
-                # Compute distances to examples from same class in learned metric space.
-                distances_same = dist(np.where(target == target[idx])[0])
+        # Define computation of weights updates for a block of sampled examples' indices.
+        def process_block(idx_block, accumulator):
 
-                # Set distance of sampled example to itself to infinity.
-                distances_same[idx_class] = np.inf
+            # Find k closest examples from each class for examples in block.
+            idxs_closest, _ = neighbours.kneighbours(idx_block, k)
 
-                # Find k closest examples from same class.
-                idxs_closest_same = np.argpartition(distances_same, k)[:k]
-                closest_same = (data[target == target[idx], :])[idxs_closest_same, :]
-            else:
-                # Find k nearest examples from same class.
-                distances_same = dist_func(e, data[target == target[idx], :])
+            # Go over sampled examples' indices in block.
+            for i, idx in enumerate(idx_block):
 
-                # Set distance of sampled example to itself to infinity.
-                distances_same[idx_class] = np.inf
+                # Get next example.
+                e = data[idx, :]
 
-                # Find closest examples from same class.
-                idxs_closest_same = np.argpartition(distances_same, k)[:k]
-                closest_same = (data[target == target[idx], :])[idxs_closest_same, :]
+                # Get index of class of next sampled example.
+                cl_idx = partition.class_idx[idx]
 
-            # Allocate matrix template for getting nearest examples from other classes.
-            closest_other = np.empty((k * (len(classes) - 1), data.shape[1]), dtype=np.float)
+                # Get k closest examples from same class.
+                closest_same = partition.block(cl_idx)[idxs_closest[cl_idx][i], :]
 
-            # Initialize pointer for adding examples to template matrix.
-            top_ptr = 0
-            for cl in classes:  # Go over classes different than the one of current sampled example.
-                if cl != target[idx]:
-                    # If keyword argument with keyword 'learned_metric_func' exists...
-                    if 'learned_metric_func' in kwargs:
-                        # get closest k examples with class cl if using learned distance metric.
-                        distances_cl = dist(np.where(target == cl)[0])
-                    else:
-                        # Get closest k examples with class cl
-                        distances_cl = dist_func(e, data[target == cl, :])
-                    # Get indices of closest exmples from class cl
-                    idx_closest_cl = np.argpartition(distances_cl, k)[:k]
+                # Get k closest examples from each of the other classes.
+                closest_other = np.vstack([partition.block(cl_other)[idxs_closest[cl_other][i], :] 
+                    for cl_other in partition.other_classes(cl_idx)])
 
-                    # Add found closest examples to matrix.
-                    closest_other[top_ptr:top_ptr+k, :] = (data[target == cl, :])[idx_closest_cl, :]
-                    top_ptr = top_ptr + k
+                # Compute diff sum weights for closest examples from different class.
+                weights_mult = np.repeat(partition.p_weights(cl_idx), k) # Weights multiplier vector
 
+                # ------ weights update ------
+                self._update_weights(accumulator, e, closest_same, closest_other, weights_mult, m, k)
 
-            # Get probabilities of classes not equal to class of sampled example.
-            p_classes_other = p_classes[p_classes[:, 0] != target[idx], 1]
-           
-            # Compute diff sum weights for closest examples from different class.
-            p_weights = p_classes_other/(1 - p_classes[p_classes[:, 0] == target[idx], 1])
-            weights_mult = np.repeat(p_weights, k) # Weights multiplier vector
+        # Go over blocks of sampled examples' indices (in worker processes if n_jobs > 1).
+        accumulate_shards(process_block, idx_sampled, self.block_size, accumulator, self.n_jobs)
 
 
-            # ------ weights update ------
-            weights = np.array(self._update_weights(data, e[np.newaxis], closest_same, closest_other, weights[np.newaxis],
-                    weights_mult[np.newaxis].T, m, k, max_f_vals[np.newaxis], min_f_vals[np.newaxis]))
+        # Measure recall of nearest neighbours search.
+        self.neighbour_recall = measure_recall(neighbours, idx_sampled, k)
 
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
 
         # Perform evaporative cooling feature selection.
         rank = self._perform_ec_ranking(data, target, weights, mu_vals)
@@ -261,3 +251,20 @@ class ECRelieff(BaseEstimator, TransformerMixin):
         # Return feature ranks.
         return rank
 
+
+    def _update_weights(self, accumulator, e, closest_same, closest_other, weights_mult, m, k):
+
+        """Add feature weights update for sampled example to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- sampled example
+            closest_same : Array[np.float64] -- matrix of k closest examples from same class
+            closest_other : Array[np.float64] -- matrix of k closest examples from each of the other classes
+            weights_mult : Array[np.float64] -- probability weights of closest examples from other classes
+            m : int -- Sample size used when evaluating the feature scores
+            k : int -- Number of closest examples from each class
+        """
+        accumulator.add_penalty(np.abs(e - closest_same), 1.0/(m*k))
+        accumulator.add_reward(weights_mult[np.newaxis].T*np.abs(e - closest_other), 1.0/(m*k))
+
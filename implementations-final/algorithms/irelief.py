@@ -4,6 +4,7 @@ from functools import partial
 from scipy.stats import rankdata
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.dtypes import as_compute_dtype
 
 class IRelief(BaseEstimator, TransformerMixin):
 
@@ -16,12 +17,13 @@ class IRelief(BaseEstimator, TransformerMixin):
     """
     
     def __init__(self, n_features_to_select=10, max_iter=100,
-            k_width=5, conv_condition=1.0e-12, initial_w_div=1):
+            k_width=5, conv_condition=1.0e-12, initial_w_div=1, dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.max_iter = max_iter                          # Maximum number of iterations
         self.k_width = k_width                            # kernel width
         self.conv_condition = conv_condition              # convergence condition
         self.initial_w_div = initial_w_div                # initial weight quotient
+        self.dtype = dtype                                # floating point type used for computing differences
 
     def fit(self, data, target):
         """
@@ -35,6 +37,9 @@ class IRelief(BaseEstimator, TransformerMixin):
             self
         """
 
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run I-RELIEF feature selection algorithm.
         self.rank, self.weights = self._irelief(data, target, self.max_iter, self.k_width, 
                 self.conv_condition, self.initial_w_div)
@@ -85,9 +90,10 @@ class IRelief(BaseEstimator, TransformerMixin):
             array of average h values for each training example.
         """
        
-        # Allocate matrix for storing results.
-        mean_h = np.empty(data.shape, dtype=np.float)
-        mean_m = np.empty(data.shape, dtype=np.float)
+        # Allocate matrix for storing results and convert distance weights to floating point type of data.
+        mean_h = np.empty(data.shape, dtype=data.dtype)
+        mean_m = np.empty(data.shape, dtype=data.dtype)
+        dist_weights = dist_weights.astype(data.dtype, copy=False)
 
         # Go over rows of pairwise differences.
         for idx in np.arange(data.shape[0]):
@@ -126,8 +132,9 @@ class IRelief(BaseEstimator, TransformerMixin):
             Array[np.float64] -- probabilities of examples being outliers
         """
 
-        # Allocate array for storing results.
+        # Allocate array for storing results and convert distance weights to floating point type of data.
         po_vals = np.empty(data.shape[0], dtype=np.float)
+        dist_weights = dist_weights.astype(data.dtype, copy=False)
 
         # Go over rows of distance matrix.
         for idx in np.arange(data.shape[0]):
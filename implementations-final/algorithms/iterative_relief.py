@@ -6,6 +6,9 @@ from scipy.stats import rankdata
 import warnings
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import get_metric, WeightedMetric
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.precomputed import resolve_precomputed
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -20,13 +23,15 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
     """
 
     def __init__(self, n_features_to_select=10,  m=-1, min_incl=3, 
-            dist_func=lambda w, x1, x2 : np.sum(np.abs(w*(x1-x2)), 1), max_iter=100, learned_metric_func=None):
+            dist_func=lambda w, x1, x2 : np.sum(np.abs(w*(x1-x2)), 1), max_iter=100, learned_metric_func=None,
+            dtype=np.float64):
         self.m = m                  # sample size
         self.min_incl = min_incl    # minimal number of examples from each class to include in hypersphere
         self.dist_func = dist_func  # metric function to measure distance between examples
         self.max_iter = max_iter    # maximal number of iterations
         self.learned_metric_func = learned_metric_func    # learned metric function
         self.n_features_to_select = n_features_to_select  # number of best features to select
+        self.dtype = dtype                                # floating point type used for computing distances and differences
 
 
     def min_radius(self, n, data, target, dist_metric, mode, **kwargs):
@@ -44,7 +49,8 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
 
             target : Array[np.int] Matrix of target variable values
 
-            dist_metric : Callable[[Array[np.float64], Array[np.float64]], np.float64] -- distance metric for distance matrix computation
+            dist_metric : Union[WeightedMetric, Callable[[Array[np.float64], Array[np.float64], Array[np.float64]], np.float64]] --
+            weighted metric or distance function for distance matrix computation
 
             mode : str -- equal to 'index' if selecting examples by their index and equal to 'example' if passing in explicit examples.
 
@@ -68,6 +74,9 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
             dist_func_adapter = lambda x1, x2 : dist_func(np.int(np.where(np.sum(np.equal(x1, data), 1) == data.shape[1])[0][0]), 
                     np.int(np.where(np.sum(np.equal(x2, data), 1) == data.shape[1])[0][0]))
             dist_mat = sk_metrics.pairwise_distances_chunked(data, metric=dist_func_adapter, working_memory=0)
+        elif mode == "example" and isinstance(dist_metric, WeightedMetric):  # else if using a metric from the registry
+            ones = np.ones(data.shape[1], dtype=np.float)
+            dist_mat = (dist_metric.pairwise(ones, data[k:k+1, :], data) for k in np.arange(data.shape[0]))
         elif mode == "example":  # else
             dist_func = lambda x1, x2 : dist_metric(np.ones(data.shape[1], dtype=np.float), x1[np.newaxis], x2[np.newaxis])
             dist_mat = sk_metrics.pairwise_distances_chunked(data, metric=dist_func, n_jobs=-1, working_memory=0)
@@ -88,17 +97,22 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
         return np.max(min_r)  # Return maximum of array of minimum acceptable radiuses for each example
 
     
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using relief feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
         # Get number of instances with class that has minimum number of instances.
         _, instances_by_class = np.unique(target, return_counts=True)
@@ -110,13 +124,16 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
             warnings.warn("Parameter k was reduced to {0} because one of the classes " \
                     "does not have {1} instances associated with it.".format(min_instances, self.min_incl), Warning)
 
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run Iterative Relief feature selection algorithm.
-        if self.learned_metric_func != None:
+        if learned_metric_func != None:
             self.rank, self.weights = self._iterative_relief(data, target, self.m, min(min_instances-1, self.min_incl), 
-                    self.dist_func, self.max_iter, learned_metric_func=self.learned_metric_func(data, target))
+                    dist_func, self.max_iter, learned_metric_func=learned_metric_func(data, target))
         else:
             self.rank, self.weights = self._iterative_relief(data, target, self.m, min(min_instances-1, self.min_incl), 
-                    self.dist_func, self.max_iter)
+                    dist_func, self.max_iter)
 
         return self
 
@@ -137,18 +154,20 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -166,10 +185,12 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
             min_incl : int -- the minimum number of examples from same and other 
             classes that a hypersphere centered at each examples should contain.
 
-            dist_func : Callable[[Array[np.float64], Array[np.float64], Array[np.float64]], np.float64] -- 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64], Array[np.float64]], np.float64]] -- 
             distance function for evaluating distance between examples. 
             The function should be able to take two matrices of examples and return a vector of distances
             between the examples. The distance function should accept a weights parameter.
+            Can also be the name of a weighted metric from the metrics registry ('weighted_manhattan', 'weighted_euclidean',
+            'weighted_sqeuclidean', 'weighted_chebyshev' or 'weighted_hamming').
 
             max_iter : int -- Maximum number of iterations to compute
 
@@ -181,6 +202,9 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
         Author: Jernej Vivod
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func, weighted=True)
+
         # If operating in learned metric space:
         if 'learned_metric_func' in kwargs:
             # Get minimum acceptable radius using learned metric.
@@ -253,11 +277,11 @@ class IterativeRelief(BaseEstimator, TransformerMixin):
                 w_miss = np.maximum(0, 1 - (dist_other**2/min_r**2))
                 w_hit = np.maximum(0, 1 - (dist_same**2/min_r**2))
 
-                numerator1 = np.sum(np.abs(e - data_other) * w_miss[np.newaxis].T, 0)
-                denominator1 = np.sum(w_miss) + np.finfo(float).eps
+                numerator1 = np.sum(np.abs(e - data_other) * w_miss[np.newaxis].T, 0, dtype=np.float64)
+                denominator1 = np.sum(w_miss, dtype=np.float64) + np.finfo(float).eps
 
-                numerator2 = np.sum(np.abs(e - data_same) * w_hit[np.newaxis].T, 0)
-                denominator2 = np.sum(w_hit) + np.finfo(float).eps
+                numerator2 = np.sum(np.abs(e - data_same) * w_hit[np.newaxis].T, 0, dtype=np.float64)
+                denominator2 = np.sum(w_hit, dtype=np.float64) + np.finfo(float).eps
 
                 feature_weights += numerator1/denominator1 - numerator2/denominator2
                 # **********************************************
@@ -0,0 +1,46 @@
+function update_weights(data, e, groups, cls, n_classes, weights, max_f_vals, min_f_vals)
+
+	# Count examples in groups. Near neighbours of class c are in group c and far neighbours of
+	# class c are in group n_classes + c (groups are 0-based and examples in group -1 are skipped).
+	counts = zeros(Int64, 2*n_classes)
+	for i = 1:size(data, 1)
+		if groups[i] >= 0
+			counts[groups[i] + 1] += 1
+		end
+	end
+
+	# Compute sums of feature value differences to examples in each group in a single pass.
+	diff_sums = zeros(Float64, 2*n_classes, size(data, 2))
+	for t = 1:size(data, 2)
+		for i = 1:size(data, 1)
+			if groups[i] >= 0
+				diff_sums[groups[i] + 1, t] += abs(e[t] - data[i, t])
+			end
+		end
+	end
+
+	# Add update for near neighbours and subtract update for far neighbours.
+	f_range = max_f_vals .- min_f_vals .+ eps(Float64)
+	for (offset, sgn) in ((0, 1.0), (n_classes, -1.0))
+		same = offset + cls + 1
+		n_other = sum(counts[offset+1:offset+n_classes]) - counts[same]
+
+		# Penalty term
+		penalty = diff_sums[same, :]./f_range
+
+		# Reward term (differences to neighbours with different class weighted by probabilities of their classes)
+		reward = zeros(Float64, size(data, 2))
+		for c = offset+1:offset+n_classes
+			if c != same
+				reward .+= (counts[c]/max(n_other, 1)).*diff_sums[c, :]./f_range
+			end
+		end
+
+		# Weights update
+		weights = weights .- sgn.*penalty./(size(data, 1)*counts[same] + eps(Float64)) .+
+			sgn.*reward./(size(data, 1)*n_other + eps(Float64))
+	end
+
+	# Return updated weights.
+	return vec(weights)
+end
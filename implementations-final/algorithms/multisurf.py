@@ -4,13 +4,20 @@ from scipy.stats import rankdata
 from functools import partial
 from nptyping import Array
 from sklearn.metrics import pairwise_distances
+from scipy.spatial.distance import squareform
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import Metric, BLOCK_ELEMENTS, get_metric, pairwise_distance_matrix
+from algorithms.utils.distance_cache import DISTANCE_CACHE
+from algorithms.utils.condensed import condensed_index_distances
+from algorithms.utils.nearest_hit_miss import iter_blocks
 
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype, float_dtype
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs, scale_rows
 
 import os
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class MultiSURF(BaseEstimator, TransformerMixin):
@@ -23,34 +30,41 @@ class MultiSURF(BaseEstimator, TransformerMixin):
     author: Jernej Vivod
     """
 
-    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None, dtype=np.float64,
+            tile_size=None):
         self.n_features_to_select = n_features_to_select  # Number of features to select.
         self.dist_func = dist_func                        # distance function to use
         self.learned_metric_func = learned_metric_func    # learned metric function
+        self.dtype = dtype                                # floating point type used for computing distances and differences
+        self.tile_size = tile_size                        # number of rows of distance matrix computed at a time (None to compute the full matrix)
 
-        # Use function written in Julia programming language to update feature weights.
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_multisurf2.jl")
 
-
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using MultiSURF feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
        
+        # Convert data to floating point type used for computations and check that sparse data is used with a sparse metric.
+        data = as_compute_dtype(data, self.dtype)
+        check_sparse_input(data, dist_func, learned_metric_func)
+
         # Run MultiSURF feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._multiSURF(data, target, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._multiSURF(data, target, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._multiSURF(data, target, self.dist_func)
+            self.rank, self.weights = self._multiSURF(data, target, dist_func)
         return self
 
 
@@ -69,17 +83,19 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
-        self.fit(data, target)  # Fit data.
+        self.fit(data, target, distances)  # Fit data.
         return self.transform(data)  # Perform feature selection.
 
 
@@ -106,12 +122,11 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         """
 
         if mode == "index":
-            # Allocate matrix for distance matrix and compute distances.
-            dist_func_adapter = lambda x1, x2 : dist_func(np.int(np.where(np.sum(np.equal(x1, data), 1) == data.shape[1])[0][0]),
-                    np.int(np.where(np.sum(np.equal(x2, data), 1) == data.shape[1])[0][0]))
-            return pairwise_distances(data, metric=dist_func_adapter)
+            # Compute distances between all pairs of examples and expand them to distance matrix.
+            return squareform(condensed_index_distances(data.shape[0], dist_func, float_dtype(data)))
         elif mode == "example":
-           return pairwise_distances(data, metric=dist_func)
+            # Get distance matrix from distance cache shared by estimators (compute it if not cached).
+            return DISTANCE_CACHE.pairwise(data, dist_func, lambda: pairwise_distance_matrix(data, dist_func))
         else:
             raise ValueError("Unknown mode specifier")
 
@@ -129,9 +144,9 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         """
 
         # Get average distance to example with index ex_idx.
-        ex_avg_dist : np.float64 = np.mean(dist_mat[ex_idx, np.arange(dist_mat.shape[1]) != ex_idx])
+        ex_avg_dist : np.float64 = np.mean(dist_mat[ex_idx, np.arange(dist_mat.shape[1]) != ex_idx], dtype=np.float64)
         # Get half of standard deviation of distances to example with index ex_idx.
-        ex_d : np.float64 = np.std(dist_mat[ex_idx, np.arange(dist_mat.shape[1]) != ex_idx]) / 2.0
+        ex_d : np.float64 = np.std(dist_mat[ex_idx, np.arange(dist_mat.shape[1]) != ex_idx], dtype=np.float64) / 2.0
         # Get threshold for near neighbours - half a standard deviation away from mean.
         near_thresh : np.float64 = ex_avg_dist - ex_d
 
@@ -141,6 +156,82 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         return np.nonzero(msk_near)[0]
 
 
+    def _iter_distance_tiles(self, data, dist_func):
+        """
+        Compute tiles of rows of the pairwise distance matrix.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], np.float64]] -- metric or
+            function computing the distance between two examples
+
+        Returns:
+            Iterator[Tuple[Array[np.int], Array[np.float64]]] -- iterator over blocks of indices of examples and tiles of
+            distances from examples in blocks to all examples
+        """
+
+        for idx_block in iter_blocks(np.arange(data.shape[0]), self.tile_size):
+            if isinstance(dist_func, Metric):
+                yield idx_block, dist_func.pairwise(data[idx_block, :], data)
+            else:
+                yield idx_block, pairwise_distances(data[idx_block, :], data, metric=dist_func)
+
+
+    def _near_mask(self, dists, idx_block):
+        """
+        Find near neighbours of a block of examples. The thresholds of all examples in the block are
+        computed at once.
+
+        Args:
+            dists : Array[np.float64] -- tile of distances from examples in block to all examples
+            idx_block : Array[np.int] -- indices of examples in block
+
+        Returns:
+            Array[np.bool] -- mask of near neighbours with a row for each example in block
+        """
+
+        # Get distances to other examples.
+        rows = np.arange(idx_block.size)
+        msk_other = np.ones(dists.shape, dtype=bool)
+        msk_other[rows, idx_block] = False
+        dists_other = dists[msk_other].reshape(idx_block.size, dists.shape[1]-1)
+
+        # Get thresholds for near neighbours - half a standard deviation away from mean.
+        near_thresh = np.mean(dists_other, 1, dtype=np.float64) - np.std(dists_other, 1, dtype=np.float64)/2.0
+
+        # Get mask of examples that are considered near neighbours.
+        msk_near = dists < near_thresh[np.newaxis].T
+        msk_near[rows, idx_block] = False
+        return msk_near
+
+
+    def _neighbours_csr(self, target, dist_tiles):
+        """
+        Find near neighbours of all examples and store them in compressed sparse row format. The neighbours
+        of example i are indices[offsets[i]:offsets[i+1]]. Bit j of the packed hit mask is set if the j-th
+        neighbour in indices has the same class as the example.
+
+        Args:
+            target : Array[np.int] -- vector of target values of examples
+            dist_tiles : Iterator[Tuple[Array[np.int], Array[np.float64]]] -- iterator over blocks of indices of
+            examples and tiles of distances from examples in blocks to all examples
+
+        Returns:
+            Array[np.int64], Array[np.int32], Array[np.uint8] -- offsets of examples' neighbours, indices of neighbours,
+            packed hit mask
+        """
+
+        counts = np.zeros(target.size + 1, dtype=np.int64)
+        indices = []
+        hit_mask = []
+        for idx_block, dists in dist_tiles:
+            rows, cols = np.nonzero(self._near_mask(dists, idx_block))
+            counts[idx_block + 1] = np.bincount(rows, minlength=idx_block.size)
+            indices.append(cols.astype(np.int32))
+            hit_mask.append(target[cols] == target[idx_block[rows]])
+        return np.cumsum(counts), np.concatenate(indices), np.packbits(np.concatenate(hit_mask))
+
+
     def _multiSURF(self, data, target, dist_func, **kwargs):
 
         """Compute feature scores using multiSURF algorithm
@@ -148,8 +239,10 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -159,17 +252,30 @@ class MultiSURF(BaseEstimator, TransformerMixin):
 
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
 
-        # Compute weighted pairwise distances.
+
+        # Compute weighted pairwise distances and get iterator over tiles of distance matrix. If the full
+        # matrix is computed, it is split into tiles.
         if 'learned_metric_func' in kwargs:
             dist_func_learned = partial(kwargs['learned_metric_func'], dist_func)
             pairwise_dist = self._get_pairwise_distances(data, dist_func_learned, mode="index")
-        else:
+        elif self.tile_size is None:
             pairwise_dist = self._get_pairwise_distances(data, dist_func, mode="example")
+        else:
+            pairwise_dist = None
+        if pairwise_dist is None:
+            dist_tiles = self._iter_distance_tiles(data, dist_func)
+        else:
+            dist_tiles = ((idx_block, pairwise_dist[idx_block, :]) for idx_block in
+                    iter_blocks(np.arange(data.shape[0]), max(1, BLOCK_ELEMENTS//data.shape[0])))
+
+        # Find near neighbours of examples and whether they represent hits or misses.
+        offsets, indices, hit_mask = self._neighbours_csr(target, dist_tiles)
 
         # Get maximum and minimum values of each feature.
-        max_f_vals = np.amax(data, 0)
-        min_f_vals = np.amin(data, 0)
+        max_f_vals, min_f_vals = max_min(data)
 
         # Get all unique classes.
         classes = np.unique(target)
@@ -178,43 +284,56 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         p_classes = (np.vstack(np.unique(target, return_counts=True)).T).astype(np.float)
         p_classes[:, 1] = p_classes[:, 1]/np.sum(p_classes[:, 1])
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
 
-        # Compute hits ans misses for each examples (within radius).
-        # first row represents the indices of neighbors within threshold and the second row
-        # indicates whether an examples is a hit or a miss.
-        neighbours_map = dict.fromkeys(np.arange(data.shape[0]))
+        # Go over neighbours of examples and update weights.
         for ex_idx in np.arange(data.shape[0]):
-            r1 = self._critical_neighbours(ex_idx, pairwise_dist)  # Compute indices of neighbours.
-            r2 = target[r1] == target[ex_idx]  # Compute whether neighbour represents a hit or miss.
-            neighbours_map[ex_idx] = np.vstack((r1, r2)) # Add info about neighbours to dictionary. First row represents neighbour indices.
-                                                         # Second row represents whether neighbour is a hit or miss (logical 0 or 1).
 
-        # Go over all hits and misses and update weights.
-        for ex_idx, neigh_data in neighbours_map.items():
+            # Get indices of neighbours and unpack mask of hits.
+            start, stop = offsets[ex_idx], offsets[ex_idx+1]
+            neigh_idx = indices[start:stop]
+            neigh_hit = np.unpackbits(hit_mask[start//8:(stop+7)//8])[start % 8:start % 8 + stop - start].astype(bool)
 
             # Get probabilities of classes not equal to class of sampled example.
             p_classes_other = p_classes[p_classes[:, 0] != target[ex_idx], :]
             p_weights = p_classes_other[:, 1]/(1 - p_classes[p_classes[:, 0] == target[ex_idx], 1])
 
             # Get classes of miss neighbours.
-            classes_other = (target[neigh_data[0]])[np.logical_not(neigh_data[1])]
+            classes_other = target[neigh_idx[np.logical_not(neigh_hit)]]
             
             # Compute probability weights for misses in considered regions.            
-            weights_mult = np.empty(classes_other.size, dtype=np.float)
+            weights_mult = np.empty(classes_other.size, dtype=data.dtype)
             u, c = np.unique(classes_other, return_counts=True)
             neighbour_weights = c/classes_other.size
             for i, val in enumerate(u):
                 weights_mult[np.where(classes_other == val)] = neighbour_weights[i]
 
             # Update weights.
-            weights = self._update_weights(data, data[ex_idx, :][np.newaxis], (data[neigh_data[0, :], :])[neigh_data[1, :], :],
-                    (data[neigh_data[0, :], :])[np.logical_not(neigh_data[1, :]), :], weights[np.newaxis], 
-                    weights_mult[np.newaxis].T, max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+            self._update_weights(accumulator, data[ex_idx, :], data[neigh_idx[neigh_hit], :],
+                    data[neigh_idx[np.logical_not(neigh_hit)], :], weights_mult, data.shape[0])
+
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
 
         # Rank weights and return.
         # Create array of feature enumerations based on score.
         rank = rankdata(-weights, method='ordinal')
         return rank, weights
 
+
+    def _update_weights(self, accumulator, e, closest_same, closest_other, weights_mult, n):
+
+        """Add feature weights update for example to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- example
+            closest_same : Array[np.float64] -- matrix of neighbours with same class
+            closest_other : Array[np.float64] -- matrix of neighbours with different class
+            weights_mult : Array[np.float64] -- probability weights of neighbours with different class
+            n : int -- number of examples in training set
+        """
+        accumulator.add_penalty(abs_diffs(e, closest_same), 1.0/(n*closest_same.shape[0] + np.finfo(np.float64).eps))
+        accumulator.add_reward(scale_rows(abs_diffs(e, closest_other), weights_mult), 
+                1.0/(n*closest_other.shape[0] + np.finfo(np.float64).eps))
@@ -5,7 +5,12 @@ from sklearn.metrics import pairwise_distances
 import os
 import sys
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import get_metric, pairwise_distance_matrix
+from algorithms.utils.distance_cache import DISTANCE_CACHE
+from algorithms.utils.condensed import condensed_index_distances
+from scipy.spatial.distance import squareform
 from julia import Julia
+from algorithms.utils.precomputed import resolve_precomputed
 jl = Julia(compiled_modules=False)
 
 class MultiSURF(BaseEstimator, TransformerMixin):
@@ -30,7 +35,7 @@ class MultiSURF(BaseEstimator, TransformerMixin):
 
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using MultiSURF feature selection algorithm
@@ -38,16 +43,21 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
         # Run MultiSURF feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._multisurf(data, target, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._multisurf(data, target, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._multisurf(data, target, self.dist_func)
+            self.rank, self.weights = self._multisurf(data, target, dist_func)
 
         return self
 
@@ -69,19 +79,21 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -109,12 +121,11 @@ class MultiSURF(BaseEstimator, TransformerMixin):
 
         # If computing distances between examples by referencing them by indices.
         if mode == "index":
-            # Allocate matrix for distance matrix and compute distances.
-            dist_func_adapter = lambda x1, x2 : dist_func(np.int(np.where(np.sum(np.equal(x1, data), 1) == data.shape[1])[0][0]),
-                    np.int(np.where(np.sum(np.equal(x2, data), 1) == data.shape[1])[0][0]))
-            return pairwise_distances(data, metric=dist_func_adapter)
+            # Compute distances between all pairs of examples and expand them to distance matrix.
+            return squareform(condensed_index_distances(data.shape[0], dist_func))
         elif mode == "example":  # Else if passing in examples...
-            return pairwise_distances(data, metric=dist_func)
+            # Get distance matrix from distance cache shared by estimators (compute it if not cached).
+            return DISTANCE_CACHE.pairwise(data, dist_func, lambda: pairwise_distance_matrix(data, dist_func))
         else:
             raise ValueError("Unknown mode specifier")
 
@@ -126,8 +137,10 @@ class MultiSURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows 
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -137,6 +150,9 @@ class MultiSURF(BaseEstimator, TransformerMixin):
 
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
+
         # Initialize feature weights.
         weights = np.zeros(data.shape[1], dtype=np.float)
 
@@ -5,6 +5,12 @@ from nptyping import Array
 from sklearn.metrics import pairwise_distances
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import Metric, get_metric
+from algorithms.utils.distance_cache import iter_distance_rows
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.packed import PackedGenotypes
+from algorithms.utils.class_diff_sums import ClassDiffSums
+from algorithms.utils.precomputed import resolve_precomputed
 
 class MultiSURFStar(BaseEstimator, TransformerMixin):
 
@@ -17,29 +23,41 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
 
     """
 
-    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2: np.sum(np.logical_xor(x1, x2), 1), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2: np.sum(np.logical_xor(x1, x2), 1), learned_metric_func=None,
+            dtype=np.float64, packed=None, max_sums_bytes=2**28):
         self.n_features_to_select = n_features_to_select  # Number of features to select.
         self.dist_func = dist_func                        # Distance function to use.
         self.learned_metric_func = learned_metric_func    # learned metric function.
+        self.dtype = dtype                                # floating point type used for computing distances.
+        self.packed = packed                              # use packed representation of discrete features (None to use it if possible).
+        self.max_sums_bytes = max_sums_bytes              # maximal number of bytes of numbers of differences to all examples of each class (0 to enumerate all neighbours)
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using MultiSURFStar feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run MultiSURFStar feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._multisurfstar(data, target, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._multisurfstar(data, target, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._multisurfstar(data, target, self.dist_func)
+            self.rank, self.weights = self._multisurfstar(data, target, dist_func)
 
         return self
 
@@ -59,18 +77,20 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)
+        self.fit(data, target, distances)
         return self.transform(data)
 
 
@@ -81,8 +101,10 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -92,8 +114,29 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
 
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
+
         # Initialize weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
+        weights = np.zeros(data.shape[1], dtype=np.float64)
+
+        # Store discrete features in packed representation if using hamming distances.
+        if self._use_packed(data, dist_func, 'learned_metric_func' in kwargs):
+            genotypes = PackedGenotypes(data)
+        else:
+            genotypes = None
+
+        # If numbers of examples of each class with different feature values fit in the memory budget, the numbers for
+        # the most numerous of close, far and remaining examples are computed from the numbers for all examples.
+        classes, class_idx = np.unique(target, return_inverse=True)
+        if ClassDiffSums.nbytes(data, classes.size) <= self.max_sums_bytes:
+            class_diff_sums = ClassDiffSums(data, class_idx, classes.size)
+        else:
+            class_diff_sums = None
+
+        # Get iterator over rows of distance matrix (read from distance cache shared by estimators if cached).
+        if 'learned_metric_func' not in kwargs and genotypes is None:
+            dist_rows = iter_distance_rows(data, dist_func)
 
         for idx in np.arange(data.shape[0]):
 
@@ -105,12 +148,14 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
             if 'learned_metric_func' in kwargs:
                 dist_func_learned = partial(kwargs['learned_metric_func'], dist_func)
                 dists = np.array([dist_func_learned(idx, idx_other) for idx_other in np.arange(data.shape[0])])
+            elif genotypes is not None:
+                dists = genotypes.distances(idx)
             else:
-                dists = dist_func(data[idx, :], data)
+                dists = next(dist_rows)
 
             # Compute mean and standard deviation of distances and set thresholds.
-            t_next = np.mean(dists[np.arange(data.shape[0] != idx)])
-            sigma_nxt = np.std(dists[np.arange(data.shape[0]) != idx])
+            t_next = np.mean(dists[np.arange(data.shape[0]) != idx], dtype=np.float64)
+            sigma_nxt = np.std(dists[np.arange(data.shape[0]) != idx], dtype=np.float64)
             thresh_near = t_next - sigma_nxt/2.0
             thresh_far = t_next + sigma_nxt/2.0
 
@@ -123,41 +168,53 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
             msk_far = dists > thresh_far
             msk_far[idx] = False
 
-
-            # Get examples that are close.
-            examples_close = data[msk_close, :]
-            target_close = target[msk_close]
-            
-            # Get examples that are far.
-            examples_far = data[msk_far, :]
-            target_far = target[msk_far]
-
-            # Get considered features of close examples.
-            features_close = e != examples_close
-            # Get considered features of far examples.
-            features_far = e == examples_far 
-
-            # Get mask for close examples with same class.
-            msk_same_close = target_close == target_e
-
-            # Get mask for far examples with same class.
-            msk_same_far = target_far == target_e
+            # Get masks of close and far examples with same class and with different class.
+            msk_same_close = np.logical_and(msk_close, target == target_e)
+            msk_same_far = np.logical_and(msk_far, target == target_e)
+            msk_other_close = np.logical_and(msk_close, target != target_e)
+            msk_other_far = np.logical_and(msk_far, target != target_e)
 
 
             ### WEIGHTS UPDATE ###
 
-            # Get penalty weights update values for close examples. 
-            wu_close_penalty = np.sum(features_close[msk_same_close, :], 0)
-            # Get reward weights update values for close examples. 
-            wu_close_reward = np.sum(features_close[np.logical_not(msk_same_close), :], 0)
+            if class_diff_sums is not None:
+
+                # Count examples with different feature values in bands of close (0), remaining (1) and far (2) examples by class.
+                bands = np.where(msk_close, 0, np.where(msk_far, 2, 1))
+                bands[idx] = -1
+                diff_counts, counts = class_diff_sums.band_sums(idx, bands, 3, partial(self._diff_counts, data, genotypes, idx), counts=True, unused=1)
+
+                # Sum counts for class of example and for other classes. Far examples with equal feature values are counted
+                # as complements of counts of differing values.
+                diff_same = diff_counts[class_idx[idx]::classes.size]
+                diff_other = np.sum(diff_counts.reshape(3, classes.size, -1), 1) - diff_same
+                wu_close_penalty = diff_same[0]
+                wu_close_reward = diff_other[0]
+                wu_far_penalty = np.sum(msk_same_far) - diff_same[2]
+                wu_far_reward = np.sum(msk_other_far) - diff_other[2]
+            elif genotypes is not None:
+
+                # Count close examples with different feature values from packed masks of differing features.
+                wu_close_penalty = genotypes.diff_counts(idx, np.flatnonzero(msk_same_close))
+                wu_close_reward = genotypes.diff_counts(idx, np.flatnonzero(msk_other_close))
+
+                # Count far examples with equal feature values as complements of counts of differing values.
+                wu_far_penalty = np.sum(msk_same_far) - genotypes.diff_counts(idx, np.flatnonzero(msk_same_far))
+                wu_far_reward = np.sum(msk_other_far) - genotypes.diff_counts(idx, np.flatnonzero(msk_other_far))
+            else:
+
+                # Get penalty weights update values for close examples. 
+                wu_close_penalty = np.sum(e != data[msk_same_close, :], 0)
+                # Get reward weights update values for close examples. 
+                wu_close_reward = np.sum(e != data[msk_other_close, :], 0)
 
-            # Get penalty weights update values for far examples.
-            wu_far_penalty = np.sum(features_far[msk_same_far, :], 0)
-            # Get reward weights update values for close examples. 
-            wu_far_reward = np.sum(features_far[np.logical_not(msk_same_far), :], 0)
+                # Get penalty weights update values for far examples.
+                wu_far_penalty = np.sum(e == data[msk_same_far, :], 0)
+                # Get reward weights update values for far examples. 
+                wu_far_reward = np.sum(e == data[msk_other_far, :], 0)
 
             # Update weights.
-            weights = weights - (wu_close_penalty + wu_far_penalty) + (wu_close_reward + wu_close_reward)
+            weights = weights - (wu_close_penalty + wu_far_penalty) + (wu_close_reward + wu_far_reward)
 
             ### /WEIGHTS UPDATE ###
 
@@ -165,3 +222,52 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         rank = rankdata(-weights, method='ordinal')
         return rank, weights
 
+
+
+    def _diff_counts(self, data, genotypes, idx, rows, groups, n_groups):
+
+        """Count examples in each group that differ from example in each feature
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            genotypes : Union[PackedGenotypes, None] -- discrete features in packed representation (None if not used)
+            idx : int -- index of example
+            rows : Array[np.int] -- indices of compared examples
+            groups : Array[np.int] -- group of each compared example
+            n_groups : int -- number of groups
+
+        Returns:
+            Array[np.int64], Array[np.int] -- matrix of counts with a row for each group, number of examples in each group
+        """
+        diff_counts = np.empty((n_groups, data.shape[1]), dtype=np.int64)
+        for group in np.arange(n_groups):
+            if genotypes is not None:
+                diff_counts[group] = genotypes.diff_counts(idx, rows[groups == group])
+            else:
+                diff_counts[group] = np.sum(data[idx, :] != data[rows[groups == group], :], 0)
+        return diff_counts, np.bincount(groups, minlength=n_groups)
+
+
+    def _use_packed(self, data, dist_func, learned_metric):
+
+        """Check if discrete features are stored in packed representation
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            learned_metric : bool -- True if distances are computed in a learned metric space
+
+        Returns:
+            bool -- True if the packed representation is used and False otherwise
+
+        Raises:
+            ValueError : if the packed representation is requested but cannot be used
+        """
+        if self.packed is False:
+            return False
+        usable = not learned_metric and isinstance(dist_func, Metric) and dist_func.name == 'hamming'
+        if self.packed is None:
+            return usable and PackedGenotypes.can_pack(data)
+        if not usable:
+            raise ValueError('Packed representation requires the hamming metric and cannot be used with a learned metric function')
+        return True
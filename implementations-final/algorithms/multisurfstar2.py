@@ -5,7 +5,10 @@ from functools import partial
 from nptyping import Array
 from sklearn.metrics import pairwise_distances
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.distance_cache import iter_distance_rows
 from julia import Julia
+from algorithms.utils.precomputed import resolve_precomputed
 jl = Julia(compiled_modules=False)
 
 
@@ -30,23 +33,28 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_multisurfstar2.jl")
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using MultiSURFStar feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
         # Run MultiSURFStar feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._multisurfstar(data, target, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._multisurfstar(data, target, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._multisurfstar(data, target, self.dist_func)
+            self.rank, self.weights = self._multisurfstar(data, target, dist_func)
 
         return self
 
@@ -66,18 +74,20 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)
+        self.fit(data, target, distances)
         return self.transform(data)
 
 
@@ -88,8 +98,10 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -99,6 +111,9 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
 
         """
 
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
+
         # Initialize weights.
         weights = np.zeros(data.shape[1], dtype=np.float)
         
@@ -106,6 +121,10 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
         max_f_vals = np.max(data, 0)
         min_f_vals = np.min(data, 0)
 
+        # Get iterator over rows of distance matrix (read from distance cache shared by estimators if cached).
+        if 'learned_metric_func' not in kwargs:
+            dist_rows = iter_distance_rows(data, dist_func)
+
         for idx in np.arange(data.shape[0]):
 
             # Get next example
@@ -117,7 +136,7 @@ class MultiSURFStar(BaseEstimator, TransformerMixin):
                 dist_func_learned = partial(kwargs['learned_metric_func'], dist_func)
                 dists = np.array([dist_func_learned(idx, idx_other) for idx_other in np.arange(data.shape[0])])
             else:
-                dists = dist_func(data[idx, :], data)
+                dists = next(dist_rows)
 
 
             # Compute mean and standard deviation of distances and set thresholds.
@@ -1,11 +1,20 @@
 import numpy as np
+import scipy.sparse as sp
 from scipy.stats import rankdata
 from functools import partial
 from sklearn.base import BaseEstimator, TransformerMixin
 import numba as nb
 import os
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.nearest_hit_miss import nearest_hit_miss, nearest_hit_miss_neighbours
+from algorithms.utils.parallel import accumulate_shards
+from algorithms.utils.incremental import ReferenceSet
+from algorithms.utils.class_partition import ClassPartition
+from algorithms.utils.neighbours import get_neighbours, measure_recall, measure_pruning_rate
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class Relief(BaseEstimator, TransformerMixin):
@@ -20,22 +29,21 @@ class Relief(BaseEstimator, TransformerMixin):
     """
 
     # Constructor: initialize learner
-    def __init__(self, n_features_to_select=10, m=-1, dist_func=lambda x1, x2: np.sum(np.abs(x1 - x2), 1), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, m=-1, dist_func=lambda x1, x2: np.sum(np.abs(x1 - x2), 1), learned_metric_func=None,
+            block_size=256, neighbour_backend='brute', neighbour_params=None, n_jobs=1, reference_size=None, dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.m = m                                        # number of examples to sample
         self.dist_func = dist_func  # distance function to use when searching for nearest neighbours
         self.learned_metric_func = learned_metric_func  # learned metric function (is set to None if not using metric learning)
+        self.block_size = block_size  # number of sampled examples for which nearest hits and misses are found at once
+        self.neighbour_backend = neighbour_backend  # nearest neighbours search backend ('brute', 'tree', 'approximate', 'early_abandon', 'pivot' or 'quantised')
+        self.neighbour_params = neighbour_params  # additional parameters of nearest neighbours search
+        self.n_jobs = n_jobs  # number of worker processes (-1 to use all processors)
+        self.reference_size = reference_size  # maximal number of examples stored for partial_fit (None for no limit)
+        self.dtype = dtype  # floating point type used for computing distances and differences (np.float32 or np.float64)
 
-        # Use function written in the Julia programming language to update weights.
 
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_relief2.jl")
-
-        import pdb
-        pdb.set_trace()
-
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using relief feature selection algorithm
@@ -43,21 +51,102 @@ class Relief(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
+        # Convert data to floating point type used for computations and check that sparse data is used with a sparse metric.
+        data = as_compute_dtype(data, self.dtype)
+        check_sparse_input(data, dist_func, learned_metric_func)
+
         # Run Relief feature selection algorithm.
-        if self.learned_metric_func != None:
-           self.rank, self.weights = self._relief(data, target, self.m, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))            
+        if learned_metric_func != None:
+           self.rank, self.weights = self._relief(data, target, self.m, dist_func, learned_metric_func=learned_metric_func(data, target))            
         else:
-           self.rank, self.weights = self._relief(data, target, self.m, self.dist_func)
+           self.rank, self.weights = self._relief(data, target, self.m, dist_func)
 
         # Return reference to self
         return self
 
 
+    def partial_fit(self, data, target):
+
+        """
+        Update feature weights with a batch of new examples. The nearest hits and misses of the new examples
+        are searched for among the stored reference examples and the examples in the batch. Feature value
+        ranges and unnormalized penalties and rewards are accumulated over all batches.
+
+        Args:
+            data : Array[np.float64] -- matrix of new examples
+            target : Array[np.int] -- vector of target values of new examples
+
+        Returns:
+            self
+
+        Raises:
+            ValueError : if a learned metric function is used or if data is sparse
+        """
+
+        # Learned metric functions are defined on a fixed training set.
+        if self.learned_metric_func is not None:
+            raise ValueError('Incremental weight updates cannot be used with a learned metric function')
+        if sp.issparse(data):
+            raise ValueError('Incremental weight updates cannot be used with sparse data')
+
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
+        # Initialize accumulator and reference set or extend feature value ranges.
+        if getattr(self, '_accumulator', None) is None:
+            self._accumulator = WeightAccumulator(np.amax(data, 0), np.amin(data, 0))
+            self._reference = ReferenceSet(self.reference_size)
+            self._n_updates = 0
+        else:
+            self._accumulator.update_ranges(np.amax(data, 0), np.amin(data, 0))
+
+        # Combine reference examples with batch and get indices of examples in batch.
+        n_ref = len(self._reference)
+        data_all = data if n_ref == 0 else np.vstack((self._reference.data, data))
+        target_all = target if n_ref == 0 else np.hstack((self._reference.target, target))
+        idx_batch = np.arange(n_ref, target_all.size)
+
+        # If there are examples from at least two classes, add weights updates for examples in batch.
+        if np.unique(target_all).size > 1:
+
+            # Initialize search for nearest neighbours from each class if not using brute force search. The quantised
+            # search reads examples from the data matrix so only the indices of examples are grouped by class.
+            if self.neighbour_backend != 'brute':
+                partition = ClassPartition(None if self.neighbour_backend == 'quantised' else data_all, target_all)
+                neighbours = get_neighbours(self.neighbour_backend, partition, self.dist_func, self.neighbour_params, data=data_all)
+            dist_func = get_metric(self.dist_func)
+
+            # Define computation of weights updates for a block of examples in batch.
+            def process_block(idx_block, accumulator):
+                if self.neighbour_backend != 'brute':
+                    idx_hit, idx_miss = nearest_hit_miss_neighbours(neighbours, idx_block)
+                else:
+                    idx_hit, idx_miss = nearest_hit_miss(data_all, target_all, idx_block, dist_func)
+                self._update_weights(accumulator, data_all[idx_block, :], data_all[idx_hit, :], data_all[idx_miss, :], 1)
+
+            # Add weights updates for blocks of examples in batch.
+            accumulate_shards(process_block, idx_batch, self.block_size, self._accumulator, self.n_jobs)
+            self._n_updates += idx_batch.size
+
+        # Add batch to reference set.
+        self._reference.add(data, target)
+
+        # Compute feature weights and rankings.
+        self.weights = self._accumulator.weights()/max(self._n_updates, 1)
+        self.rank = rankdata(-self.weights, method='ordinal')
+        return self
+
+
     def transform(self, data):
 
         """
@@ -75,19 +164,21 @@ class Relief(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -99,9 +190,10 @@ class Relief(BaseEstimator, TransformerMixin):
             data : Array[np.float64] -- matrix containing examples' data as rows
             target: Array[np.int] -- Matrix containing the examples' class values
             m : int --  Sample size to use when evaluating the feature scores
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should accept two examples or two matrices of examples and return
-            the distance between them.
+            the distance between them. Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean',
+            'sqeuclidean', 'chebyshev' or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -110,12 +202,11 @@ class Relief(BaseEstimator, TransformerMixin):
              Array[np.int], Array[np.float64] -- Array of feature enumerations based on the scores, array of feature scores
         """
 
-        # Initialize all weights to zero.
-        weights = np.zeros(data.shape[1], dtype=np.float)
-
         # Get maximum and minimum values of each feature
-        max_f_vals = np.amax(data, axis=0)
-        min_f_vals = np.amin(data, axis=0)
+        max_f_vals, min_f_vals = max_min(data)
+
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
 
         # Sample m examples without replacement.
         sample_idxs = np.random.choice(np.arange(data.shape[0]), data.shape[0] if m == -1 else m, replace=False)
@@ -124,38 +215,63 @@ class Relief(BaseEstimator, TransformerMixin):
         m = data.shape[0] if m == -1 else m
 
 
-        # Evaluate features using a sample of m examples.
-        for idx in sample_idxs:
-            e = data[idx, :]  # Get sampled example data.
-            msk = np.array(list(map(lambda x: True if x == target[idx] else False, target)))  # Get mask for examples with same class.
-
-            # Get index of sampled example in subset of examples with same class.
-            idx_subset = idx - np.sum(~msk[:idx+1])
-
-            # Find nearest hit and nearest miss.
-            if 'learned_metric_func' in kwargs:  # If operating in learned metric space.
-                dist = partial(kwargs['learned_metric_func'], dist_func, idx)
-                d_same = dist(np.where(msk)[0])
-                d_same[idx_subset] = np.inf     # Set distance of sampled example to itself to infinity.
-                d_other = dist(np.where(~msk)[0])
-                closest_same = data[msk, :][d_same.argmin(), :]
-                closest_other = data[~msk, :][d_other.argmin(), :]
+        # If not using brute force search, initialize search for nearest neighbours from each class. The quantised
+        # search reads examples from the data matrix so only the indices of examples are grouped by class.
+        if self.neighbour_backend != 'brute':
+            partition = ClassPartition(None if self.neighbour_backend == 'quantised' else data, target)
+            neighbours = get_neighbours(self.neighbour_backend, partition, dist_func, self.neighbour_params, data=data, **kwargs)
+        else:
+            neighbours = None
+            dist_func = get_metric(dist_func)
+
+        # Define computation of weights updates for a block of sampled examples' indices. Nearest hits and
+        # misses are found for blocks of sampled examples at once to bound the size of the distance matrix.
+        def process_block(idx_block, accumulator):
+
+            # Find nearest hits and nearest misses of examples in block.
+            if neighbours is not None:           # If using nearest neighbours search.
+                idx_hit, idx_miss = nearest_hit_miss_neighbours(neighbours, idx_block)
+            elif 'learned_metric_func' in kwargs:  # If operating in learned metric space.
+                idx_hit, idx_miss = nearest_hit_miss(data, target, idx_block, dist_func,
+                        learned_metric_func=kwargs['learned_metric_func'])
             else:                                # Else
-                dist = partial(dist_func, e)  # Curry distance function with chosen example data vector.
-                d_same = dist(data[msk, :]) 
-                d_same[idx_subset] = np.inf  # Set distance of sampled example to itself to infinity.
-                d_other = dist(data[~msk, :])
-                closest_same = data[msk, :][d_same.argmin(), :]
-                closest_other = data[~msk, :][d_other.argmin(), :]
+                idx_hit, idx_miss = nearest_hit_miss(data, target, idx_block, dist_func)
 
             # ------ weights update ------
-            weights = self._update_weights(data, e, closest_same, closest_other, weights, m, max_f_vals, min_f_vals)
+            self._update_weights(accumulator, data[idx_block, :], data[idx_hit, :], data[idx_miss, :], m)
+
+        # Evaluate features using a sample of m examples (in worker processes if n_jobs > 1).
+        accumulate_shards(process_block, sample_idxs, self.block_size, accumulator, self.n_jobs, getattr(neighbours, 'counts', None))
 
 
+        # Measure recall of nearest neighbours search.
+        self.neighbour_recall = measure_recall(neighbours, sample_idxs, 1) if neighbours is not None else 1.0
+
+        # Get fraction of distance computations skipped by the nearest neighbours search while finding the neighbours.
+        self.neighbour_pruning_rate = measure_pruning_rate(neighbours)
+
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
+
         # Return feature rankings and weights.
         return rankdata(-weights, method='ordinal'), weights
 
 
+    def _update_weights(self, accumulator, e, closest_same, closest_other, m):
+
+        """Add feature weights updates for sampled examples to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- sampled example or matrix of sampled examples
+            closest_same : Array[np.float64] -- nearest hit or matrix of nearest hits of sampled examples
+            closest_other : Array[np.float64] -- nearest miss or matrix of nearest misses of sampled examples
+            m : int -- Sample size used when evaluating the feature scores
+        """
+        accumulator.add_penalty(abs_diffs(e, closest_same), 1.0/m)
+        accumulator.add_reward(abs_diffs(e, closest_other), 1.0/m)
+
+
 if __name__ == '__main__':
     import scipy.io as sio
     data = sio.loadmat('data.mat')['data']
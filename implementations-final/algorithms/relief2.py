@@ -2,6 +2,7 @@ import numpy as np
 from scipy.stats import rankdata
 from functools import partial
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.metrics import get_metric
 import numba as nb
 import os
 from julia import Julia
@@ -41,8 +42,8 @@ class Relief(BaseEstimator, TransformerMixin):
             self
         """
         
-        # Compute feature weights and rank.
-        self.weights = self._relief(data, target, self.m, self.dist_func)
+        # Compute feature weights and rank (metrics specified by name are resolved from the registry).
+        self.weights = self._relief(data, target, self.m, get_metric(self.dist_func))
         self.rank = rankdata(-self.weights, method='ordinal')
 
         # Return reference to self
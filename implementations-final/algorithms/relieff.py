@@ -1,13 +1,21 @@
 import numpy as np
+import scipy.sparse as sp
 import numba as nb
 from scipy.stats import rankdata
-from functools import partial
 import os
 import sys
 import warnings
 from sklearn.base import BaseEstimator, TransformerMixin
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.class_partition import ClassPartition
+from algorithms.utils.neighbours import get_neighbours, measure_recall, measure_pruning_rate
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.out_of_core import open_data, is_out_of_core, streaming_min_max, ChunkedNeighbours
+from algorithms.utils.parallel import accumulate_shards
+from algorithms.utils.incremental import ReferenceSet
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs, scale_rows, vstack_rows
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class Relieff(BaseEstimator, TransformerMixin):
@@ -20,30 +28,47 @@ class Relieff(BaseEstimator, TransformerMixin):
     Author: Jernej Vivod
     """
    
-    def __init__(self, n_features_to_select=10, m=-1, k=5, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, m=-1, k=5, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None,
+            neighbour_backend='brute', neighbour_params=None, block_size=256, n_jobs=1, chunk_size=4096, reference_size=None,
+            dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.m = m                                        # example sample size
         self.k = k                                        # the k parameter
         self.dist_func = dist_func                        # distance function
         self.learned_metric_func = learned_metric_func    # learned distance function
+        self.neighbour_backend = neighbour_backend        # nearest neighbours search backend ('brute', 'tree', 'approximate', 'early_abandon', 'pivot' or 'quantised')
+        self.neighbour_params = neighbour_params          # additional parameters of nearest neighbours search
+        self.block_size = block_size                      # number of sampled examples processed together
+        self.n_jobs = n_jobs                              # number of worker processes (-1 to use all processors)
+        self.chunk_size = chunk_size                      # number of rows read at once when processing data out of core
+        self.reference_size = reference_size              # maximal number of examples stored for partial_fit (None for no limit)
+        self.dtype = dtype                                # floating point type used for computing distances and differences
 
-        # Use function written in Julia programming language to update feature weights.
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_relieff2.jl")
 
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
-        Rank features using ReliefF feature selection algorithm
+        Rank features using ReliefF feature selection algorithm. If data is a memory-mapped array or
+        a path to a file (a .npy file or a raw matrix of np.float64 values), it is processed out of core.
 
         Args:
-            data : Array[np.float64] -- matrix of examples
+            data : Union[str, Array[np.float64]] -- matrix of examples or path to file containing the matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
-        
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
+        # If data is stored in a file, open it as memory-mapped array. Else convert it to floating point type used for computations.
+        data = open_data(data, len(target))
+        if not is_out_of_core(data):
+            data = as_compute_dtype(data, self.dtype)
+        check_sparse_input(data, dist_func, learned_metric_func)
+
         # Get number of instances with class that has minimum number of instances.
         _, instances_by_class = np.unique(target, return_counts=True)
         min_instances = np.min(instances_by_class)
@@ -55,12 +80,71 @@ class Relieff(BaseEstimator, TransformerMixin):
                     "does not have {1} instances associated with it.".format(min_instances, self.k), Warning)
 
         # Run ReliefF feature selection algorithm.
-        if self.learned_metric_func != None:
+        if learned_metric_func != None:
             self.rank, self.weights = self._relieff(data, target, self.m, min(self.k, min_instances), 
-                    self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+                    dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
             self.rank, self.weights = self._relieff(data, target, self.m, min(self.k, min_instances), 
-                    self.dist_func)
+                    dist_func)
+        return self
+
+
+    def partial_fit(self, data, target):
+        """
+        Update feature weights with a batch of new examples. The nearest neighbours of the new examples
+        are searched for among the stored reference examples and the examples in the batch. Feature value
+        ranges and unnormalized penalties and rewards are accumulated over all batches.
+
+        Args:
+            data : Array[np.float64] -- matrix of new examples
+            target : Array[np.int] -- vector of target values of new examples
+
+        Returns:
+            self
+
+        Raises:
+            ValueError : if a learned metric function is used or if data is sparse
+        """
+
+        # Learned metric functions are defined on a fixed training set.
+        if self.learned_metric_func is not None:
+            raise ValueError('Incremental weight updates cannot be used with a learned metric function')
+        if sp.issparse(data):
+            raise ValueError('Incremental weight updates cannot be used with sparse data')
+
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
+        # Initialize accumulator and reference set or extend feature value ranges.
+        if getattr(self, '_accumulator', None) is None:
+            self._accumulator = WeightAccumulator(np.amax(data, 0), np.amin(data, 0))
+            self._reference = ReferenceSet(self.reference_size)
+            self._n_updates = 0
+        else:
+            self._accumulator.update_ranges(np.amax(data, 0), np.amin(data, 0))
+
+        # Combine reference examples with batch and get indices of examples in batch.
+        n_ref = len(self._reference)
+        data_all = data if n_ref == 0 else np.vstack((self._reference.data, data))
+        target_all = target if n_ref == 0 else np.hstack((self._reference.target, target))
+        idx_batch = np.arange(n_ref, target_all.size)
+
+        # If there are examples from at least two classes, add weights updates for examples in batch. The quantised
+        # search reads examples from the data matrix so only the indices of examples are grouped by class.
+        partition = ClassPartition(None if self.neighbour_backend == 'quantised' else data_all, target_all)
+        if partition.classes.size > 1:
+            k = min(self.k, np.min(np.diff(partition.offsets)))
+            neighbours = get_neighbours(self.neighbour_backend, partition, self.dist_func, self.neighbour_params, data=data_all)
+            process_block = lambda idx_block, accumulator: self._update_block(accumulator, data_all, partition, neighbours, idx_block, 1, k)
+            accumulate_shards(process_block, idx_batch, self.block_size, self._accumulator, self.n_jobs)
+            self._n_updates += idx_batch.size
+
+        # Add batch to reference set.
+        self._reference.add(data, target)
+
+        # Compute feature weights and rankings.
+        self.weights = self._accumulator.weights()/max(self._n_updates, 1)
+        self.rank = rankdata(-self.weights, method='ordinal')
         return self
 
 
@@ -79,17 +163,19 @@ class Relieff(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -98,12 +184,15 @@ class Relieff(BaseEstimator, TransformerMixin):
         """Compute feature scores using ReliefF algorithm
 
         Args:
-            data : Array[np.float64] -- matrix containing examples' data as rows 
+            data : Array[np.float64] -- matrix containing examples' data as rows (memory-mapped matrices are processed out of core)
             target : Array[np.int] -- matrix containing the example's target variable value
             m : int -- Sample size to use when evaluating the feature scores
             k : int -- Number of closest examples from each class to use
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming'). Minkowski metrics ('manhattan', 'euclidean' and 'chebyshev') allow the use of spatial indices for
+            finding nearest neighbours.
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -113,97 +202,109 @@ class Relieff(BaseEstimator, TransformerMixin):
 
         """
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
-
         # Get indices of examples in sample.
         idx_sampled = np.random.choice(np.arange(data.shape[0]), data.shape[0] if m == -1 else m, replace=False)
         
         # Set m if currently set to signal value -1.
         m = data.shape[0] if m == -1 else m
 
-        # Get maximum and minimum values of each feature.
-        max_f_vals = np.amax(data, 0)
-        min_f_vals = np.amin(data, 0)
+        # Get maximum and minimum values of each feature (in a single pass over chunks of rows if processing data out of core).
+        out_of_core = is_out_of_core(data)
+        if out_of_core:
+            max_f_vals, min_f_vals = streaming_min_max(data, self.chunk_size)
+        else:
+            max_f_vals, min_f_vals = max_min(data)
+
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+
+        # Group examples by class into contiguous blocks (only indices if processing data out of core or if using the
+        # quantised search, which reads examples from the data matrix) and get class probabilities.
+        partition = ClassPartition(None if out_of_core or self.neighbour_backend == 'quantised' else data, target)
 
-        # Get all unique classes.
-        classes = np.unique(target)
+        # Initialize search for nearest neighbours from each class. If processing data out of core,
+        # the data matrix is scanned in chunks of rows.
+        if out_of_core:
+            if self.neighbour_backend != 'brute':
+                raise ValueError('Neighbour backend {0} cannot be used with data processed out of core'.format(self.neighbour_backend))
+            neighbours = ChunkedNeighbours(data, partition, get_metric(dist_func), self.chunk_size, self.dtype, **kwargs)
+        else:
+            neighbours = get_neighbours(self.neighbour_backend, partition, dist_func, self.neighbour_params, data=data, **kwargs)
+
+        # Define computation of weights updates for a block of sampled examples' indices.
+        process_block = lambda idx_block, accumulator: self._update_block(accumulator, data, partition, neighbours, idx_block, m, k)
+
+        # Go over blocks of sampled examples' indices (in worker processes if n_jobs > 1).
+        accumulate_shards(process_block, idx_sampled, self.block_size, accumulator, self.n_jobs, getattr(neighbours, 'counts', None))
+
+
+        # Measure recall of nearest neighbours search.
+        self.neighbour_recall = measure_recall(neighbours, idx_sampled, k)
+
+        # Get fraction of distance computations skipped by the nearest neighbours search while finding the neighbours.
+        self.neighbour_pruning_rate = measure_pruning_rate(neighbours)
+
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
+
+        # Return feature rankings and weights.
+        return rankdata(-weights, method='ordinal'), weights
+
+
+    def _update_block(self, accumulator, data, partition, neighbours, idx_block, m, k):
 
-        # Get probabilities of classes in training set.
-        p_classes = (np.vstack(np.unique(target, return_counts=True)).T).astype(np.float)
-        p_classes[:, 1] = p_classes[:, 1] / np.sum(p_classes[:, 1])
+        """Add feature weights updates for block of sampled examples to accumulator
 
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            data : Array[np.float64] -- matrix containing examples' data as rows
+            partition : ClassPartition -- examples grouped by class
+            neighbours : Union[BruteForceNeighbours, TreeNeighbours, RandomProjectionNeighbours, ChunkedNeighbours] --
+            nearest neighbours search
+            idx_block : Array[np.int] -- indices of sampled examples in block
+            m : int -- Sample size used when evaluating the feature scores
+            k : int -- Number of closest examples from each class
+        """
+
+        # Find k closest examples from each class for examples in block.
+        idxs_closest, _ = neighbours.kneighbours(idx_block, k)
 
-        # Go over sampled examples' indices.
-        for idx in idx_sampled:
+        # Go over sampled examples' indices in block.
+        for i, idx in enumerate(idx_block):
 
             # Get next example.
             e = data[idx, :]
 
-            # Get index of next sampled example in group of examples with same class.
-            idx_class = idx - np.sum(target[:idx] != target[idx])
-          
-            # If keyword argument with keyword 'learned_metric_func' exists...
-            if 'learned_metric_func' in kwargs:
-
-                # Partially apply distance function.
-                dist = partial(kwargs['learned_metric_func'], dist_func, np.int(idx))
-
-                # Compute distances to examples from same class in learned metric space.
-                distances_same = dist(np.where(target == target[idx])[0])
-
-                # Set distance of sampled example to itself to infinity.
-                distances_same[idx_class] = np.inf
-
-                # Find k closest examples from same class.
-                idxs_closest_same = np.argpartition(distances_same, k-1)[:k]
-                closest_same = (data[target == target[idx], :])[idxs_closest_same, :]
-            else:
-                # Find k nearest examples from same class.
-                distances_same = dist_func(e, data[target == target[idx], :])
-
-                # Set distance of sampled example to itself to infinity.
-                distances_same[idx_class] = np.inf
-
-                # Find closest examples from same class.
-                idxs_closest_same = np.argpartition(distances_same, k-1)[:k]
-                closest_same = (data[target == target[idx], :])[idxs_closest_same, :]
-
-            # Allocate matrix template for getting nearest examples from other classes.
-            closest_other = np.empty((k * (len(classes) - 1), data.shape[1]), dtype=np.float)
-
-            # Initialize pointer for adding examples to template matrix.
-            top_ptr = 0
-            for cl in classes:  # Go over classes different than the one of current sampled example.
-                if cl != target[idx]:
-                    # If keyword argument with keyword 'learned_metric_func' exists...
-                    if 'learned_metric_func' in kwargs:
-                        # get closest k examples with class cl if using learned distance metric.
-                        distances_cl = dist(np.where(target == cl)[0])
-                    else:
-                        # Get closest k examples with class cl.
-                        distances_cl = dist_func(e, data[target == cl, :])
-                    # Get indices of closest exmples from class cl.
-                    idx_closest_cl = np.argpartition(distances_cl, k-1)[:k]
-
-                    # Add found closest examples to matrix.
-                    closest_other[top_ptr:top_ptr+k, :] = (data[target == cl, :])[idx_closest_cl, :]
-                    top_ptr = top_ptr + k
-
-
-            # Get probabilities of classes not equal to class of sampled example.
-            p_classes_other = p_classes[p_classes[:, 0] != target[idx], 1]
-           
+            # Get index of class of next sampled example.
+            cl_idx = partition.class_idx[idx]
+
+            # Get k closest examples from same class.
+            closest_same = data[partition.original_idx(cl_idx)[idxs_closest[cl_idx][i]], :]
+
+            # Get k closest examples from each of the other classes.
+            closest_other = vstack_rows([data[partition.original_idx(cl_other)[idxs_closest[cl_other][i]], :] 
+                for cl_other in partition.other_classes(cl_idx)])
+
             # Compute diff sum weights for closest examples from different class.
-            p_weights = p_classes_other/(1 - p_classes[p_classes[:, 0] == target[idx], 1])
-            weights_mult = np.repeat(p_weights, k) # Weights multiplier vector
-           
+            weights_mult = np.repeat(partition.p_weights(cl_idx), k) # Weights multiplier vector
 
             # ------ weights update ------
-            weights = np.array(self._update_weights(data, e[np.newaxis], closest_same, closest_other, weights[np.newaxis],
-                    weights_mult[np.newaxis].T, m, k, max_f_vals[np.newaxis], min_f_vals[np.newaxis]))
+            self._update_weights(accumulator, e, closest_same, closest_other, weights_mult, m, k)
 
 
-        # Return feature rankings and weights.
-        return rankdata(-weights, method='ordinal'), weights
+    def _update_weights(self, accumulator, e, closest_same, closest_other, weights_mult, m, k):
+
+        """Add feature weights update for sampled example to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- sampled example
+            closest_same : Array[np.float64] -- matrix of k closest examples from same class
+            closest_other : Array[np.float64] -- matrix of k closest examples from each of the other classes
+            weights_mult : Array[np.float64] -- probability weights of closest examples from other classes
+            m : int -- Sample size used when evaluating the feature scores
+            k : int -- Number of closest examples from each class
+        """
+        accumulator.add_penalty(abs_diffs(e, closest_same), 1.0/(m*k))
+        accumulator.add_reward(scale_rows(abs_diffs(e, closest_other), weights_mult), 1.0/(m*k))
 
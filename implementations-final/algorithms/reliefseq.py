@@ -3,6 +3,7 @@ import warnings
 from algorithms.relieff import Relieff
 from scipy.stats import rankdata
 from sklearn.base import BaseEstimator, TransformerMixin
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class ReliefSeq(BaseEstimator, TransformerMixin):
@@ -18,15 +19,19 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
     """
 
     def __init__(self, n_features_to_select=10, m=-1, k_max=20,
-            dist_func=lambda x1, x2: np.sum(np.abs(x1-x2), 1), learned_metric_func=None):
+            dist_func=lambda x1, x2: np.sum(np.abs(x1-x2), 1), learned_metric_func=None, neighbour_backend='brute', neighbour_params=None,
+            dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select.
         self.m = m                                        # sample size of examples for the ReliefF algorithm
         self.k_max = k_max                                # maximal k value
         self.dist_func = dist_func                        # distance function
         self.learned_metric_func = learned_metric_func    # learned metric function
+        self.neighbour_backend = neighbour_backend        # nearest neighbours search backend ('brute', 'tree', 'approximate', 'early_abandon', 'pivot' or 'quantised')
+        self.neighbour_params = neighbour_params          # additional parameters of nearest neighbours search
+        self.dtype = dtype                                # floating point type used by ReliefF for computing distances and differences
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using ReliefSeq feature selection algorithm
@@ -34,11 +39,16 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
         # Get number of instances with class that has minimum number of instances.
         _, instances_by_class = np.unique(target, return_counts=True)
         min_instances = np.min(instances_by_class)
@@ -51,12 +61,12 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
 
 
         # Run ReliefSeq feature selection algorithm.
-        if self.learned_metric_func != None:
+        if learned_metric_func != None:
             self.rank, self.weights = self._reliefseq(data, target, self.m, min(self.k_max, min_instances), 
-                    self.dist_func, learned_metric_func=self.learned_metric_func)
+                    dist_func, learned_metric_func=learned_metric_func)
         else:
             self.rank, self.weights = self._reliefseq(data, target, self.m, min(self.k_max, min_instances), 
-                    self.dist_func, learned_metric_func=None)
+                    dist_func, learned_metric_func=None)
 
         return self
 
@@ -78,19 +88,21 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)  # Fit training data.
+        self.fit(data, target, distances)  # Fit training data.
         return self.transform(data)  # Perform feature selection.
 
 
@@ -103,8 +115,10 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
             target : Array[np.int] -- matrix containing the example's target variable value
             m : int -- Sample size to use when evaluating the feature scores
             k_max : int -- k sweep upper limit
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -115,24 +129,30 @@ class ReliefSeq(BaseEstimator, TransformerMixin):
         """
 
         
-        # Initialize matrix of weights by k.
+        # Initialize matrix of weights by k and vector of recalls of nearest neighbours search by k.
         weights_mat = np.empty((data.shape[1], k_max), dtype=np.float)
+        recalls = np.empty(k_max, dtype=np.float)
         
         # Sweep k from 1 to k_max.
         for k in np.arange(1, k_max+1):
 
             # Initialize ReliefF algorithm implementation with next value of k.
-            clf = Relieff(m=m, k=k, dist_func=dist_func, learned_metric_func=learned_metric_func)
+            clf = Relieff(m=m, k=k, dist_func=dist_func, learned_metric_func=learned_metric_func, 
+                    neighbour_backend=self.neighbour_backend, neighbour_params=self.neighbour_params, dtype=self.dtype)
 
             # Fit data and target.
             clf.fit(data, target)
 
             # Add weights to matrix.
             weights_mat[:, k-1] = clf.weights
+            recalls[k-1] = clf.neighbour_recall
         
         # For each feature choose maximum weight over weights by different values of k.
         weights = np.max(weights_mat, 1)
 
+        # Report lowest recall of nearest neighbours search over values of k.
+        self.neighbour_recall = np.min(recalls)
+
         # Return feature rankings and weights.
         return rankdata(-weights, method='ordinal'), weights
 
@@ -6,8 +6,14 @@ from sklearn.metrics import pairwise_distances
 import os
 import sys
 from sklearn.base import BaseEstimator, TransformerMixin
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.condensed import CondensedDistances, condensed_distances, condensed_index_distances
+from algorithms.utils.distance_cache import DISTANCE_CACHE
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs, scale_rows
+from algorithms.utils.radius_neighbours import RadiusNeighbours, estimate_mean_distance
+from algorithms.utils.precomputed import resolve_precomputed
 
 class SURF(BaseEstimator, TransformerMixin):
 
@@ -16,23 +22,31 @@ class SURF(BaseEstimator, TransformerMixin):
     Casey S Greene, Nadia M Penrod, Jeff Kiralis, Jason H Moore. 
     Spatially Uniform ReliefF (SURF) for computationally-efficient filtering of gene-gene interactions
 
+    If mean_sample_size is set, the mean distance threshold is estimated from distances between randomly
+    sampled pairs of examples and the neighbours within the threshold are found using radius queries so
+    that the pairwise distance matrix is not stored. The weights then deviate from the weights computed
+    using the exact mean distance only through neighbours whose distances lie between the exact and the
+    estimated threshold. With probability given by the confidence level, these are neighbours at a distance
+    within mean_dist_bound of the estimated threshold (on the order of the standard deviation of
+    distances divided by the square root of the sample size).
+
     Author: Jernej Vivod
 
     """
 
 
-    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None, dtype=np.float64,
+            distance_dtype=None, mean_sample_size=None, confidence=0.95):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.dist_func = dist_func                        # metric function
         self.learned_metric_func = learned_metric_func    # learned metric function
-
-        # Use function written in Julia programming language to update feature weights.
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_surf3.jl")
+        self.dtype = dtype                                # floating point type used for computing distances and differences
+        self.distance_dtype = distance_dtype              # floating point type of stored pairwise distances (None for type of computed distances)
+        self.mean_sample_size = mean_sample_size          # number of sampled pairs used to estimate mean distance (None to compute all pairwise distances)
+        self.confidence = confidence                      # confidence level of bound of estimated mean distance
 
 
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using SURF feature selection algorithm
@@ -40,16 +54,25 @@ class SURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
+        # Convert data to floating point type used for computations and check that sparse data is used with a sparse metric.
+        data = as_compute_dtype(data, self.dtype)
+        check_sparse_input(data, dist_func, learned_metric_func)
+
         # Run SURF feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._surf(data, target, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._surf(data, target, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._surf(data, target, self.dist_func)
+            self.rank, self.weights = self._surf(data, target, dist_func)
 
         return self
 
@@ -71,19 +94,21 @@ class SURF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -103,7 +128,7 @@ class SURF(BaseEstimator, TransformerMixin):
             to compare.
 
         Returns:
-            Pairwise distance matrix : Array[np.float64]
+            CondensedDistances -- condensed store of pairwise distances (can be converted to the pairwise distance matrix)
 
         Raises:
             ValueError : if the mode parameter does not have an allowed value ('example' or 'index')
@@ -111,22 +136,14 @@ class SURF(BaseEstimator, TransformerMixin):
 
         # If computing distances between examples by referencing them by indices.
         if mode == "index":
-            # Allocate matrix for distance matrix and compute distances.
-            # dist_func_adapter = lambda x1, x2 : dist_func(np.int(np.where(np.sum(np.equal(x1, data), 1) == data.shape[1])[0][0]),
-            #         np.int(np.where(np.sum(np.equal(x2, data), 1) == data.shape[1])[0][0]))
-
-
-            dist_vec = np.empty(np.int(data.shape[0]*(data.shape[0]-1)/2), dtype=np.float)
-            count = 0
-            for i in np.arange(1, data.shape[0]-1):
-                for j in np.arange(i+1, data.shape[0]):
-                    dist_vec[count] = dist_func(i, j)
-                    count += 1
-
-            # return pairwise_distances(data, metric=dist_func_adapter)
-            return sp.spatial.distance.squareform(dist_vec)
+            # Compute condensed vector of distances between all pairs of examples.
+            dist_vec = condensed_index_distances(data.shape[0], dist_func, np.float64 if self.distance_dtype is None else self.distance_dtype)
+            return CondensedDistances(dist_vec, data.shape[0])
         elif mode == "example":  # Else if passing in examples...
-            return pairwise_distances(data, metric=dist_func)
+            # Get condensed vector of distances from distance cache shared by estimators (compute it if not cached).
+            kind = 'condensed' if self.distance_dtype is None else 'condensed-' + np.dtype(self.distance_dtype).name
+            dist_vec = DISTANCE_CACHE.pairwise(data, dist_func, lambda: condensed_distances(data, dist_func, self.distance_dtype), kind)
+            return CondensedDistances(dist_vec, data.shape[0])
         else:
             raise ValueError("Unknown mode specifier")
 
@@ -138,8 +155,10 @@ class SURF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows 
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -149,50 +168,77 @@ class SURF(BaseEstimator, TransformerMixin):
 
         """
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
 
         # Get maximal and minimal feature values.
-        max_f_vals = np.max(data, 0)
-        min_f_vals = np.min(data, 0)
+        max_f_vals, min_f_vals = max_min(data)
 
-        # Compute weighted pairwise distances.
-        if 'learned_metric_func' in kwargs:
-            dist_func_learned = partial(kwargs['learned_metric_func'], dist_func)
-            pairwise_dist = self._get_pairwise_distances(data, dist_func_learned, mode="index")
-        else:
-            pairwise_dist = self._get_pairwise_distances(data, dist_func, mode="example")
-
-        # Get mean distance between all examples.
-        mean_dist = np.mean(pairwise_dist)
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
 
-        # Go over examples.
-        for idx in np.arange(data.shape[0]):
+        if self.mean_sample_size is not None:
 
-            # Get neighbours within threshold.
-            neigh_mask = pairwise_dist[idx, :] <= mean_dist
-            neigh_mask[idx] = False
+            # Estimate mean distance between all examples from sampled pairs and get iterator over neighbours within
+            # threshold found using radius queries.
+            if 'learned_metric_func' in kwargs:
+                raise ValueError('Sampled mean distance estimation cannot be used with a learned metric function')
+            self.mean_dist, self.mean_dist_bound = estimate_mean_distance(data, dist_func, self.mean_sample_size, self.confidence)
+            neighbours = RadiusNeighbours(data, dist_func).iter_query(self.mean_dist)
+        else:
 
-            # Get mask of neighbours with same class.
-            hit_neigh_mask = np.logical_and(neigh_mask, target == target[idx])
-            # Get mask of neighbours with different class.
-            miss_neigh_mask = np.logical_and(neigh_mask, target != target[idx])
+            # Compute weighted pairwise distances.
+            if 'learned_metric_func' in kwargs:
+                dist_func_learned = partial(kwargs['learned_metric_func'], dist_func)
+                pairwise_dist = self._get_pairwise_distances(data, dist_func_learned, mode="index")
+            else:
+                pairwise_dist = self._get_pairwise_distances(data, dist_func, mode="example")
+
+            # Get mean distance between all examples and iterator over neighbours within threshold.
+            self.mean_dist, self.mean_dist_bound = pairwise_dist.mean(), 0.0
+            neighbours = (np.flatnonzero(pairwise_dist.row(idx) <= self.mean_dist) for idx in np.arange(data.shape[0]))
+
+        # Go over examples and their neighbours within threshold.
+        for idx, neigh in enumerate(neighbours):
+            neigh = neigh[neigh != idx]
+
+            # Get neighbours with same class.
+            hit_neigh = neigh[target[neigh] == target[idx]]
+            # Get neighbours with different class.
+            miss_neigh = neigh[target[neigh] != target[idx]]
             
             # Compute probability weights for misses in considered region.
-            miss_classes = target[miss_neigh_mask]
-            weights_mult = np.empty(miss_classes.size, dtype=np.float)
+            miss_classes = target[miss_neigh]
+            weights_mult = np.empty(miss_classes.size, dtype=data.dtype)
             u, c = np.unique(miss_classes, return_counts=True)
             neighbour_weights = c/miss_classes.size
             for i, val in enumerate(u):
                 weights_mult[np.where(miss_classes == val)] = neighbour_weights[i]
 
             # Update feature weights
-            weights = self._update_weights(data, data[idx, :][np.newaxis], data[hit_neigh_mask, :], 
-                    data[miss_neigh_mask, :], weights[np.newaxis], weights_mult[np.newaxis].T, 
-                    max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+            self._update_weights(accumulator, data[idx, :], data[hit_neigh, :], data[miss_neigh, :], 
+                    weights_mult, data.shape[0])
+
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
 
         # Create array of feature enumerations based on score.
         rank = rankdata(-weights, method='ordinal')
         return rank, weights
 
 
+    def _update_weights(self, accumulator, e, closest_same, closest_other, weights_mult, n):
+
+        """Add feature weights update for example to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- example
+            closest_same : Array[np.float64] -- matrix of neighbours with same class
+            closest_other : Array[np.float64] -- matrix of neighbours with different class
+            weights_mult : Array[np.float64] -- probability weights of neighbours with different class
+            n : int -- number of examples in training set
+        """
+        accumulator.add_penalty(abs_diffs(e, closest_same), 1.0/(n*closest_same.shape[0] + np.finfo(np.float64).eps))
+        accumulator.add_reward(scale_rows(abs_diffs(e, closest_other), weights_mult), 
+                1.0/(n*closest_other.shape[0] + np.finfo(np.float64).eps))
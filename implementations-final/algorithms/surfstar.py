@@ -1,12 +1,20 @@
 import numpy as np
 import scipy as sp
 from scipy.stats import rankdata
+from scipy.sparse import issparse
 from functools import partial
 from sklearn.metrics import pairwise_distances
 import os
 from sklearn.base import BaseEstimator, TransformerMixin
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.condensed import CondensedDistances, condensed_distances, condensed_index_distances
+from algorithms.utils.distance_cache import DISTANCE_CACHE
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.group_sums import group_sums
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs, scale_rows
+from algorithms.utils.class_diff_sums import ClassDiffSums
+from algorithms.utils.precomputed import resolve_precomputed
 
 class SURFStar(BaseEstimator, TransformerMixin):
 
@@ -20,17 +28,17 @@ class SURFStar(BaseEstimator, TransformerMixin):
 
     """
 
-    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2)), learned_metric_func=None, dtype=np.float64,
+            distance_dtype=None, max_sums_bytes=0):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.dist_func = dist_func                        # metric function
         self.learned_metric_func = learned_metric_func    # learned metric function
+        self.dtype = dtype                                # floating point type used for computing distances and differences
+        self.distance_dtype = distance_dtype              # floating point type of stored pairwise distances (None for type of computed distances)
+        self.max_sums_bytes = max_sums_bytes              # maximal number of bytes of sums of differences to all examples of each class (0 to enumerate all neighbours exactly)
 
-        # Use function written in Julia programming language to update feature weights.
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_surfstar3.jl")
 
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using SURFStar feature selection algorithm
@@ -38,17 +46,26 @@ class SURFStar(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
+        # Convert data to floating point type used for computations and check that sparse data is used with a sparse metric.
+        data = as_compute_dtype(data, self.dtype)
+        check_sparse_input(data, dist_func, learned_metric_func)
+
         # Run SURFStar feature selection algorithm.
-        if self.learned_metric_func != None: 
-            self.rank, self.weights = self._surfStar(data, target, self.dist_func, 
-                    learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None: 
+            self.rank, self.weights = self._surfStar(data, target, dist_func, 
+                    learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._surfStar(data, target, self.dist_func)
+            self.rank, self.weights = self._surfStar(data, target, dist_func)
 
         return self
 
@@ -70,19 +87,21 @@ class SURFStar(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -102,7 +121,7 @@ class SURFStar(BaseEstimator, TransformerMixin):
             to compare.
 
         Returns:
-            Pairwise distance matrix : Array[np.float64]
+            CondensedDistances -- condensed store of pairwise distances (can be converted to the pairwise distance matrix)
 
         Raises:
             ValueError : if the mode parameter does not have an allowed value ('example' or 'index')
@@ -110,22 +129,14 @@ class SURFStar(BaseEstimator, TransformerMixin):
 
         # If computing distances between examples by referencing them by indices.
         if mode == "index":
-            # Allocate matrix for distance matrix and compute distances.
-            # dist_func_adapter = lambda x1, x2 : dist_func(np.int(np.where(np.sum(np.equal(x1, data), 1) == data.shape[1])[0][0]),
-            #         np.int(np.where(np.sum(np.equal(x2, data), 1) == data.shape[1])[0][0]))
-            # return pairwise_distances(data, metric=dist_func_adapter)
-
-            dist_vec = np.empty(np.int(data.shape[0]*(data.shape[0]-1)/2), dtype=np.float)
-            count = 0
-            for i in np.arange(1, data.shape[0]-1):
-                for j in np.arange(i+1, data.shape[0]):
-                    dist_vec[count] = dist_func(i, j)
-                    count += 1
-
-            # return pairwise_distances(data, metric=dist_func_adapter)
-            return sp.spatial.distance.squareform(dist_vec)
-        elif mode == "example":  # Else if passing in examples.
-            return pairwise_distances(data, metric=dist_func)
+            # Compute condensed vector of distances between all pairs of examples.
+            dist_vec = condensed_index_distances(data.shape[0], dist_func, np.float64 if self.distance_dtype is None else self.distance_dtype)
+            return CondensedDistances(dist_vec, data.shape[0])
+        elif mode == "example":  # Else if passing in examples...
+            # Get condensed vector of distances from distance cache shared by estimators (compute it if not cached).
+            kind = 'condensed' if self.distance_dtype is None else 'condensed-' + np.dtype(self.distance_dtype).name
+            dist_vec = DISTANCE_CACHE.pairwise(data, dist_func, lambda: condensed_distances(data, dist_func, self.distance_dtype), kind)
+            return CondensedDistances(dist_vec, data.shape[0])
         else:
             raise ValueError("Unknown mode specifier")
 
@@ -137,8 +148,10 @@ class SURFStar(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- Matrix containing examples' data as rows 
             target : Array[np.int] -- matrix containing the example's target variable value
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -148,8 +161,8 @@ class SURFStar(BaseEstimator, TransformerMixin):
 
         """
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
 
         # Compute weighted pairwise distances.
         if 'learned_metric_func' in kwargs:
@@ -160,82 +173,93 @@ class SURFStar(BaseEstimator, TransformerMixin):
             pairwise_dist = self._get_pairwise_distances(data, dist_func, mode="example")
 
         # Get mean distance between all examples.
-        mean_dist = np.float(np.sum(pairwise_dist))/np.float(np.size(pairwise_dist))
+        mean_dist = pairwise_dist.mean()
         
         # Compute maximal and minimal feature values.
-        max_f_vals = np.max(data, 0)
-        min_f_vals = np.min(data, 0)
+        max_f_vals, min_f_vals = max_min(data)
 
-        # Go over examples.
-        for idx in np.arange(data.shape[0]):
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
 
-           
-            # Select next example.
-            e = data[idx, :]
+        # Get indices of classes of examples.
+        classes, class_idx = np.unique(target, return_inverse=True)
 
-            ### NEIGHBOUR INDICES ###
+        # If sums of differences to all examples of each class fit in the memory budget, the sums for near or far
+        # neighbours (whichever are more numerous) are computed as the sums for all examples minus the sums for the others
+        # (the weights then agree with the weights computed by enumerating all neighbours only up to rounding).
+        if not issparse(data) and ClassDiffSums.nbytes(data, classes.size) <= self.max_sums_bytes:
+            class_diff_sums = ClassDiffSums(data, class_idx, classes.size)
+        else:
+            class_diff_sums = None
 
-            # Get indices of near neighbours.
-            neigh_mask_near = pairwise_dist[idx, :] <= mean_dist
-            neigh_mask_near[idx] = False  # Set value at index refering to current example to False.
-            
-            # Get indices of far neighbours.
-            neigh_mask_far = pairwise_dist[idx, :] > mean_dist
+        # Go over examples.
+        for idx in np.arange(data.shape[0]):
 
-            ### /NEIGHBOUR INDICES ###
+            # Select next example and get distances to all examples.
+            e = data[idx, :]
+            dist_row = pairwise_dist.row(idx)
 
+            # Get band of each neighbour (0 for near and 1 for far neighbours).
+            bands = (dist_row > mean_dist).astype(int)
+            bands[idx] = -1
+            hit = class_idx == class_idx[idx]
 
-            ###  HIT AND MISS MASKS ###
+            if class_diff_sums is not None:
 
-            # Get mask of near neighbours with same class.
-            hit_neigh_mask_near = np.logical_and(neigh_mask_near, target == target[idx])
-            # Get mask of near neighbours with different class.
-            miss_neigh_mask_near = np.logical_and(neigh_mask_near, target != target[idx])
+                # Get sums of feature value differences to neighbours of each class in each band.
+                diff_sums, counts = class_diff_sums.band_sums(idx, bands, 2,
+                        lambda rows, groups, n_groups: group_sums(abs_diffs(e, data[rows, :]), groups, n_groups))
+                diff_sums, counts = diff_sums.reshape(2, classes.size, -1), counts.reshape(2, classes.size)
 
+                # Weight sums of differences to neighbours with different class by probabilities of their classes among these neighbours.
+                msk_other = np.arange(classes.size) != class_idx[idx]
+                n_other = np.sum(counts[:, msk_other], 1)
+                p_other = counts[:, msk_other]/np.maximum(n_other, 1)[np.newaxis].T
+                sums_same, n_same = diff_sums[:, class_idx[idx]], counts[:, class_idx[idx]]
+                sums_other = [np.dot(p_other[band], diff_sums[band, msk_other]) for band in np.arange(2)]
+            else:
 
-            # Get mask of far neighbours with same class.
-            hit_neigh_mask_far = np.logical_and(neigh_mask_far, target == target[idx])
-            # Get mask of far neighbours with different class.
-            miss_neigh_mask_far = np.logical_and(neigh_mask_far, target != target[idx])
+                # Weight differences to neighbours with different class by probabilities of their classes among these
+                # neighbours in the band.
+                counts = np.bincount(bands[bands >= 0]*classes.size + class_idx[bands >= 0], minlength=2*classes.size).reshape(2, -1)
+                p_class = counts/np.maximum(np.sum(counts, 1) - counts[:, class_idx[idx]], 1)[np.newaxis].T
+                weights_mult = np.where(hit, 1.0, p_class[np.maximum(bands, 0), class_idx]).astype(data.dtype)
 
-            ###  /HIT AND MISS MASKS ###
+                # Compute sums of weighted differences to hits and misses in each band in a single pass (the rows of each
+                # group are summed in order).
+                diff_sums, n_rows = group_sums(scale_rows(abs_diffs(e, data), weights_mult), np.where(bands >= 0, 2*bands + ~hit, -1), 4)
+                sums_same, n_same, sums_other, n_other = diff_sums[0::2], n_rows[0::2], diff_sums[1::2], n_rows[1::2]
 
-            
-            # Compute probability weights for misses in considered regions.            
-            miss_classes = target[miss_neigh_mask_near]
-            weights_mult1 = np.empty(miss_classes.size, dtype=np.float)
-            u, c = np.unique(miss_classes, return_counts=True)
-            neighbour_weights = c/miss_classes.size
-            for i, val in enumerate(u):
-                weights_mult1[np.where(miss_classes == val)] = neighbour_weights[i]
+            # Update feature weights for near examples and for far examples. The scoring for far examples is subtracted.
+            self._update_weights(accumulator, sums_same[0], n_same[0], sums_other[0], n_other[0], data.shape[0])
+            self._update_weights(accumulator, sums_same[1], n_same[1], sums_other[1], n_other[1], data.shape[0], far=True)
 
-            miss_classes = target[miss_neigh_mask_far]
-            weights_mult2 = np.empty(miss_classes.size, dtype=np.float)
-            u, c = np.unique(miss_classes, return_counts=True)
-            neighbour_weights = c/miss_classes.size
-            for i, val in enumerate(u):
-                weights_mult2[np.where(miss_classes == val)] = neighbour_weights[i]
 
-            
-            ### WEIGHTS UPDATE ###
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
 
-            # Update feature weights for near examples.
-            weights_near = self._update_weights(data, e[np.newaxis], data[hit_neigh_mask_near, :], 
-                    data[miss_neigh_mask_near, :], weights[np.newaxis], weights_mult1[np.newaxis].T,
-                    max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+        # Create array of feature enumerations based on score.
+        rank = rankdata(-weights, method='ordinal')
+        return rank, weights
 
-            # Update feature weights for far examples.
-            weights_far = self._update_weights(data, e[np.newaxis], data[hit_neigh_mask_far, :], 
-                    data[miss_neigh_mask_far, :], weights[np.newaxis], weights_mult2[np.newaxis].T,
-                    max_f_vals[np.newaxis], min_f_vals[np.newaxis])
-            
-            # Subtract scoring for far examples. Subtract previous value of weights to get delta.
-            weights = weights_near - (weights_far - weights)
 
-            ### /WEIGHTS UPDATE ###
+    def _update_weights(self, accumulator, sums_same, n_same, sums_other, n_other, n, far=False):
 
+        """Add feature weights update for example to accumulator
 
-        # Create array of feature enumerations based on score.
-        rank = rankdata(-weights, method='ordinal')
-        return rank, weights
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            sums_same : Array[np.float64] -- sums of feature value differences to neighbours with same class
+            n_same : int -- number of neighbours with same class
+            sums_other : Array[np.float64] -- sums of feature value differences to neighbours with different class weighted
+            by probabilities of their classes
+            n_other : int -- number of neighbours with different class
+            n : int -- number of examples in training set
+            far : bool -- if True, the neighbours are far neighbours and their scoring is subtracted
+        """
 
+        # For far neighbours, neighbours with same class are rewarded and neighbours with different class are penalized.
+        add_same = accumulator.add_reward if far else accumulator.add_penalty
+        add_other = accumulator.add_penalty if far else accumulator.add_reward
+        add_same(sums_same, 1.0/(n*n_same + np.finfo(np.float64).eps))
+        add_other(sums_other, 1.0/(n*n_other + np.finfo(np.float64).eps))
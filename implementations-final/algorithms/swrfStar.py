@@ -5,8 +5,11 @@ from functools import partial
 import os
 import sys
 from sklearn.base import BaseEstimator, TransformerMixin
-from julia import Julia
-jl = Julia(compiled_modules=False)
+from algorithms.utils.metrics import get_metric
+from algorithms.utils.parallel import accumulate_shards, SHARD_SIZE
+from algorithms.utils.weight_accumulator import WeightAccumulator
+from algorithms.utils.dtypes import as_compute_dtype
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class SWRFStar(BaseEstimator, TransformerMixin):
@@ -19,34 +22,41 @@ class SWRFStar(BaseEstimator, TransformerMixin):
         Author: Jernej Vivod
     """
    
-    def __init__(self, n_features_to_select=10, m=-1, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None):
+    def __init__(self, n_features_to_select=10, m=-1, dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None, n_jobs=1,
+            dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.m = m                                        # number of examples to sample
         self.dist_func = dist_func                        # distance function
         self.learned_metric_func = learned_metric_func    # learned metric function
+        self.n_jobs = n_jobs                              # number of worker processes (-1 to use all processors)
+        self.dtype = dtype                                # floating point type used for computing distances and differences
 
-        # Use function written in Julia programming language to update feature weights.
-        script_path = os.path.abspath(__file__)
-        self._update_weights = jl.include(script_path[:script_path.rfind('/')] + "/julia-utils/update_weights_swrfstar2.jl")
 
-
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using relief feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
+
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
         
+        # Convert data to floating point type used for computations.
+        data = as_compute_dtype(data, self.dtype)
+
         # Run SWRFStar feature selection algorithm.
-        if self.learned_metric_func != None:
-            self.rank, self.weights = self._swrfstar(data, target, self.m, self.dist_func, learned_metric_func=self.learned_metric_func(data, target))
+        if learned_metric_func != None:
+            self.rank, self.weights = self._swrfstar(data, target, self.m, dist_func, learned_metric_func=learned_metric_func(data, target))
         else:
-            self.rank, self.weights = self._swrfstar(data, target, self.m, self.dist_func)
+            self.rank, self.weights = self._swrfstar(data, target, self.m, dist_func)
         return self
 
 
@@ -65,17 +75,19 @@ class SWRFStar(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -88,8 +100,10 @@ class SWRFStar(BaseEstimator, TransformerMixin):
             target : Array[np.int] -- matrix containing the example's target variable value
             m : int -- Sample size to use when evaluating the feature scores
             k : int -- Number of closest examples from each class to use
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating 
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating 
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -99,8 +113,8 @@ class SWRFStar(BaseEstimator, TransformerMixin):
 
         """
 
-        # Initialize feature weights.
-        weights = np.zeros(data.shape[1], dtype=np.float)
+        # Get metric if distance function is specified by name.
+        dist_func = get_metric(dist_func)
 
         # Get indices of examples in sample of examples.
         idx_sampled = np.random.choice(np.arange(data.shape[0]), data.shape[0] if m == -1 else m, replace=False)
@@ -112,6 +126,9 @@ class SWRFStar(BaseEstimator, TransformerMixin):
         max_f_vals = np.amax(data, 0)
         min_f_vals = np.amin(data, 0)
 
+        # Initialize accumulator of weights updates.
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+
         # Get all unique classes.
         classes = np.unique(target)
 
@@ -120,81 +137,107 @@ class SWRFStar(BaseEstimator, TransformerMixin):
         p_classes[:, 1] = p_classes[:, 1] / (np.sum(p_classes[:, 1]) + np.finfo(np.float64).eps)
 
 
-        # Go over sampled examples' indices.
-        for idx in idx_sampled:
+        # Define computation of weights updates for a shard of sampled examples' indices.
+        def process_shard(idx_shard, accumulator):
 
-            # Get next example.
-            e = data[idx, :]
+            # Go over sampled examples' indices in shard.
+            for idx in idx_shard:
 
-            # mask for selecting examples with same class
-            # that exludes currently sampled example.
-            same_sel = target == target[idx]
-            same_sel[idx] = False
+                # Get next example.
+                e = data[idx, :]
+
+                # mask for selecting examples with same class
+                # that exludes currently sampled example.
+                same_sel = target == target[idx]
+                same_sel[idx] = False
             
-            # examples with same class value
-            same = data[same_sel, :]
+                # examples with same class value
+                same = data[same_sel, :]
 
-            # examples with different class value
-            other = data[target != target[idx], :]
+                # examples with different class value
+                other = data[target != target[idx], :]
             
-            # class values of examples with different class value
-            target_other = target[target != target[idx]]
-
-            # If keyword argument with keyword 'learned_metric_func' exists...
-            if 'learned_metric_func' in kwargs:
-
-                # Partially apply distance function.
-                dist = partial(kwargs['learned_metric_func'], dist_func, np.int(idx))
-
-                # Compute distances to examples from same class in learned metric space.
-                distances_same = dist(np.where(same_sel)[0])
-            else:
-                # Compute distances to examples with same class value.
-                distances_same = dist_func(e, same)
-
-            # Compute t and u parameter values.
-            t_same = np.mean(distances_same)
-            u_same = np.std(distances_same)
-
-            if 'learned_metric_func' in kwargs:
-                # Compute distances to examples from different class in learned metric space.
-                distances_other = dist(np.where(target != target[idx])[0])
-            else:
-                # Compute distances to examples with different class value.
-                distances_other = dist_func(e, other)
-
-            # Compute t and u parameter values.
-            t_other = np.mean(distances_other)
-            u_other = np.std(distances_other)
-
-            # Compute weights for examples from same class.
-            neigh_weights_same = 2.0/(1 + np.exp(-(t_same-distances_same)/(u_same/4.0 + np.finfo(np.float64).eps)) + np.finfo(np.float64).eps) - 1
+                # class values of examples with different class value
+                target_other = target[target != target[idx]]
+
+                # If keyword argument with keyword 'learned_metric_func' exists...
+                if 'learned_metric_func' in kwargs:
+
+                    # Partially apply distance function.
+                    dist = partial(kwargs['learned_metric_func'], dist_func, np.int(idx))
+
+                    # Compute distances to examples from same class in learned metric space.
+                    distances_same = dist(np.where(same_sel)[0])
+                else:
+                    # Compute distances to examples with same class value.
+                    distances_same = dist_func(e, same)
+
+                # Compute t and u parameter values.
+                t_same = np.mean(distances_same)
+                u_same = np.std(distances_same)
+
+                if 'learned_metric_func' in kwargs:
+                    # Compute distances to examples from different class in learned metric space.
+                    distances_other = dist(np.where(target != target[idx])[0])
+                else:
+                    # Compute distances to examples with different class value.
+                    distances_other = dist_func(e, other)
+
+                # Compute t and u parameter values.
+                t_other = np.mean(distances_other)
+                u_other = np.std(distances_other)
+
+                # Compute weights for examples from same class.
+                neigh_weights_same = 2.0/(1 + np.exp(-(t_same-distances_same)/(u_same/4.0 + np.finfo(np.float64).eps)) + np.finfo(np.float64).eps) - 1
             
-            # Compute weights for examples from different class.
-            neigh_weights_other = 2.0/(1 + np.exp(-(t_other-distances_other)/(u_other/4.0 + np.finfo(np.float64).eps)) + np.finfo(np.float64).eps) - 1
+                # Compute weights for examples from different class.
+                neigh_weights_other = 2.0/(1 + np.exp(-(t_other-distances_other)/(u_other/4.0 + np.finfo(np.float64).eps)) + np.finfo(np.float64).eps) - 1
 
-            # Get probabilities of classes not equal to class of sampled example.
-            p_classes_other = p_classes[p_classes[:, 0] != target[idx], 1]
+                # Get probabilities of classes not equal to class of sampled example.
+                p_classes_other = p_classes[p_classes[:, 0] != target[idx], 1]
             
-            # Get other classes.
-            classes_other = p_classes[p_classes[:, 0] != target[idx], 0]
+                # Get other classes.
+                classes_other = p_classes[p_classes[:, 0] != target[idx], 0]
            
-            # Compute diff sum weights for examples from different classes.
-            p_weights = p_classes_other/(1 - p_classes[p_classes[:, 0] == target[idx], 1] + np.finfo(np.float64).eps)
+                # Compute diff sum weights for examples from different classes.
+                p_weights = p_classes_other/(1 - p_classes[p_classes[:, 0] == target[idx], 1] + np.finfo(np.float64).eps)
             
-            # Map weights to 'other' vector and construct weights vector.
-            weights_map = np.vstack((classes_other, p_weights))
+                # Map weights to 'other' vector and construct weights vector.
+                weights_map = np.vstack((classes_other, p_weights))
             
-            # Construct weights multiplication vector.
-            weights_mult = np.array([weights_map[1, np.where(weights_map[0, :] == t)[0][0]] for t in target_other])
+                # Construct weights multiplication vector.
+                weights_mult = np.array([weights_map[1, np.where(weights_map[0, :] == t)[0][0]] for t in target_other])
+
+                # ------ weights update ------
+                self._update_weights(accumulator, e, same, other, weights_mult, neigh_weights_same, neigh_weights_other, m)
+
+        # Go over shards of sampled examples' indices (in worker processes if n_jobs > 1).
+        accumulate_shards(process_shard, idx_sampled, SHARD_SIZE, accumulator, self.n_jobs)
 
-            # ------ weights update ------
-            weights = self._update_weights(data, e[np.newaxis], same, other, weights[np.newaxis], 
-                    weights_mult[np.newaxis].T, neigh_weights_same[np.newaxis].T, neigh_weights_other[np.newaxis].T, 
-                    m, max_f_vals[np.newaxis], min_f_vals[np.newaxis])
-       
+        # Compute feature weights from accumulated updates.
+        weights = accumulator.weights()
 
         # Create array of feature enumerations based on score.
         rank = rankdata(-weights, method='ordinal')
         return rank, weights
 
+
+    def _update_weights(self, accumulator, e, same, other, weights_mult, neigh_weights_same, neigh_weights_other, m):
+
+        """Add feature weights update for sampled example to accumulator
+
+        Args:
+            accumulator : WeightAccumulator -- accumulator of feature weights updates
+            e : Array[np.float64] -- sampled example
+            same : Array[np.float64] -- matrix of examples from same class
+            other : Array[np.float64] -- matrix of examples from other classes
+            weights_mult : Array[np.float64] -- probability weights of examples from other classes
+            neigh_weights_same : Array[np.float64] -- distance weights of examples from same class
+            neigh_weights_other : Array[np.float64] -- distance weights of examples from other classes
+            m : int -- Sample size used when evaluating the feature scores
+        """
+        accumulator.add_penalty(neigh_weights_same[np.newaxis].T*np.abs(e - same), 
+                1.0/(m*same.shape[0] + np.finfo(np.float64).eps))
+        accumulator.add_reward((neigh_weights_other*weights_mult)[np.newaxis].T*np.abs(e - other), 
+                1.0/(m*other.shape[0] + np.finfo(np.float64).eps))
+
@@ -21,7 +21,7 @@ class TuRF(BaseEstimator, TransformerMixin):
         self.rba = rba                                    # relief-based algorithm to use
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
 
         """
         Rank features using TURF feature selection algorithm
@@ -29,13 +29,15 @@ class TuRF(BaseEstimator, TransformerMixin):
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples passed to the relief-based
+            algorithm (used if its dist_func is 'precomputed')
 
         Returns:
             self
         """
         
         # Run TuRF algorithm.
-        self.rank, self.weights = self._turf(data, target, self.num_it, self.rba)
+        self.rank, self.weights = self._turf(data, target, self.num_it, self.rba, distances)
         return self
 
     def transform(self, data):
@@ -55,23 +57,25 @@ class TuRF(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples passed to the relief-based
+            algorithm (used if its dist_func is 'precomputed')
 
         Returns:
             Array[np.float64] -- result of performing feature selection
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
-    def _turf(self, data, target, num_it, rba):
+    def _turf(self, data, target, num_it, rba, distances=None):
 
         """Compute feature scores using TURF algorithm
 
@@ -80,6 +84,8 @@ class TuRF(BaseEstimator, TransformerMixin):
             target : Array[np.int] -- matrix containing the example's target variable value
             num_it : int -- number of iterations of feature elimination to perform
             rba -- initialized relief based feature selection algorithm implementation
+            distances : Union[Array[np.float64], CondensedDistances] -- precomputed distances between examples (None if
+            the relief-based algorithm computes distances)
 
         Returns:
             Array[np.int], Array[np.float64] -- Array of feature enumerations based on the scores, array of feature scores
@@ -110,8 +116,8 @@ class TuRF(BaseEstimator, TransformerMixin):
             it_idx += 1
 
 
-            # Fit rba.
-            rba = rba.fit(data_filtered, target)
+            # Fit rba (precomputed distances between examples do not depend on removed features).
+            rba = rba.fit(data_filtered, target) if distances is None else rba.fit(data_filtered, target, distances)
 
             # Rank features.
             rank_nxt = rba.rank
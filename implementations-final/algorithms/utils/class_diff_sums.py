@@ -0,0 +1,176 @@
+import numpy as np
+from algorithms.utils.metrics import BLOCK_ELEMENTS
+
+
+class ClassDiffSums:
+
+    """Sums of feature value differences between each example and all examples of each class
+
+    For each feature, the values are sorted once and the sum of absolute differences between an example
+    and all examples of a class is computed from the number and the prefix sum of values of the class's
+    examples that precede the example in the sorted order. The number of examples of a class with a
+    different value is computed from the number of the class's examples in the example's group of tied
+    values. All sums are computed in O(n log n) time per feature. When neighbours are split into bands
+    (e.g. near and far neighbours), the sums for the band with most examples are then computed as the sums
+    for all examples minus the sums for the other bands so that only the smaller bands are enumerated.
+    Numbers of different values computed this way are exact while sums of absolute differences agree with
+    the enumerated sums only up to rounding.
+    """
+
+    def __init__(self, data, class_idx, n_classes):
+        """
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            class_idx : Array[np.int] -- index of class of each example
+            n_classes : int -- number of classes
+        """
+        self.data = data
+        self.class_idx = class_idx
+        self.n_classes = n_classes
+        self.class_counts = np.bincount(class_idx, minlength=n_classes)
+        self._abs_diff_sums = None
+        self._diff_counts = None
+
+
+    @staticmethod
+    def nbytes(data, n_classes):
+        """
+        Get number of bytes of sums (or numbers of differences) for all examples and classes.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            n_classes : int -- number of classes
+
+        Returns:
+            int -- number of bytes
+        """
+        return 8*n_classes*data.shape[0]*data.shape[1]
+
+
+    def _compute(self, counts):
+        """
+        Compute sums of absolute feature value differences or numbers of different feature values between
+        each example and all examples of each class for blocks of features.
+
+        Args:
+            counts : bool -- if True, numbers of different values are computed and else sums of absolute differences
+
+        Returns:
+            Array[np.float64] -- array with a matrix of sums for each class (a row for each example)
+        """
+        n = self.data.shape[0]
+        res = np.empty((self.n_classes,) + self.data.shape, dtype=np.int64 if counts else np.float64)
+        pos = np.arange(n)[np.newaxis].T
+        block_size = max(1, BLOCK_ELEMENTS//max(n, 1))
+        for start in np.arange(0, self.data.shape[1], block_size):
+            block = self.data[:, start:start+block_size]
+
+            # Sort values of each feature.
+            order = np.argsort(block, axis=0, kind='stable')
+            vals = np.take_along_axis(block, order, 0).astype(np.float64)
+            cls_sorted = self.class_idx[order]
+
+            # Get first position of each value's group of tied values and position following the group.
+            if counts:
+                group_start = np.ones(vals.shape, dtype=bool)
+                group_start[1:, :] = vals[1:, :] != vals[:-1, :]
+                group_end = np.ones(vals.shape, dtype=bool)
+                group_end[:-1, :] = group_start[1:, :]
+                lo = np.maximum.accumulate(np.where(group_start, pos, 0), axis=0)
+                hi = np.minimum.accumulate(np.where(group_end, pos, n-1)[::-1, :], axis=0)[::-1, :] + 1
+
+            for c in np.arange(self.n_classes):
+
+                # Get numbers of examples of class preceding each position (and at each position).
+                in_class = cls_sorted == c
+                cnt = np.cumsum(in_class, 0)
+                if counts:
+
+                    # Examples with different values are examples of class outside the group of tied values.
+                    n_equal = np.take_along_axis(cnt, hi-1, 0) - (np.take_along_axis(cnt, lo, 0) - np.take_along_axis(in_class, lo, 0))
+                    sums = self.class_counts[c] - n_equal
+                else:
+
+                    # Differences to preceding examples of class are v - v_j and to following examples v_j - v.
+                    csum = np.cumsum(np.where(in_class, vals, 0.0), 0)
+                    cnt_below = cnt - in_class
+                    sum_below = csum - np.where(in_class, vals, 0.0)
+                    sums = vals*cnt_below - sum_below + (csum[-1, :] - sum_below) - vals*(self.class_counts[c] - cnt_below)
+
+                np.put_along_axis(res[c, :, start:start+block_size], order, sums, 0)
+        return res
+
+
+    def abs_diff_sums(self, idx):
+        """
+        Get sums of absolute feature value differences between example and all examples of each class.
+
+        Args:
+            idx : int -- index of example
+
+        Returns:
+            Array[np.float64] -- matrix of sums with a row for each class
+        """
+        if self._abs_diff_sums is None:
+            self._abs_diff_sums = self._compute(counts=False)
+        return self._abs_diff_sums[:, idx, :]
+
+
+    def diff_counts(self, idx):
+        """
+        Get numbers of examples of each class with a different value of each feature than example.
+
+        Args:
+            idx : int -- index of example
+
+        Returns:
+            Array[np.int] -- matrix of numbers of examples with a row for each class
+        """
+        if self._diff_counts is None:
+            self._diff_counts = self._compute(counts=True)
+        return self._diff_counts[:, idx, :]
+
+
+    def band_sums(self, idx, bands, n_bands, sums_func, counts=False, unused=None):
+        """
+        Get sums of feature value differences between example and examples in each band grouped by class.
+        The examples in the band with most examples are not enumerated and their sums are computed from the
+        sums for all examples of each class. If the sums for a band are not needed and the band has most
+        examples, the band is neither enumerated nor are any sums computed from the sums for all examples.
+
+        Args:
+            idx : int -- index of example
+            bands : Array[np.int] -- band of each example (examples with negative band, e.g. the example itself,
+            are not included in any band and must not differ from example)
+            n_bands : int -- number of bands
+            sums_func : Callable[[Array[np.int], Array[np.int], int], Tuple[Array[np.float64], Array[np.int]]] -- function
+            that takes indices of examples, their groups and number of groups and returns the sums of differences for each
+            group and numbers of examples in each group (see group_sums)
+            counts : bool -- if True, the summed differences are indicators of different values and else absolute differences
+            unused : Union[int, None] -- band for which the sums are not needed (None if sums for all bands are needed)
+
+        Returns:
+            Array[np.float64], Array[np.int] -- matrix of sums with a row for each class of each band (row band*n_classes + class),
+            number of examples in each class of each band (sums and numbers for unused band are not valid)
+        """
+
+        # Enumerate examples in all bands except the band with most examples.
+        band_sizes = np.bincount(bands[bands >= 0], minlength=n_bands)
+        derived = np.argmax(band_sizes)
+        if unused is not None and band_sizes[unused] >= band_sizes[derived]:
+            derived = unused
+        rows = np.flatnonzero(np.logical_and(bands >= 0, bands != derived))
+        sums, n_examples = sums_func(rows, bands[rows]*self.n_classes + self.class_idx[rows], n_bands*self.n_classes)
+        if derived == unused:
+            return sums, n_examples
+
+        # Compute sums for band with most examples from sums for all examples of each class.
+        total = self.diff_counts(idx) if counts else self.abs_diff_sums(idx)
+        n_excluded = np.bincount(self.class_idx[bands < 0], minlength=self.n_classes)
+        derived_rows = slice(derived*self.n_classes, (derived + 1)*self.n_classes)
+        sums[derived_rows] = total - np.sum(sums.reshape(n_bands, self.n_classes, -1), 0)
+        n_examples[derived_rows] = self.class_counts - n_excluded - np.sum(n_examples.reshape(n_bands, self.n_classes), 0)
+
+        # Clear rounding residues of sums for classes without examples in band.
+        sums[derived_rows][n_examples[derived_rows] == 0] = 0
+        return sums, n_examples
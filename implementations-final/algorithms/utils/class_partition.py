@@ -0,0 +1,124 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class ClassPartition:
+
+    """Examples grouped by class into a single contiguous matrix
+
+    The rows of the data matrix are (stably) sorted by class so that the examples of each
+    class form a contiguous block. Class blocks are returned as views so that no copying
+    is needed when searching for nearest neighbours from a particular class. The partition
+    also holds the class prior probabilities and the probability weights used for nearest misses.
+    """
+
+    def __init__(self, data, target):
+        """
+        Construct partition of examples by class.
+
+        Args:
+            data : Array[np.float64] -- matrix containing examples' data as rows (if None, only the indices
+            of examples are grouped by class and the block method cannot be used)
+            target : Array[np.int] -- vector of target values of examples
+        """
+
+        # Get unique classes and numbers of examples in each class.
+        self.classes, counts = np.unique(target, return_counts=True)
+
+        # Get index of class of each example (index into classes array).
+        self.class_idx = np.searchsorted(self.classes, target)
+
+        # Sort examples by class. Stable sort preserves the order of examples within each class.
+        self.order = np.argsort(self.class_idx, kind='stable')
+        if data is None:
+            self.data = None
+        elif sp.issparse(data):
+            self.data = data[self.order, :]
+        else:
+            self.data = np.ascontiguousarray(data[self.order, :])
+
+        # Get offsets of class blocks.
+        self.offsets = np.hstack((0, np.cumsum(counts)))
+
+        # Slicing sparse matrices copies the rows so the class blocks of sparse matrices are sliced once.
+        if sp.issparse(self.data):
+            self._blocks = [self.data[self.offsets[c]:self.offsets[c+1], :] for c in np.arange(self.classes.size)]
+
+        # Get position of each example in sorted matrix.
+        self.position = np.empty(target.size, dtype=np.int64)
+        self.position[self.order] = np.arange(target.size)
+
+        # Get probabilities of classes in training set.
+        self.p_classes = counts/np.float64(target.size)
+
+        # Compute probability weights of other classes for examples of each class.
+        self._p_weights = [np.delete(self.p_classes, c)/(1 - self.p_classes[c]) for c in np.arange(self.classes.size)]
+
+
+    def block(self, c):
+        """
+        Get examples with class at index c.
+
+        Args:
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.float64] -- view of examples with class at index c
+        """
+        if sp.issparse(self.data):
+            return self._blocks[c]
+        return self.data[self.offsets[c]:self.offsets[c+1], :]
+
+
+    def original_idx(self, c):
+        """
+        Get indices of examples with class at index c in the original data matrix.
+
+        Args:
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.int] -- indices of examples in original data matrix
+        """
+        return self.order[self.offsets[c]:self.offsets[c+1]]
+
+
+    def idx_in_class(self, idx):
+        """
+        Get index of example within the block of examples with the same class.
+
+        Args:
+            idx : int -- index of example in the original data matrix
+
+        Returns:
+            int -- index of example in its class block
+        """
+        return self.position[idx] - self.offsets[self.class_idx[idx]]
+
+
+    def other_classes(self, c):
+        """
+        Get indices of classes not equal to class at index c in increasing order.
+
+        Args:
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.int] -- indices of other classes
+        """
+        return np.delete(np.arange(self.classes.size), c)
+
+
+    def p_weights(self, c):
+        """
+        Get probability weights of classes other than the class at index c.
+        The weights are the class prior probabilities normalized by 1 - p(c).
+
+        Args:
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.float64] -- probability weights of other classes
+        """
+        return self._p_weights[c]
+
@@ -0,0 +1,131 @@
+import numpy as np
+from scipy.spatial.distance import pdist, squareform
+from algorithms.utils.metrics import Metric, BLOCK_ELEMENTS
+from algorithms.utils.dtypes import float_dtype
+
+
+class CondensedDistances:
+
+    """Distances between all pairs of examples stored as a condensed upper triangular vector
+
+    The distance between examples i < j is stored at index n*i - i*(i+1)/2 + j - i - 1 (the ordering used
+    by scipy's pdist function). Rows of the distance matrix are assembled from the vector when accessed
+    so that the square matrix is never materialised. Converting the store to an array expands it to the
+    square matrix.
+    """
+
+    def __init__(self, values, n):
+        """
+        Args:
+            values : Array[np.float64] -- condensed vector of distances
+            n : int -- number of examples
+        """
+        self.values = values
+        self.n = n
+
+        # Get index of distance between each example and the next example and offsets
+        # for indexing distances to previous examples.
+        self._row_start = n*np.arange(n) - np.arange(n)*(np.arange(n) + 1)//2
+        self._col_offset = self._row_start - np.arange(n) - 1
+
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+
+    def __array__(self, dtype=None):
+        return squareform(self.values).astype(dtype if dtype is not None else self.values.dtype, copy=False)
+
+
+    def row(self, idx):
+        """
+        Get distances from example to all examples (the distance to itself is 0).
+
+        Args:
+            idx : int -- index of example
+
+        Returns:
+            Array[np.float64] -- vector of distances
+        """
+        row = np.empty(self.n, dtype=self.values.dtype)
+        row[:idx] = self.values[self._col_offset[:idx] + idx]
+        row[idx] = 0.0
+        row[idx+1:] = self.values[self._row_start[idx]:self._row_start[idx] + self.n - idx - 1]
+        return row
+
+
+    def mean(self):
+        """
+        Get mean of the square distance matrix (including the zero distances of examples to themselves).
+
+        Returns:
+            np.float64 -- mean distance
+        """
+        return 2.0*np.sum(self.values, dtype=np.float64)/(self.n*self.n)
+
+
+def condensed_distances(data, dist_func, dtype=None):
+    """
+    Compute condensed vector of distances between all pairs of examples. Metrics from the registry
+    compute the upper triangular part of the distance matrix for blocks of rows with their vectorised
+    kernels. Other distance functions are evaluated for each pair of examples.
+
+    Args:
+        data : Array[np.float64] -- matrix of examples
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], np.float64]] -- metric or
+        function computing the distance between two examples
+        dtype : type -- floating point type of stored distances (if None, the floating point type of data)
+
+    Returns:
+        Array[np.float64] -- condensed vector of distances
+    """
+    n = data.shape[0]
+    if not isinstance(dist_func, Metric):
+        return pdist(data, dist_func).astype(dtype if dtype is not None else np.float64, copy=False)
+    values = np.empty(n*(n-1)//2, dtype=dtype if dtype is not None else float_dtype(data))
+    row_start = n*np.arange(n) - np.arange(n)*(np.arange(n) + 1)//2
+    block_size = max(1, BLOCK_ELEMENTS//max(n, 1))
+    for start in np.arange(0, n, block_size):
+        dists = dist_func.pairwise(data[start:start+block_size, :], data[start:, :])
+        for i in np.arange(dists.shape[0]):
+            values[row_start[start+i]:row_start[start+i] + n - start - i - 1] = dists[i, i+1:]
+    return values
+
+
+def condensed_index_distances(n, dist_func, dtype=np.float64):
+    """
+    Compute condensed vector of distances between all pairs of examples referenced by their indices
+    (distances in a learned metric space). Only the distances between examples i < j are evaluated. If the
+    distance function accepts an index and an array of indices and returns the vector of distances, it is
+    called once for each example with the indices of all following examples. Else it is called for each pair.
+
+    Args:
+        n : int -- number of examples
+        dist_func : Callable[[int, Union[int, Array[np.int]]], Union[np.float64, Array[np.float64]]] -- function
+        computing distances between examples referenced by their indices
+        dtype : type -- floating point type of stored distances
+
+    Returns:
+        Array[np.float64] -- condensed vector of distances
+    """
+    values = np.empty(n*(n-1)//2, dtype=dtype)
+    if n < 2:
+        return values
+
+    # Check if distance function computes distances to arrays of examples.
+    dists_first = np.asarray(dist_func(0, np.arange(1, n)))
+    vectorised = dists_first.shape == (n-1,)
+
+    row_start = n*np.arange(n) - np.arange(n)*(np.arange(n) + 1)//2
+    for i in np.arange(n-1):
+        if vectorised:
+            values[row_start[i]:row_start[i] + n - i - 1] = dists_first if i == 0 else dist_func(int(i), np.arange(i+1, n))
+        else:
+            values[row_start[i]:row_start[i] + n - i - 1] = [dist_func(int(i), int(j)) for j in np.arange(i+1, n)]
+    return values
@@ -0,0 +1,290 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse as sp
+from algorithms.utils.metrics import METRICS
+
+
+# Default maximal number of bytes of distance matrices held in memory.
+DEFAULT_MAX_BYTES = 2**27
+
+
+def fingerprint(data):
+    """
+    Compute fingerprint of data matrix by hashing its shape, type and buffer. Sparse matrices are
+    fingerprinted by hashing the buffers of their CSR representation.
+
+    Args:
+        data : Union[Array[np.float64], scipy.sparse.spmatrix] -- matrix of examples
+
+    Returns:
+        str -- hexadecimal digest identifying the data matrix
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if sp.issparse(data):
+        data = data.tocsr()
+        digest.update('csr{0}{1}'.format(data.shape, data.dtype.str).encode())
+        for buffer in (data.indptr, data.indices, data.data):
+            digest.update(np.ascontiguousarray(buffer))
+    else:
+        data = np.ascontiguousarray(data)
+        digest.update('{0}{1}'.format(data.shape, data.dtype.str).encode())
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class DistanceCache:
+
+    """Least recently used cache of pairwise distance matrices
+
+    Only distances computed with metrics from the registry are cached. Matrices are keyed by the
+    fingerprint of the data matrix, the name of the metric and the kind of storage (e.g. square matrix
+    or condensed vector of distances). Distances computed with other distance functions are neither
+    cached nor looked up as a function cannot be identified reliably. Cached arrays are shared between
+    callers and are therefore read-only. If the bytes of the matrices held in memory exceed the budget,
+    the least recently used matrices are evicted. If a cache directory is set, matrices are spilled to
+    files in the directory when evicted (or when larger than the budget) and read back as memory-mapped
+    arrays. A disabled cache computes all distances and returns them unchanged.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None, enabled=True):
+        """
+        Args:
+            max_bytes : int -- maximal number of bytes of distance matrices held in memory
+            cache_dir : str -- directory for spilled distance matrices (if None, matrices are not spilled)
+            enabled : bool -- if False, no distance matrices are cached
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def enable(self, max_bytes=None, cache_dir=None):
+        """
+        Enable caching of distance matrices.
+
+        Args:
+            max_bytes : int -- maximal number of bytes of distance matrices held in memory (if None, the budget is not changed)
+            cache_dir : str -- directory for spilled distance matrices (if None, the directory is not changed)
+        """
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+        self.enabled = True
+
+
+    def disable(self):
+        """
+        Disable caching of distance matrices and release the matrices held in memory.
+        """
+        self.enabled = False
+        self.clear()
+
+
+    def cacheable(self, dist_func):
+        """
+        Check if distances computed with distance function are cached.
+
+        Args:
+            dist_func : Union[Metric, Callable] -- metric or distance function
+
+        Returns:
+            bool -- True if the cache is enabled and the distance function is a metric from the registry
+        """
+        return self.enabled and METRICS.get(getattr(dist_func, 'name', None)) is dist_func
+
+
+    def _key(self, data, dist_func, kind):
+        """
+        Get key of distance matrix of data matrix computed with distance function.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            kind : str -- kind of storage of distances
+
+        Returns:
+            Tuple[str, str, str] -- fingerprint of data, metric name and kind of storage
+        """
+        return fingerprint(data), dist_func.name, kind
+
+
+    def _spill_path(self, key):
+        """
+        Get path of file for spilled distance matrix or None if matrices are not spilled.
+
+        Args:
+            key : Tuple[str, str, str] -- key of distance matrix
+
+        Returns:
+            str -- path of file or None
+        """
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, '{0}-{1}-{2}.npy'.format(*key))
+
+
+    def _spill(self, key, dists):
+        """
+        Write distance matrix to cache directory if it can be spilled and is not spilled yet.
+
+        Args:
+            key : Tuple[str, str, str] -- key of distance matrix
+            dists : Array[np.float64] -- distance matrix
+        """
+        path = self._spill_path(key)
+        if path is not None and not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.save(path + '.tmp.npy', dists)
+            os.replace(path + '.tmp.npy', path)
+
+
+    def get(self, data, dist_func, kind='square'):
+        """
+        Get cached distance matrix.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            kind : str -- kind of storage of distances
+
+        Returns:
+            Array[np.float64] -- cached (read-only) distance matrix or None if not cached
+        """
+        if not self.cacheable(dist_func):
+            return None
+        key = self._key(data, dist_func, kind)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        path = self._spill_path(key)
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            return np.load(path, mmap_mode='r')
+        self.misses += 1
+        return None
+
+
+    def put(self, data, dist_func, dists, kind='square'):
+        """
+        Add distance matrix to cache and evict least recently used matrices that exceed the budget.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            dists : Array[np.float64] -- distance matrix
+            kind : str -- kind of storage of distances
+
+        Returns:
+            Array[np.float64] -- distance matrix (made read-only if held in memory)
+        """
+        if not self.cacheable(dist_func):
+            return dists
+        key = self._key(data, dist_func, kind)
+        if dists.nbytes > self.max_bytes:
+            self._spill(key, dists)
+            return dists
+        dists.flags.writeable = False
+        if key in self._entries:
+            self._n_bytes -= self._entries.pop(key).nbytes
+        self._entries[key] = dists
+        self._n_bytes += dists.nbytes
+        while self._n_bytes > self.max_bytes:
+            key_evicted, dists_evicted = self._entries.popitem(last=False)
+            self._n_bytes -= dists_evicted.nbytes
+            self._spill(key_evicted, dists_evicted)
+        return dists
+
+
+    def fits(self, dist_func, n_bytes):
+        """
+        Check if a distance matrix computed with distance function is cached and can be held in memory.
+
+        Args:
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            n_bytes : int -- number of bytes of distance matrix
+
+        Returns:
+            bool -- True if the matrix is cached and does not exceed the budget and False otherwise
+        """
+        return self.cacheable(dist_func) and n_bytes <= self.max_bytes
+
+
+    def pairwise(self, data, dist_func, compute, kind='square'):
+        """
+        Get cached distance matrix or compute it and add it to cache.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+            dist_func : Union[Metric, Callable] -- metric or distance function
+            compute : Callable[[], Array[np.float64]] -- function computing the distance matrix
+            kind : str -- kind of storage of distances
+
+        Returns:
+            Array[np.float64] -- distance matrix (read-only if cached)
+        """
+        dists = self.get(data, dist_func, kind)
+        if dists is None:
+            dists = self.put(data, dist_func, compute(), kind)
+        return dists
+
+
+    def clear(self, spilled=False):
+        """
+        Remove all distance matrices held in memory and reset the numbers of hits and misses.
+
+        Args:
+            spilled : bool -- if True, matrices spilled to the cache directory are also removed
+        """
+        self._entries.clear()
+        self._n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if spilled and self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npy'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+# Distance cache shared by all estimators in the process. The cache is disabled unless enabled
+# explicitly (DISTANCE_CACHE.enable()) and its matrices are released by DISTANCE_CACHE.clear().
+DISTANCE_CACHE = DistanceCache(enabled=False)
+
+
+def iter_distance_rows(data, dist_func, cache=DISTANCE_CACHE):
+    """
+    Iterate over rows of distance matrix of data matrix. If the matrix is cached, its rows are read
+    from the cache. Else the rows are computed and, if the matrix is cacheable and fits in the cache's
+    budget, the matrix is added to the cache when its last row is computed.
+
+    Args:
+        data : Array[np.float64] -- matrix of examples
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- metric or
+        function for evaluating distances between examples. The function should accept an example and a matrix of
+        examples and return the distances.
+        cache : DistanceCache -- distance cache
+
+    Returns:
+        Iterator[Array[np.float64]] -- iterator over rows of distance matrix
+    """
+    dists = cache.get(data, dist_func)
+    if dists is not None:
+        for idx in np.arange(data.shape[0]):
+            yield dists[idx, :]
+    else:
+        collect = cache.fits(dist_func, np.dtype(np.float64).itemsize*data.shape[0]**2)
+        rows = []
+        for idx in np.arange(data.shape[0]):
+            row = dist_func(data[idx, :], data)
+            if collect:
+                rows.append(row)
+                if idx == data.shape[0] - 1:
+                    cache.put(data, dist_func, np.vstack(rows))
+            yield row
@@ -0,0 +1,43 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+# Floating point types that can be used for computing distances and feature value differences.
+COMPUTE_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+def as_compute_dtype(data, dtype):
+    """
+    Convert data matrix to floating point type used for computing distances and feature value
+    differences. The matrix is not copied if it already has the specified type. Sparse matrices
+    are converted to the CSR format.
+
+    Args:
+        data : Union[Array[np.float64], scipy.sparse.spmatrix] -- matrix of examples
+        dtype : Union[type, str] -- np.float32 or np.float64
+
+    Returns:
+        Union[Array[Union[np.float32, np.float64]], scipy.sparse.csr_matrix] -- matrix of examples with specified type
+
+    Raises:
+        ValueError : if dtype is not np.float32 or np.float64
+    """
+    if np.dtype(dtype) not in COMPUTE_DTYPES:
+        raise ValueError('Unknown compute dtype {0}'.format(dtype))
+    if sp.issparse(data):
+        return data.tocsr().astype(dtype, copy=False)
+    return np.asarray(data, dtype=dtype)
+
+
+def float_dtype(*arrays):
+    """
+    Get floating point type of distances and differences computed from arrays. Single precision
+    arrays give single precision results and other arrays (also integer arrays) double precision results.
+
+    Args:
+        *arrays : Array -- arrays of values
+
+    Returns:
+        np.dtype -- floating point type
+    """
+    return np.result_type(np.float32, *[a.dtype if sp.issparse(a) else np.asarray(a).dtype for a in arrays])
@@ -0,0 +1,32 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def group_sums(values, groups, n_groups):
+    """
+    Compute sums of rows of matrix for each group of rows in a single pass. The rows are gathered by
+    group (keeping their order within each group) and the rows of each group are summed in order and
+    accumulated in double precision so that the sums are identical to summing each group's rows separately.
+
+    Args:
+        values : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of values (e.g. feature value differences) with a
+        row for each example
+        groups : Array[np.int] -- group of each row (rows with negative group are not included in any sum)
+        n_groups : int -- number of groups
+
+    Returns:
+        Array[np.float64], Array[np.int] -- matrix of sums with a row for each group, number of rows in each group
+    """
+    msk = groups >= 0
+    counts = np.bincount(groups[msk], minlength=n_groups)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    rows = np.argsort(np.where(msk, groups, n_groups), kind='stable')[:bounds[-1]]
+    grouped = values[rows]
+    sums = np.zeros((n_groups, values.shape[1]), dtype=np.float64)
+    for group in np.flatnonzero(counts):
+        block = grouped[bounds[group]:bounds[group+1]]
+        if sp.issparse(block):
+            sums[group] = np.asarray(block.sum(0, dtype=np.float64)).ravel()
+        else:
+            sums[group] = np.sum(block, 0, dtype=np.float64)
+    return sums, counts
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class ReferenceSet:
+
+    """Examples stored for nearest neighbours search in incremental feature weights updates
+
+    If the size of the reference set is bounded, reservoir sampling is used to keep a uniform random
+    sample of the examples seen so far so that the memory used does not grow with the number of examples.
+    """
+
+    def __init__(self, size=None):
+        """
+        Args:
+            size : int -- maximal number of stored examples (if None, all examples are stored)
+        """
+        self.size = size
+        self._data = None
+        self._target = None
+        self.n_stored = 0
+        self.n_seen = 0
+
+
+    @property
+    def data(self):
+        return None if self._data is None else self._data[:self.n_stored, :]
+
+
+    @property
+    def target(self):
+        return None if self._target is None else self._target[:self.n_stored]
+
+
+    def __len__(self):
+        return self.n_stored
+
+
+    def add(self, data, target):
+        """
+        Add batch of examples to reference set.
+
+        Args:
+            data : Array[np.float64] -- matrix of new examples
+            target : Array[np.int] -- vector of target values of new examples
+        """
+
+        # If reference set is not bounded, add all examples.
+        if self.size is None:
+            self._data = np.array(data) if self._data is None else np.vstack((self._data, data))
+            self._target = np.array(target) if self._target is None else np.hstack((self._target, target))
+            self.n_stored += target.size
+            self.n_seen += target.size
+            return
+
+        # Allocate storage for examples when first batch is added.
+        if self._data is None:
+            self._data = np.empty((self.size, data.shape[1]), dtype=data.dtype)
+            self._target = np.empty(self.size, dtype=target.dtype)
+
+        # Fill reference set up to its size with first examples of batch.
+        n_fill = min(self.size - self.n_stored, target.size)
+        self._data[self.n_stored:self.n_stored+n_fill, :] = data[:n_fill, :]
+        self._target[self.n_stored:self.n_stored+n_fill] = target[:n_fill]
+        self.n_stored += n_fill
+        self.n_seen += n_fill
+
+        # Replace random stored examples with remaining examples (reservoir sampling).
+        for i in np.arange(n_fill, target.size):
+            j = np.random.randint(0, self.n_seen + 1)
+            if j < self.size:
+                self._data[j, :] = data[i, :]
+                self._target[j] = target[i]
+            self.n_seen += 1
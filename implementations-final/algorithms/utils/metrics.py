@@ -0,0 +1,400 @@
+import numpy as np
+import scipy.sparse as sp
+import weakref
+from collections import OrderedDict
+from scipy.spatial.distance import cdist
+from sklearn.metrics.pairwise import manhattan_distances
+from sklearn.metrics import pairwise_distances
+from algorithms.utils.dtypes import float_dtype
+
+
+# Number of set bits in each 16-bit value.
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in np.arange(2**16)], dtype=np.uint8)
+
+# Maximal number of elements of intermediate arrays in blocked kernels.
+BLOCK_ELEMENTS = 2**22
+
+# Maximal number of sparse matrices for which squared norms of rows are cached.
+SQ_NORMS_CACHE_SIZE = 8
+
+# Cached squared norms of rows of sparse matrices (keyed by identity of matrix).
+_sq_norms_cache = OrderedDict()
+
+
+class Metric:
+
+    """Distance metric with a vectorised kernel for computing pairwise distances
+
+    Calling the metric with two examples returns the distance between them. Calling it with an
+    example and a matrix of examples returns the vector of distances from the example to each row.
+    Distances between single precision examples are returned in single precision. Metrics with a
+    sparse kernel also accept sparse (CSR) examples.
+    """
+
+    def __init__(self, name, dist, pairwise, sparse_pairwise=None):
+        """
+        Args:
+            name : str -- name of metric
+            dist : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function computing distances
+            along the last axis
+            pairwise : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function computing matrix
+            of distances between rows of two matrices
+            sparse_pairwise : Callable[[scipy.sparse.csr_matrix, scipy.sparse.csr_matrix], Array[np.float64]] -- function
+            computing matrix of distances between rows of two sparse matrices (None if sparse matrices are not supported)
+        """
+        self.name = name
+        self._dist = dist
+        self._pairwise = pairwise
+        self._sparse_pairwise = sparse_pairwise
+
+
+    @property
+    def supports_sparse(self):
+        return self._sparse_pairwise is not None
+
+
+    def __call__(self, x1, x2):
+        if sp.issparse(x1) or sp.issparse(x2):
+            return np.ravel(self.pairwise(x1, x2))
+        return self._dist(x1, x2)
+
+
+    def pairwise(self, x1, x2=None):
+        """
+        Compute matrix of distances between rows of x1 and rows of x2.
+
+        Args:
+            x1 : Array[np.float64] -- matrix of examples
+            x2 : Array[np.float64] -- matrix of examples (if None, distances between rows of x1 are computed)
+
+        Returns:
+            Array[np.float64] -- matrix of distances
+
+        Raises:
+            ValueError : if the matrices are sparse and the metric does not support sparse matrices
+        """
+        pairwise = self._pairwise
+        if sp.issparse(x1) or (x2 is not None and sp.issparse(x2)):
+            if self._sparse_pairwise is None:
+                raise ValueError('Metric {0} does not support sparse data'.format(self.name))
+            pairwise = self._sparse_pairwise
+        if x2 is None:
+            dists = pairwise(x1, x1)
+            np.fill_diagonal(dists, 0.0)
+            return dists
+        else:
+            return pairwise(x1, x2)
+
+
+class WeightedMetric:
+
+    """Feature-weighted distance metric with a vectorised kernel for computing pairwise distances
+
+    The metric is called with a vector of feature weights as the first argument. The feature weights
+    are converted to the floating point type of the examples. If the distances are linear in nonnegative
+    feature weights, the unweighted per-feature terms of the distances can be computed once and
+    weighted by a matrix-vector product whenever the feature weights change.
+    """
+
+    def __init__(self, name, dist, pairwise, linear_terms=None):
+        """
+        Args:
+            name : str -- name of metric
+            dist : Callable[[Array[np.float64], Array[np.float64], Array[np.float64]], Array[np.float64]] -- function
+            computing weighted distances along the last axis
+            pairwise : Callable[[Array[np.float64], Array[np.float64], Array[np.float64]], Array[np.float64]] -- function
+            computing matrix of weighted distances between rows of two matrices
+            linear_terms : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function computing
+            per-feature terms whose dot product with nonnegative feature weights is the distance (None if the distances
+            are not linear in feature weights)
+        """
+        self.name = name
+        self._dist = dist
+        self._pairwise = pairwise
+        self.linear_terms = linear_terms
+
+
+    def __call__(self, w, x1, x2):
+        return self._dist(np.asarray(w, dtype=float_dtype(x1, x2)), x1, x2)
+
+
+    def pairwise(self, w, x1, x2=None):
+        """
+        Compute matrix of weighted distances between rows of x1 and rows of x2.
+
+        Args:
+            w : Array[np.float64] -- feature weights
+            x1 : Array[np.float64] -- matrix of examples
+            x2 : Array[np.float64] -- matrix of examples (if None, distances between rows of x1 are computed)
+
+        Returns:
+            Array[np.float64] -- matrix of distances
+        """
+        w = np.asarray(w, dtype=float_dtype(x1, x1 if x2 is None else x2))
+        if x2 is None:
+            dists = self._pairwise(w, x1, x1)
+            np.fill_diagonal(dists, 0.0)
+            return dists
+        else:
+            return self._pairwise(w, x1, x2)
+
+
+def _pairwise_sqeuclidean(x1, x2):
+    """
+    Compute matrix of squared euclidean distances using matrix multiplication. The squared norms and
+    dot products are accumulated in double precision so that distances between nearly identical single
+    precision examples do not cancel catastrophically. Single precision (and integer) matrices are
+    converted to double precision in blocks of rows so that only blocks are copied.
+
+    Args:
+        x1 : Array[np.float64] -- matrix of examples
+        x2 : Array[np.float64] -- matrix of examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    if x1.dtype == np.float64 and x2.dtype == np.float64:
+        dists = -2.0*np.dot(x1, x2.T)
+        dists += np.sum(x1**2, 1)[np.newaxis].T
+        dists += np.sum(x2**2, 1)
+        return np.maximum(dists, 0.0, out=dists)
+
+    dists = np.empty((x1.shape[0], x2.shape[0]), dtype=float_dtype(x1, x2))
+    block_size = max(1, min(int(np.sqrt(BLOCK_ELEMENTS)), BLOCK_ELEMENTS//max(x1.shape[1], 1)))
+    for start2 in np.arange(0, x2.shape[0], block_size):
+        block2 = x2[start2:start2+block_size, :].astype(np.float64)
+        sq_norms2 = np.sum(block2**2, 1)
+        for start1 in np.arange(0, x1.shape[0], block_size):
+            block1 = x1[start1:start1+block_size, :].astype(np.float64)
+            block = -2.0*np.dot(block1, block2.T)
+            block += np.sum(block1**2, 1)[np.newaxis].T
+            block += sq_norms2
+            dists[start1:start1+block_size, start2:start2+block_size] = np.maximum(block, 0.0, out=block)
+    return dists
+
+
+def _sparse_sq_norms(x):
+    """
+    Get squared euclidean norms of rows of sparse matrix. The norms of recently used matrices are
+    cached (the matrices are referenced weakly so that the cache does not keep them alive).
+
+    Args:
+        x : scipy.sparse.csr_matrix -- sparse matrix of examples
+
+    Returns:
+        Array[np.float64] -- squared norms of rows
+    """
+    entry = _sq_norms_cache.get(id(x))
+    if entry is not None and entry[0]() is x:
+        _sq_norms_cache.move_to_end(id(x))
+        return entry[1]
+    sq_norms = np.asarray(x.multiply(x).sum(1, dtype=np.float64)).ravel()
+    _sq_norms_cache[id(x)] = (weakref.ref(x), sq_norms)
+    if len(_sq_norms_cache) > SQ_NORMS_CACHE_SIZE:
+        _sq_norms_cache.popitem(last=False)
+    return sq_norms
+
+
+def _pairwise_sparse_sqeuclidean(x1, x2):
+    """
+    Compute matrix of squared euclidean distances between rows of sparse matrices from the sparse
+    product of the matrices and the (cached) squared norms of rows.
+
+    Args:
+        x1 : scipy.sparse.csr_matrix -- sparse matrix of examples
+        x2 : scipy.sparse.csr_matrix -- sparse matrix of examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    x1, x2 = sp.csr_matrix(x1), sp.csr_matrix(x2)
+    dists = -2.0*x1.dot(x2.T).toarray().astype(float_dtype(x1, x2), copy=False)
+    dists += _sparse_sq_norms(x1)[np.newaxis].T
+    dists += _sparse_sq_norms(x2)
+    return np.maximum(dists, 0.0, out=dists)
+
+
+def _pairwise_sparse_manhattan(x1, x2):
+    """
+    Compute matrix of manhattan distances between rows of sparse matrices using only their nonzero values.
+
+    Args:
+        x1 : scipy.sparse.csr_matrix -- sparse matrix of examples
+        x2 : scipy.sparse.csr_matrix -- sparse matrix of examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    return manhattan_distances(sp.csr_matrix(x1), sp.csr_matrix(x2)).astype(float_dtype(x1, x2), copy=False)
+
+
+def _is_binary(x):
+    """
+    Check if all values in matrix are 0 or 1.
+
+    Args:
+        x : Array[np.float64] -- matrix of examples
+
+    Returns:
+        bool -- True if all values are 0 or 1 and False otherwise
+    """
+    return np.all(np.logical_or(x == 0, x == 1))
+
+
+def _pairwise_hamming(x1, x2):
+    """
+    Compute matrix of hamming distances (numbers of features with different values). For binary
+    data, the examples are packed into bits and distances are computed by counting set bits of XOR-ed 16-bit words.
+
+    Args:
+        x1 : Array[np.float64] -- matrix of examples
+        x2 : Array[np.float64] -- matrix of examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    dists = np.empty((x1.shape[0], x2.shape[0]), dtype=float_dtype(x1, x2))
+    if _is_binary(x1) and _is_binary(x2):
+
+        # Pack binary features into bits and view packed bits as 16-bit values.
+        n_bytes = 2*((x1.shape[1] + 15)//16)
+        x1_packed = np.zeros((x1.shape[0], n_bytes), dtype=np.uint8)
+        x2_packed = np.zeros((x2.shape[0], n_bytes), dtype=np.uint8)
+        x1_packed[:, :(x1.shape[1] + 7)//8] = np.packbits(x1.astype(bool), axis=1)
+        x2_packed[:, :(x2.shape[1] + 7)//8] = np.packbits(x2.astype(bool), axis=1)
+        x1_packed, x2_packed = x1_packed.view(np.uint16), x2_packed.view(np.uint16)
+
+        # Count differing bits for blocks of rows.
+        block_size = max(1, BLOCK_ELEMENTS//max(x2.shape[0]*x1_packed.shape[1], 1))
+        for start in np.arange(0, x1.shape[0], block_size):
+            xor = np.bitwise_xor(x1_packed[start:start+block_size, np.newaxis, :], x2_packed[np.newaxis, :, :])
+            dists[start:start+block_size, :] = np.sum(POPCOUNT_TABLE[xor], 2, dtype=np.int64)
+    else:
+        # Count differing values feature by feature.
+        dists[:] = 0.0
+        for f_idx in np.arange(x1.shape[1]):
+            dists += x1[:, f_idx][np.newaxis].T != x2[:, f_idx]
+    return dists
+
+
+def _pairwise_weighted_hamming(w, x1, x2):
+    """
+    Compute matrix of weighted hamming distances (sums of weights of features with different values).
+    For binary data, the distances are computed using matrix multiplication.
+
+    Args:
+        w : Array[np.float64] -- feature weights
+        x1 : Array[np.float64] -- matrix of examples
+        x2 : Array[np.float64] -- matrix of examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    if _is_binary(x1) and _is_binary(x2):
+        # For binary values, xor(a, b) = a + b - 2ab.
+        dists = -2.0*np.dot(x1*w, x2.T)
+        dists += np.dot(x1, w)[np.newaxis].T
+        dists += np.dot(x2, w)
+        return dists
+    else:
+        dists = np.zeros((x1.shape[0], x2.shape[0]), dtype=float_dtype(w, x1, x2))
+        for f_idx in np.arange(x1.shape[1]):
+            dists += w[f_idx]*(x1[:, f_idx][np.newaxis].T != x2[:, f_idx])
+        return dists
+
+
+def _pairwise_cdist(x1, x2, metric):
+    """
+    Compute matrix of distances using scipy's cdist function. The distances are computed in double
+    precision and returned in the floating point type of the examples.
+
+    Args:
+        x1 : Array[np.float64] -- matrix of examples
+        x2 : Array[np.float64] -- matrix of examples
+        metric : str -- name of metric in scipy
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    return cdist(x1, x2, metric).astype(float_dtype(x1, x2), copy=False)
+
+
+# Registry of metrics.
+METRICS = {
+    'manhattan' : Metric('manhattan',
+        lambda x1, x2: np.sum(np.abs(x1-x2), -1),
+        lambda x1, x2: _pairwise_cdist(x1, x2, 'cityblock'),
+        _pairwise_sparse_manhattan),
+    'euclidean' : Metric('euclidean',
+        lambda x1, x2: np.sqrt(np.sum((x1-x2)**2, -1)),
+        lambda x1, x2: np.sqrt(_pairwise_sqeuclidean(x1, x2)),
+        lambda x1, x2: np.sqrt(_pairwise_sparse_sqeuclidean(x1, x2))),
+    'sqeuclidean' : Metric('sqeuclidean',
+        lambda x1, x2: np.sum((x1-x2)**2, -1),
+        _pairwise_sqeuclidean,
+        _pairwise_sparse_sqeuclidean),
+    'chebyshev' : Metric('chebyshev',
+        lambda x1, x2: np.max(np.abs(x1-x2), -1),
+        lambda x1, x2: _pairwise_cdist(x1, x2, 'chebyshev')),
+    'hamming' : Metric('hamming',
+        lambda x1, x2: np.sum(x1 != x2, -1).astype(float_dtype(x1, x2)),
+        _pairwise_hamming),
+}
+
+# Registry of weighted metrics. Weighted Minkowski distances are distances between examples with
+# features multiplied by their weights. Weighted manhattan and hamming distances are linear in
+# nonnegative feature weights.
+WEIGHTED_METRICS = dict(
+    [('weighted_' + name, WeightedMetric('weighted_' + name,
+        lambda w, x1, x2, metric=METRICS[name]: metric(w*x1, w*x2),
+        lambda w, x1, x2, metric=METRICS[name]: metric.pairwise(x1*w, x2*w),
+        (lambda x1, x2: np.abs(x1-x2)) if name == 'manhattan' else None))
+        for name in ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev')] +
+    [('weighted_hamming', WeightedMetric('weighted_hamming',
+        lambda w, x1, x2: np.sum(w*(x1 != x2), -1),
+        _pairwise_weighted_hamming,
+        lambda x1, x2: (x1 != x2).astype(float_dtype(x1, x2))))])
+
+
+def get_metric(dist_func, weighted=False):
+    """
+    Get metric with specified name or return passed distance function.
+
+    Args:
+        dist_func : Union[str, Callable] -- name of metric or distance function
+        weighted : bool -- if True, the name must be the name of a weighted metric (for algorithms whose distance
+        functions accept feature weights)
+
+    Returns:
+        Union[Metric, WeightedMetric, Callable] -- metric or passed distance function
+
+    Raises:
+        ValueError : if there is no (weighted) metric with specified name
+    """
+    if isinstance(dist_func, str):
+        registry = WEIGHTED_METRICS if weighted else METRICS
+        if dist_func not in registry:
+            raise ValueError('Unknown {0}metric {1}'.format('weighted ' if weighted else '', dist_func))
+        return registry[dist_func]
+    else:
+        return dist_func
+
+
+def pairwise_distance_matrix(data, dist_func):
+    """
+    Compute matrix of distances between all pairs of examples. Metrics from the registry use
+    their vectorised kernels. Other distance functions are evaluated for each pair of examples.
+
+    Args:
+        data : Array[np.float64] -- matrix of examples
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], np.float64]] -- metric or
+        function computing the distance between two examples
+
+    Returns:
+        Array[np.float64] -- matrix of distances
+    """
+    if isinstance(dist_func, Metric):
+        return dist_func.pairwise(data)
+    else:
+        return pairwise_distances(data, metric=dist_func)
+
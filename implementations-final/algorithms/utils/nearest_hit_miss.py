@@ -0,0 +1,131 @@
+import numpy as np
+from algorithms.utils.metrics import Metric
+from algorithms.utils.dtypes import float_dtype
+
+
+def block_distances(data, idx_block, dist_func, **kwargs):
+    """
+    Compute matrix of distances from a block of examples to all examples in the training set.
+
+    Args:
+        data : Array[np.float64] -- matrix containing examples' data as rows
+        idx_block : Array[np.int] -- indices of examples in the block
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- metric or
+        function for evaluating distances between examples. The function should accept an example and a matrix of
+        examples and return the distances.
+        **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
+        function and indices of two training examples and returns the distance between the examples in the learned
+        metric space.
+
+    Returns:
+        Array[np.float64] -- matrix of distances with a row for each example in the block
+    """
+
+    # If using a metric from the registry, compute block of distances with its vectorised kernel.
+    if isinstance(dist_func, Metric) and 'learned_metric_func' not in kwargs:
+        return dist_func.pairwise(data[idx_block, :], data)
+
+    # Allocate matrix for block of distances.
+    dists = np.empty((idx_block.size, data.shape[0]), dtype=float_dtype(data))
+
+    # Compute rows of distances. Each row is computed in a single call against the whole data matrix.
+    if 'learned_metric_func' in kwargs:
+        idx_all = np.arange(data.shape[0])
+        for i, idx in enumerate(idx_block):
+            dists[i, :] = kwargs['learned_metric_func'](dist_func, int(idx), idx_all)
+    else:
+        for i, idx in enumerate(idx_block):
+            dists[i, :] = dist_func(data[idx, :], data)
+
+    return dists
+
+
+def nearest_hit_miss(data, target, idx_block, dist_func, **kwargs):
+    """
+    Find nearest hit and nearest miss for each example in a block of examples.
+
+    Args:
+        data : Array[np.float64] -- matrix containing examples' data as rows
+        target : Array[np.int] -- vector of target values of examples
+        idx_block : Array[np.int] -- indices of examples for which to find the nearest hit and miss
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- metric or
+        function for evaluating distances between examples. The function should accept an example and a matrix of
+        examples and return the distances.
+        **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
+        function and indices of two training examples and returns the distance between the examples in the learned
+        metric space.
+
+    Returns:
+        Array[np.int], Array[np.int] -- indices of nearest hits, indices of nearest misses
+    """
+
+    # Compute block of distances.
+    dists = block_distances(data, idx_block, dist_func, **kwargs)
+
+    # Get mask of examples with same class as examples in block.
+    msk_same = target[idx_block, np.newaxis] == target[np.newaxis, :]
+
+    # Find nearest hits. Distances of examples to themselves are set to infinity.
+    d_hit = np.where(msk_same, dists, np.inf)
+    d_hit[np.arange(idx_block.size), idx_block] = np.inf
+    idx_hit = np.argmin(d_hit, 1)
+
+    # If example is the only one of its class, use example itself as its nearest hit.
+    no_hit = np.isinf(d_hit[np.arange(idx_block.size), idx_hit])
+    idx_hit[no_hit] = idx_block[no_hit]
+
+    # Find nearest misses.
+    d_miss = np.where(msk_same, np.inf, dists)
+    idx_miss = np.argmin(d_miss, 1)
+
+    return idx_hit, idx_miss
+
+
+def nearest_hit_miss_neighbours(neighbours, idx_block):
+    """
+    Find nearest hit and nearest miss for each example in a block of examples using a search
+    for nearest neighbours from each class.
+
+    Args:
+        neighbours : Union[BruteForceNeighbours, TreeNeighbours, RandomProjectionNeighbours, EarlyAbandonNeighbours, PivotNeighbours,
+        QuantisedNeighbours] -- nearest neighbours search
+        idx_block : Array[np.int] -- indices of examples for which to find the nearest hit and miss
+
+    Returns:
+        Array[np.int], Array[np.int] -- indices of nearest hits, indices of nearest misses
+    """
+    partition = neighbours.partition
+
+    # Find nearest neighbour from each class and get its index in the original data matrix.
+    idx_closest, dists_closest = neighbours.kneighbours(idx_block, 1)
+    idx_nearest = np.column_stack([partition.original_idx(c)[idx_closest[c][:, 0]] for c in np.arange(partition.classes.size)])
+    dists_nearest = np.column_stack([dists_c[:, 0] for dists_c in dists_closest])
+
+    # Nearest neighbour from same class is nearest hit. If example is the only one of its class,
+    # the example itself is found as its nearest neighbour.
+    rows = np.arange(idx_block.size)
+    cl_idx = partition.class_idx[idx_block]
+    idx_hit = idx_nearest[rows, cl_idx]
+
+    # Nearest neighbour from other classes is nearest miss.
+    dists_nearest[rows, cl_idx] = np.inf
+    idx_miss = idx_nearest[rows, np.argmin(dists_nearest, 1)]
+
+    return idx_hit, idx_miss
+
+
+def iter_blocks(idx, block_size):
+    """
+    Split array of indices into consecutive blocks of at most block_size elements.
+
+    Args:
+        idx : Array[np.int] -- array of indices
+        block_size : int -- maximal number of indices in a block
+
+    Returns:
+        Iterator[Array[np.int]] -- iterator over blocks of indices
+    """
+
+    for start in np.arange(0, idx.size, block_size):
+        yield idx[start:start+block_size]
+
@@ -0,0 +1,1115 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial.distance import cdist
+from sklearn.neighbors import KDTree, BallTree
+from algorithms.utils.metrics import Metric, BLOCK_ELEMENTS, get_metric
+from algorithms.utils.dtypes import float_dtype
+from algorithms.utils.class_partition import ClassPartition
+
+
+# Names of metrics that can be used with the tree-based nearest neighbours search.
+TREE_METRICS = ('manhattan', 'euclidean', 'chebyshev')
+
+# Maximal dimensionality for which a KD-tree is used instead of a ball tree.
+KD_TREE_MAX_DIM = 16
+
+# Number of queries used to measure recall of approximate nearest neighbours search.
+RECALL_SAMPLE_SIZE = 100
+
+# Metrics whose distances are sums of nonnegative per-feature terms that can be accumulated feature block by
+# feature block and names of scipy's cdist metrics that compute the sums of terms (for hamming, the mean of terms).
+# The euclidean distance is a monotonic function of the sum of its terms so the sum can be used for pruning.
+PARTIAL_DISTANCE_METRICS = {
+    'manhattan' : 'cityblock',
+    'euclidean' : 'sqeuclidean',
+    'sqeuclidean' : 'sqeuclidean',
+    'hamming' : 'hamming',
+}
+
+# Names of true metrics (satisfying the triangle inequality) that can be used with the pivot-based search.
+PIVOT_METRICS = ('manhattan', 'euclidean', 'chebyshev', 'hamming')
+
+# Names of metrics of feature value differences that can be used with the quantised search.
+QUANTISED_METRICS = ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev')
+
+# Minimal fraction of candidates that are not abandoned for which partial sums are computed for all pairs
+# of queries and candidates at once.
+DENSE_SUMS_FRACTION = 0.25
+
+# Number of candidates in chunks from which the pivot-based search selects the candidates whose distances bound
+# the distance to the k-th nearest neighbour.
+SEED_CHUNK_SIZE = 64
+
+# Maximal number of lower bounds of distances computed by the pivot-based search at once.
+LOWER_BOUNDS_BLOCK_ELEMENTS = 2**15
+
+# Maximal number of approximate distances computed from codes of features by the quantised search at once.
+CODES_BLOCK_ELEMENTS = 2**17
+
+# Relative tolerance of comparisons of partial sums with the bound so that rounding errors of the
+# accumulation never abandon a neighbour.
+ABANDON_RTOL = 1.0e-6
+
+
+def smallest_k(dists, k):
+    """
+    Get column indices of the k smallest distances in each row ordered by distance. Ties are broken
+    by column index so that the result does not depend on the order of computation.
+
+    Args:
+        dists : Array[np.float64] -- matrix of distances
+        k : int -- number of smallest distances to select (all columns are selected if there are at most k)
+
+    Returns:
+        Array[np.int] -- matrix of column indices of the smallest distances (a row for each row of distances)
+    """
+
+    # If there are at most k columns, sort all columns.
+    if dists.shape[1] <= k:
+        return np.argsort(dists, axis=1, kind='stable')
+
+    # Select k smallest distances. In rows where distances outside the selection are equal to the largest
+    # selected distance, select examples with the smallest column indices among the tied examples.
+    idx = np.argpartition(dists, k-1, axis=1)[:, :k]
+    kth = np.max(np.take_along_axis(dists, idx, 1), 1)
+    ties = np.sum(dists <= kth[np.newaxis].T, 1) > k
+    if np.any(ties):
+        idx[ties, :] = np.argsort(dists[ties, :], axis=1, kind='stable')[:, :k]
+
+    # Order selected columns by distance and column index.
+    return np.take_along_axis(idx, np.lexsort((idx, np.take_along_axis(dists, idx, 1)), axis=1), 1)
+
+
+def _pair_distances(dist_func, queries, block, idx_query, idx_cand):
+    """
+    Compute distances between pairs of queried examples and examples of a class. The distances are
+    computed with the metric's kernel for blocks of pairs at once.
+
+    Args:
+        dist_func : Metric -- metric
+        queries : Array[np.float64] -- matrix of queried examples
+        block : Array[np.float64] -- matrix of examples of class
+        idx_query : Array[np.int] -- index of query of each pair
+        idx_cand : Array[np.int] -- index of example of class of each pair
+
+    Returns:
+        Array[np.float64] -- distance between examples of each pair
+    """
+    dists = np.empty(idx_query.size, dtype=float_dtype(queries, block))
+    pairs_size = max(1, BLOCK_ELEMENTS//max(block.shape[1], 1))
+    for pos in np.arange(0, idx_query.size, pairs_size):
+        dists[pos:pos+pairs_size] = dist_func(queries[idx_query[pos:pos+pairs_size], :], block[idx_cand[pos:pos+pairs_size], :])
+    return dists
+
+
+def _select_pairs(idx_query, idx_cand, dists, n_queries, k):
+    """
+    Select k closest candidates of each query from distances of pairs of queries and candidates. The pairs
+    are arranged in rows of candidates of each query (padded with infinite distances) so that the selection
+    is made for all queries at once.
+
+    Args:
+        idx_query : Array[np.int] -- index of query of each pair (the pairs are ordered by query and candidate index)
+        idx_cand : Array[np.int] -- index of candidate of each pair
+        dists : Array[np.float64] -- distance between query and candidate of each pair
+        n_queries : int -- number of queries
+        k : int -- number of candidates to select for each query
+
+    Returns:
+        Array[np.int], Array[np.float64] -- matrix of indices of selected candidates (a row for each query),
+        matrix of distances to the selected candidates
+    """
+    n_query_cand = np.bincount(idx_query, minlength=n_queries)
+    cols = np.arange(idx_query.size) - np.repeat(np.cumsum(n_query_cand) - n_query_cand, n_query_cand)
+    dists_padded = np.full((n_queries, max(np.max(n_query_cand, initial=0), k)), np.inf, dtype=dists.dtype)
+    dists_padded[idx_query, cols] = dists
+    cand = np.zeros(dists_padded.shape, dtype=np.int64)
+    cand[idx_query, cols] = idx_cand
+    sel = smallest_k(dists_padded, k)
+    return np.take_along_axis(cand, sel, 1), np.take_along_axis(dists_padded, sel, 1)
+
+
+class BruteForceNeighbours:
+
+    """Exact search for nearest neighbours from each class by computing distances to all examples of the class
+
+    The search works with any distance function and with learned metric functions.
+    """
+
+    def __init__(self, partition, dist_func, **kwargs):
+        """
+        Args:
+            partition : ClassPartition -- examples grouped by class
+            dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- metric or
+            function for evaluating distances between examples. The function should accept an example and a matrix of
+            examples and return the distances.
+            **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
+            function and indices of two training examples and returns the distance between the examples in the learned
+            metric space.
+        """
+        self.partition = partition
+        self.dist_func = dist_func
+        self.learned_metric_func = kwargs.get('learned_metric_func', None)
+        self.exact = True
+
+
+    def _distances(self, idx_block, c):
+        """
+        Compute distances from examples in block to examples with class at index c.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.float64] -- matrix of distances with a row for each queried example
+        """
+        if isinstance(self.dist_func, Metric) and self.learned_metric_func is None:
+            return self.dist_func.pairwise(self.partition.data[self.partition.position[idx_block], :], self.partition.block(c))
+        dists = np.empty((idx_block.size, self.partition.offsets[c+1] - self.partition.offsets[c]), dtype=float_dtype(self.partition.data))
+        if self.learned_metric_func is not None:
+            for i, idx in enumerate(idx_block):
+                dists[i, :] = self.learned_metric_func(self.dist_func, int(idx), self.partition.original_idx(c))
+        else:
+            block = self.partition.block(c)
+            for i, idx in enumerate(idx_block):
+                dists[i, :] = self.dist_func(self.partition.data[self.partition.position[idx], :], block)
+        return dists
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find k nearest neighbours from each class for each queried example. The queried examples
+        are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        idx_closest, dists_closest = [], []
+        for c in np.arange(self.partition.classes.size):
+
+            # Compute distances and set distances of examples to themselves to infinity.
+            dists = self._distances(idx_block, c)
+            in_class = self.partition.class_idx[idx_block] == c
+            dists[np.where(in_class)[0], self.partition.idx_in_class(idx_block[in_class])] = np.inf
+
+            # Find k closest examples.
+            idx_c = smallest_k(dists, k)
+            idx_closest.append(idx_c)
+            dists_closest.append(np.take_along_axis(dists, idx_c, 1))
+
+        return idx_closest, dists_closest
+
+
+class TreeNeighbours:
+
+    """Exact search for nearest neighbours from each class using a spatial index for each class
+
+    A KD-tree is built for low-dimensional data and a ball tree otherwise. The indices are
+    built once and support Minkowski metrics (manhattan, euclidean and chebyshev). As in the
+    brute force search, the found neighbours are ordered by distance and (for equal distances)
+    index and a queried example is its own neighbour only with an infinite distance if its class
+    does not have k other examples.
+    """
+
+    def __init__(self, partition, metric, leaf_size=40):
+        """
+        Args:
+            partition : ClassPartition -- examples grouped by class
+            metric : str -- name of metric ('manhattan', 'euclidean' or 'chebyshev')
+            leaf_size : int -- leaf size of spatial indices
+        """
+        self.partition = partition
+        self.exact = True
+        tree = KDTree if partition.data.shape[1] <= KD_TREE_MAX_DIM else BallTree
+        self.trees = [tree(partition.block(c), leaf_size=leaf_size, metric=metric) for c in np.arange(partition.classes.size)]
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find k nearest neighbours from each class for each queried example. The queried examples
+        are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        queries = self.partition.data[self.partition.position[idx_block], :]
+        idx_closest, dists_closest = [], []
+        for c, tree in enumerate(self.trees):
+
+            # Query for two more neighbours than needed so that the queried example itself can be removed and ties
+            # with examples that were not found can be detected. Queried examples are not candidates for their own neighbours.
+            n_class = self.partition.offsets[c+1] - self.partition.offsets[c]
+            kq = min(k + 2, n_class)
+            dists_c, idx_c = tree.query(queries, k=kq)
+            self_pos = np.where(self.partition.class_idx[idx_block] == c, self.partition.idx_in_class(idx_block), -1)
+            dists_c[idx_c == self_pos[np.newaxis].T] = np.inf
+
+            # Order found examples by distance and index (as the brute force search).
+            order = np.lexsort((idx_c, dists_c), axis=1)
+            idx_c, dists_c = np.take_along_axis(idx_c, order, 1), np.take_along_axis(dists_c, order, 1)
+
+            # Examples that were not found can be tied with the k-th neighbour only if the farthest found example is
+            # (with a tolerance for rounding of the radius). For such queries, find all examples within the distance
+            # to the k-th neighbour and keep the k closest by distance and index.
+            if kq < n_class:
+                radius = dists_c[:, k-1]*(1.0 + ABANDON_RTOL)
+                tied = np.where(np.max(np.where(np.isinf(dists_c), -np.inf, dists_c), 1) <= radius)[0]
+                if tied.size > 0:
+                    for i, ind, dist in zip(tied, *tree.query_radius(queries[tied, :], radius[tied], return_distance=True)):
+                        dist[ind == self_pos[i]] = np.inf
+                        sel = np.lexsort((ind, dist))[:k]
+                        idx_c[i, :k], dists_c[i, :k] = ind[sel], dist[sel]
+            idx_c, dists_c = idx_c[:, :k], dists_c[:, :k]
+
+            idx_closest.append(idx_c)
+            dists_closest.append(dists_c)
+
+        return idx_closest, dists_closest
+
+
+class EarlyAbandonNeighbours:
+
+    """Exact search for nearest neighbours from each class by accumulating distances feature block by feature block
+
+    For each query, the full distances to the k candidates closest in the first block of features
+    bound the distance to the k-th nearest neighbour. The distances to the other candidates are
+    accumulated over blocks of features and a candidate is abandoned once its partial sum exceeds the
+    bound. The accumulated sums of the remaining candidates are their distances (square roots of the
+    sums for the euclidean distance) so that no distance is computed twice. The returned distances are
+    therefore rounded differently from the distances computed by the metric's kernels and agree with
+    them only up to rounding. The indices of the found neighbours are the same as those found by the
+    brute force search unless distances of candidates differ only by rounding errors. Features can be
+    ordered by decreasing variance so that the partial sums grow quickly. The numbers of computed
+    distance terms are counted over all searches.
+    """
+
+    def __init__(self, partition, metric, feature_block_size=256, order_by_variance=True):
+        """
+        Args:
+            partition : ClassPartition -- examples grouped by class
+            metric : str -- name of metric ('manhattan', 'euclidean', 'sqeuclidean' or 'hamming')
+            feature_block_size : int -- number of features added to partial sums at once
+            order_by_variance : bool -- if True, features with higher variance are added to partial sums first
+        """
+        self.partition = partition
+        self.dist_func = get_metric(metric)
+        self.exact = True
+        self._cdist_metric = PARTIAL_DISTANCE_METRICS[metric]
+        self._sqrt = metric == 'euclidean'
+        self.feature_order = np.argsort(-np.var(partition.data, 0), kind='stable') if order_by_variance else None
+        self.feature_blocks = [(start, min(start + feature_block_size, partition.data.shape[1]))
+                for start in np.arange(0, partition.data.shape[1], feature_block_size)]
+
+        # Numbers of computed distance terms and of distance terms computed by the brute force search.
+        self.counts = np.zeros(2, dtype=np.int64)
+
+
+    @property
+    def pruning_rate(self):
+        """
+        Fraction of per-feature distance terms computed by the brute force search that were skipped by abandoning
+        candidates since the counts were reset.
+        """
+        return 1.0 - self.counts[0]/np.float64(self.counts[1]) if self.counts[1] > 0 else 0.0
+
+
+    def reset_counts(self):
+        """
+        Reset counts of computed distance terms.
+        """
+        self.counts[:] = 0
+
+
+    def _dense_sums(self, queries, block, features):
+        """
+        Compute sums of distance terms over block of features for all pairs of queries and examples of class.
+
+        Args:
+            queries : Array[np.float64] -- matrix of queried examples
+            block : Array[np.float64] -- matrix of examples of class
+            features : Tuple[int, int] -- start and end of block of features
+
+        Returns:
+            Array[np.float64] -- matrix of sums of terms with a row for each query
+        """
+        start, stop = features
+        self.counts[0] += queries.shape[0]*block.shape[0]*(stop - start)
+        sums = cdist(queries[:, start:stop], block[:, start:stop], self._cdist_metric)
+
+        # Hamming distances computed by cdist are fractions of features with different values.
+        return np.rint(sums*(stop - start)) if self._cdist_metric == 'hamming' else sums
+
+
+    def _pair_sums(self, queries, block, idx_query, idx_cand, features):
+        """
+        Compute sums of distance terms over block of features for pairs of queries and candidates. The
+        differences are computed for blocks of pairs at once.
+
+        Args:
+            queries : Array[np.float64] -- matrix of queried examples
+            block : Array[np.float64] -- matrix of examples of class
+            idx_query : Array[np.int] -- index of query of each pair
+            idx_cand : Array[np.int] -- index of candidate of each pair
+            features : Tuple[int, int] -- start and end of block of features
+
+        Returns:
+            Array[np.float64] -- sums of terms for each pair
+        """
+        start, stop = features
+        self.counts[0] += idx_query.size*(stop - start)
+        sums = np.empty(idx_query.size, dtype=np.float64)
+        pairs_size = max(1, BLOCK_ELEMENTS//max(stop - start, 1))
+        for pos in np.arange(0, idx_query.size, pairs_size):
+            diffs = queries[idx_query[pos:pos+pairs_size], start:stop] - block[idx_cand[pos:pos+pairs_size], start:stop]
+            if self._cdist_metric == 'cityblock':
+                sums[pos:pos+pairs_size] = np.sum(np.abs(diffs), 1)
+            elif self._cdist_metric == 'sqeuclidean':
+                sums[pos:pos+pairs_size] = np.sum(diffs**2, 1)
+            else:
+                sums[pos:pos+pairs_size] = np.sum(diffs != 0, 1)
+        return sums
+
+
+    def _distances(self, queries, block, self_pos, k):
+        """
+        Compute distances from queries to candidates that are not abandoned when searching for the k nearest
+        neighbours of queries.
+
+        Args:
+            queries : Array[np.float64] -- matrix of queried examples (features in order of accumulation)
+            block : Array[np.float64] -- matrix of examples of class (features in order of accumulation)
+            self_pos : Array[np.int] -- index of each queried example in the class block (-1 if not in block)
+            k : int -- number of nearest neighbours
+
+        Returns:
+            Array[np.float64] -- matrix of distances with a row for each query (distances to abandoned candidates
+            and of queried examples to themselves are infinite)
+        """
+
+        # Accumulate first block of features. Queried examples are not candidates for their own neighbours.
+        self.counts[1] += queries.shape[0]*block.shape[0]*block.shape[1]
+        partial = self._dense_sums(queries, block, self.feature_blocks[0])
+        in_block = np.where(self_pos >= 0)[0]
+        partial[in_block, self_pos[in_block]] = np.inf
+
+        # If there are at most k candidates, all are neighbours.
+        if block.shape[0] - 1 <= k:
+            for features in self.feature_blocks[1:]:
+                partial += self._dense_sums(queries, block, features)
+        elif len(self.feature_blocks) > 1:
+
+            # Bound distances to k-th nearest neighbours by full distances to the k candidates with smallest partial sums.
+            seeds = np.argpartition(partial, k-1, axis=1)[:, :k].ravel()
+            seeds_query = np.repeat(np.arange(queries.shape[0]), k)
+            seed_sums = partial[seeds_query, seeds] + sum(self._pair_sums(queries, block, seeds_query, seeds, features)
+                    for features in self.feature_blocks[1:])
+            bound = np.max(seed_sums.reshape(-1, k), 1)*(1.0 + ABANDON_RTOL)
+            msk_seed = np.zeros(partial.shape, dtype=bool)
+            msk_seed[seeds_query, seeds] = True
+
+            # Add blocks of features to partial sums of other candidates that are not abandoned. If most candidates
+            # are not abandoned, the sums are computed for all pairs at once.
+            for features in self.feature_blocks[1:]:
+                msk_keep = partial <= bound[np.newaxis].T
+                msk_keep[msk_seed] = False
+                partial[~np.logical_or(msk_keep, msk_seed)] = np.inf
+                if np.count_nonzero(msk_keep) >= DENSE_SUMS_FRACTION*partial.size:
+                    np.add(partial, self._dense_sums(queries, block, features), out=partial, where=msk_keep)
+                else:
+                    idx_query, idx_cand = np.nonzero(msk_keep)
+                    partial[idx_query, idx_cand] += self._pair_sums(queries, block, idx_query, idx_cand, features)
+            partial[seeds_query, seeds] = seed_sums
+
+        dists = partial.astype(float_dtype(block), copy=False)
+        return np.sqrt(dists, out=dists) if self._sqrt else dists
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find k nearest neighbours from each class for each queried example. The queried examples
+        are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        queries = self.partition.data[self.partition.position[idx_block], :]
+        if self.feature_order is not None:
+            queries = queries[:, self.feature_order]
+        idx_closest, dists_closest = [], []
+        for c in np.arange(self.partition.classes.size):
+            block = self.partition.block(c)
+            self_pos = np.where(self.partition.class_idx[idx_block] == c, self.partition.idx_in_class(idx_block), -1)
+
+            # Compute distances to candidates that are not abandoned. Distances to other examples are infinite.
+            dists = self._distances(queries, block if self.feature_order is None else block[:, self.feature_order], self_pos, k)
+
+            # Find k closest examples.
+            idx_c = smallest_k(dists, k)
+            idx_closest.append(idx_c)
+            dists_closest.append(np.take_along_axis(dists, idx_c, 1))
+
+        return idx_closest, dists_closest
+
+
+class PivotNeighbours:
+
+    """Exact search for nearest neighbours from each class that skips candidates using distances to pivots
+
+    A few pivot examples are selected in each class (the first at random and each next as the example
+    farthest from the selected pivots) and the distances from all examples of the class to the pivots
+    are computed once. By the triangle inequality, max_p |d(q, p) - d(x, p)| is a lower bound of the
+    distance between query q and candidate x. The full distances to the k candidates with the smallest
+    bounds bound the distance to the k-th nearest neighbour and the distances are computed only to the
+    candidates whose lower bounds do not exceed it. The bounds are computed for all queries of a block
+    at once (in single precision with a tolerance for rounding errors). If most candidates remain, the
+    distances to all examples are computed at once. The found neighbours are the same as those found by
+    the brute force search (the distances agree up to rounding). The numbers of computed distances are
+    counted over all searches.
+    """
+
+    def __init__(self, partition, metric, n_pivots=8):
+        """
+        Args:
+            partition : ClassPartition -- examples grouped by class
+            metric : str -- name of metric ('manhattan', 'euclidean', 'chebyshev' or 'hamming')
+            n_pivots : int -- number of pivots selected in each class
+        """
+        self.partition = partition
+        self.dist_func = get_metric(metric)
+        self.exact = True
+        self.pivots, self.pivot_dists = [], []
+        for c in np.arange(partition.classes.size):
+            block = partition.block(c)
+            pivots = [np.random.randint(block.shape[0])]
+            pivot_dists = [self.dist_func.pairwise(block[pivots[0]:pivots[0]+1, :], block)[0, :]]
+            while len(pivots) < min(n_pivots, block.shape[0]):
+                pivots.append(int(np.argmax(np.min(pivot_dists, 0))))
+                pivot_dists.append(self.dist_func.pairwise(block[pivots[-1]:pivots[-1]+1, :], block)[0, :])
+            self.pivots.append(np.array(pivots))
+            self.pivot_dists.append(np.column_stack(pivot_dists))
+
+        # Distances of examples to each pivot in single precision (a row for each pivot).
+        self._pivot_dists_t = [np.ascontiguousarray(pivot_dists.T, dtype=np.float32) for pivot_dists in self.pivot_dists]
+
+        # Numbers of computed distances and of distances computed by the brute force search.
+        self.counts = np.zeros(2, dtype=np.int64)
+
+
+    @property
+    def pruning_rate(self):
+        """
+        Fraction of distances computed by the brute force search that were skipped since the counts were reset.
+        """
+        return 1.0 - self.counts[0]/np.float64(self.counts[1]) if self.counts[1] > 0 else 0.0
+
+
+    def reset_counts(self):
+        """
+        Reset counts of computed distances.
+        """
+        self.counts[:] = 0
+
+
+    def _lower_bounds(self, dists_query, c):
+        """
+        Compute lower bounds of distances from queries to examples of class using distances to pivots.
+
+        Args:
+            dists_query : Array[np.float64] -- matrix of distances from queries to pivots
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.float32] -- matrix of lower bounds (a row for each query)
+        """
+        pivot_dists_t = self._pivot_dists_t[c]
+        dists_query = dists_query.astype(np.float32)
+        lower = np.empty((dists_query.shape[0], pivot_dists_t.shape[1]), dtype=np.float32)
+
+        # Compute bounds for blocks of queries so that the intermediate arrays stay small.
+        rows = max(1, LOWER_BOUNDS_BLOCK_ELEMENTS//max(pivot_dists_t.shape[1], 1))
+        diffs = np.empty((min(rows, lower.shape[0]), lower.shape[1]), dtype=np.float32)
+        for start in np.arange(0, lower.shape[0], rows):
+            lower_block, diffs_block = lower[start:start+rows, :], diffs[:min(rows, lower.shape[0] - start), :]
+            np.abs(np.subtract(dists_query[start:start+rows, 0, np.newaxis], pivot_dists_t[0, :], out=lower_block), out=lower_block)
+            for p in np.arange(1, pivot_dists_t.shape[0]):
+                np.subtract(dists_query[start:start+rows, p, np.newaxis], pivot_dists_t[p, :], out=diffs_block)
+                np.maximum(lower_block, np.abs(diffs_block, out=diffs_block), out=lower_block)
+        return lower
+
+
+    def _kneighbours_class(self, queries, c, self_pos, k):
+        """
+        Find k nearest neighbours from class for each query.
+
+        Args:
+            queries : Array[np.float64] -- matrix of queried examples
+            c : int -- index of class in classes array
+            self_pos : Array[np.int] -- index of each queried example in the class block (-1 if not in block)
+            k : int -- number of nearest neighbours
+
+        Returns:
+            Array[np.int], Array[np.float64] -- matrix of indices of nearest neighbours in the class block (a row for
+            each query), matrix of distances to the nearest neighbours
+        """
+        block = self.partition.block(c)
+        self.counts[1] += queries.shape[0]*block.shape[0]
+        in_block = np.where(self_pos >= 0)[0]
+
+        if block.shape[0] > k + 1:
+
+            # Compute lower bounds of distances. Queried examples are not candidates for their own neighbours.
+            dists_query = self.dist_func.pairwise(queries, block[self.pivots[c], :])
+            self.counts[0] += dists_query.size
+            lower = self._lower_bounds(dists_query, c)
+            lower[in_block, self_pos[in_block]] = np.inf
+
+            # Bound distances to k-th nearest neighbours by full distances to k candidates with small lower bounds. The
+            # candidates are split into chunks and the candidates with smallest lower bounds in the k chunks with smallest
+            # minimal lower bounds are selected.
+            chunk_size = max(1, min(SEED_CHUNK_SIZE, block.shape[0]//k))
+            chunks = lower[:, :block.shape[0] - block.shape[0] % chunk_size].reshape(queries.shape[0], -1, chunk_size)
+            seeds = np.argpartition(np.min(chunks, 2), k-1, axis=1)[:, :k]
+            seeds = seeds*chunk_size + np.argmin(np.take_along_axis(chunks, seeds[:, :, np.newaxis], 1), 2)
+            seeds_query = np.repeat(np.arange(queries.shape[0]), k)
+            seed_dists = _pair_distances(self.dist_func, queries, block, seeds_query, seeds.ravel())
+            seed_dists[np.isinf(np.take_along_axis(lower, seeds, 1).ravel())] = np.inf
+            self.counts[0] += seed_dists.size
+            tol = ABANDON_RTOL*(np.max(dists_query, 1) + np.max(self.pivot_dists[c]))
+            bound = np.max(seed_dists.reshape(-1, k), 1) + tol
+
+            # Get candidates whose lower bounds do not exceed the bound.
+            msk_cand = lower <= bound[np.newaxis].T
+            n_cand = np.count_nonzero(msk_cand)
+
+        # If most candidates remain, compute distances to all examples.
+        if block.shape[0] <= k + 1 or n_cand >= DENSE_SUMS_FRACTION*msk_cand.size:
+            dists = self.dist_func.pairwise(queries, block)
+            self.counts[0] += dists.size
+            dists[in_block, self_pos[in_block]] = np.inf
+            idx_c = smallest_k(dists, k)
+            return idx_c, np.take_along_axis(dists, idx_c, 1)
+
+        # Compute distances to remaining candidates (including the seeds) and select the k closest candidates of each query.
+        idx_query, idx_cand = np.nonzero(msk_cand)
+        self.counts[0] += idx_query.size
+        return _select_pairs(idx_query, idx_cand, _pair_distances(self.dist_func, queries, block, idx_query, idx_cand), queries.shape[0], k)
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find k nearest neighbours from each class for each queried example. The queried examples
+        are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        queries = self.partition.data[self.partition.position[idx_block], :]
+        idx_closest, dists_closest = [], []
+        for c in np.arange(self.partition.classes.size):
+            self_pos = np.where(self.partition.class_idx[idx_block] == c, self.partition.idx_in_class(idx_block), -1)
+            idx_c, dists_c = self._kneighbours_class(queries, c, self_pos, k)
+            idx_closest.append(idx_c)
+            dists_closest.append(dists_c)
+
+        return idx_closest, dists_closest
+
+
+class QuantisedNeighbours:
+
+    """Search for nearest neighbours from each class that filters candidates using a quantised copy of the data
+
+    Each feature is scaled to the range of an 8-bit integer type and the examples of each class are
+    stored as 8-bit integer codes. The distances used to filter candidates are computed from the codes
+    of the queries and of the examples only (the per-feature quantisation steps weight the differences
+    of codes). They select a pool of at least pool_multiplier*k candidates for each query and only the
+    examples in the pools are read from the data matrix to rank the neighbours by exact distances. If the
+    search is given the data matrix, the partition can hold only the indices of examples so that the
+    data is not copied. A dequantised example differs from the original by at most half of the
+    quantisation step of each feature so the approximate distances between dequantised examples
+    differ from the exact distances by at most twice the distance between the two. If guarantee is
+    True, the pool is extended with all candidates whose approximate distances are within this error
+    of the k-th exact distance in the pool, which makes the search exact.
+    """
+
+    def __init__(self, partition, metric, pool_multiplier=4, guarantee=False, quantised_dtype=np.uint8, data=None):
+        """
+        Args:
+            partition : ClassPartition -- examples (or only their indices if data is given) grouped by class
+            metric : str -- name of metric ('manhattan', 'euclidean', 'sqeuclidean' or 'chebyshev')
+            pool_multiplier : int -- minimal number of candidates re-ranked using exact distances as a multiple of k
+            guarantee : bool -- if True, the pool is extended so that the found neighbours are exact
+            quantised_dtype : type -- np.uint8 or np.int8
+            data : Array[np.float64] -- data matrix from which the examples are read (if None, the examples are
+            read from the partition)
+        """
+        self.partition = partition
+        self.dist_func = get_metric(metric)
+        self.pool_multiplier = pool_multiplier
+        self.exact = guarantee
+        self.quantised_dtype = np.dtype(quantised_dtype)
+
+        # Get data matrix and row of each example of the partition in it.
+        self.data = partition.data if data is None else data
+        self._order = None if data is None else partition.order
+
+        # Compute offsets and quantisation steps of features and quantise examples of each class in blocks of rows.
+        info = np.iinfo(self.quantised_dtype)
+        self.offset = np.amin(self.data, 0)
+        f_range = np.amax(self.data, 0) - self.offset
+        self.step = np.where(f_range > 0, f_range/(int(info.max) - int(info.min)), 1.0).astype(self.data.dtype)
+        block_size = max(1, BLOCK_ELEMENTS//max(self.data.shape[1], 1))
+        self.quantised = []
+        for c in np.arange(partition.classes.size):
+            rows = self._rows(np.arange(partition.offsets[c], partition.offsets[c+1]))
+            self.quantised.append(np.vstack([(np.rint((self.data[rows[start:start+block_size], :] - self.offset)/self.step) + 
+                info.min).astype(self.quantised_dtype) for start in np.arange(0, max(rows.size, 1), block_size)]))
+
+        # Get bound of errors of dequantised examples (of square roots of distances for squared euclidean distances).
+        self._squared = metric in ('euclidean', 'sqeuclidean')
+        self._sqrt = metric == 'sqeuclidean'
+        self.error = get_metric('euclidean' if self._sqrt else metric)(self.step/2.0, np.zeros_like(self.step))
+
+        # Get bound of rounding errors of approximate distances computed from codes in single precision (squared euclidean
+        # distances are computed from norms and products of codes and other distances are accumulated feature by feature).
+        n_terms = self.data.shape[1] + 2
+        if self._squared:
+            self._rounding = 4*n_terms*np.finfo(np.float32).eps*np.sum(np.square(self.step*(int(info.max) - int(info.min)), dtype=np.float64))
+        else:
+            self._rounding = n_terms*np.finfo(np.float32).eps*np.sum(self.step*(int(info.max) - int(info.min)), dtype=np.float64)
+
+
+    def _rows(self, positions):
+        """
+        Get rows of examples in the data matrix.
+
+        Args:
+            positions : Array[np.int] -- positions of examples in the partition
+
+        Returns:
+            Array[np.int] -- indices of rows of examples in the data matrix
+        """
+        return positions if self._order is None else self._order[positions]
+
+
+    def _codes(self, idx_block):
+        """
+        Get codes of examples (shifted to unsigned integers).
+
+        Args:
+            idx_block : Array[np.int] -- indices of examples in the original data matrix
+
+        Returns:
+            Array[np.uint8] -- matrix of codes of examples
+        """
+        codes = np.empty((idx_block.size, self.data.shape[1]), dtype=self.quantised_dtype)
+        class_idx, idx_in_class = self.partition.class_idx[idx_block], self.partition.idx_in_class(idx_block)
+        for c in np.unique(class_idx):
+            codes[class_idx == c, :] = self.quantised[c][idx_in_class[class_idx == c], :]
+        return np.bitwise_xor(codes.view(np.uint8), np.uint8(128)) if self.quantised_dtype.kind == 'i' else codes
+
+
+    def _approximate_distances(self, codes_query, c):
+        """
+        Compute distances from queries to examples of class using their codes in single precision. Squared euclidean
+        distances are computed from products of codes weighted by the squared steps in blocks of examples. Differences
+        of codes of other metrics are computed feature by feature (as 8-bit integers) for blocks of queries.
+
+        Args:
+            codes_query : Array[np.uint8] -- matrix of (unsigned) codes of queried examples
+            c : int -- index of class in classes array
+
+        Returns:
+            Array[np.float32] -- matrix of approximate distances (squared euclidean distances for the euclidean and
+            squared euclidean metrics) with a row for each query
+        """
+        codes = self.quantised[c].view(np.uint8)
+        if self.quantised_dtype.kind == 'i':
+            codes = np.bitwise_xor(codes, np.uint8(128))
+
+        if self._squared:
+            weights = np.square(self.step, dtype=np.float32)
+            weighted_query = codes_query*weights
+            norms_query = np.dot(np.square(codes_query, dtype=np.float32), weights)
+            dists = np.empty((codes_query.shape[0], codes.shape[0]), dtype=np.float32)
+            block_size = max(1, BLOCK_ELEMENTS//max(codes.shape[1], 1))
+            for start in np.arange(0, codes.shape[0], block_size):
+                codes_block = codes[start:start+block_size, :].astype(np.float32)
+                dists_block = np.dot(weighted_query, codes_block.T)
+                dists_block *= -2.0
+                dists_block += norms_query[np.newaxis].T
+                dists_block += np.dot(np.square(codes_block), weights)
+                dists[:, start:start+block_size] = dists_block
+            return np.maximum(dists, 0.0, out=dists)
+
+        # Accumulate weighted absolute differences of codes (or take their maximum) for blocks of queries so that the
+        # intermediate arrays stay small.
+        codes_t = np.ascontiguousarray(codes.T)
+        weights = self.step.astype(np.float32)
+        dists = np.zeros((codes_query.shape[0], codes.shape[0]), dtype=np.float32)
+        rows = max(1, CODES_BLOCK_ELEMENTS//max(codes.shape[0], 1))
+        upper, lower = np.empty((2, min(rows, dists.shape[0]), dists.shape[1]), dtype=np.uint8)
+        terms = np.empty(upper.shape, dtype=np.float32)
+        for start in np.arange(0, dists.shape[0], rows):
+            dists_block = dists[start:start+rows, :]
+            upper_block, lower_block, terms_block = upper[:dists_block.shape[0], :], lower[:dists_block.shape[0], :], terms[:dists_block.shape[0], :]
+            for f in np.arange(codes.shape[1]):
+                codes_f = codes_query[start:start+rows, f, np.newaxis]
+                np.maximum(codes_f, codes_t[f, :], out=upper_block)
+                np.subtract(upper_block, np.minimum(codes_f, codes_t[f, :], out=lower_block), out=upper_block)
+                np.multiply(upper_block, weights[f], out=terms_block)
+                if self.dist_func.name == 'chebyshev':
+                    np.maximum(dists_block, terms_block, out=dists_block)
+                else:
+                    dists_block += terms_block
+        return dists
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find (approximately, if guarantee is False) k nearest neighbours from each class for each queried
+        example. The queried examples are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        queries = self.data[self._rows(self.partition.position[idx_block]), :]
+        codes_query = self._codes(idx_block)
+        idx_closest, dists_closest = [], []
+        for c in np.arange(self.partition.classes.size):
+            n_class = self.partition.offsets[c+1] - self.partition.offsets[c]
+            rows_class = self._rows(np.arange(self.partition.offsets[c], self.partition.offsets[c+1]))
+
+            # Compute approximate distances. Queried examples are not candidates for their own neighbours.
+            approx = self._approximate_distances(codes_query, c)
+            in_class = self.partition.class_idx[idx_block] == c
+            approx[np.where(in_class)[0], self.partition.idx_in_class(idx_block[in_class])] = np.inf
+
+            # Select pools of candidates whose approximate distances do not exceed the pool_multiplier*k-th smallest
+            # minimal approximate distance in chunks of candidates (the pools contain at least pool_multiplier*k candidates).
+            # The threshold is infinite only if the pool contains the whole class (including the queried example).
+            pool_size = min(self.pool_multiplier*k, n_class)
+            chunk_size = max(1, min(SEED_CHUNK_SIZE, n_class//(2*pool_size)))
+            chunks = approx[:, :n_class - n_class % chunk_size].reshape(idx_block.size, -1, chunk_size)
+            threshold = np.partition(np.min(chunks, 2), pool_size-1, axis=1)[:, pool_size-1]
+            idx_query, idx_cand = np.nonzero(approx <= threshold[np.newaxis].T)
+
+            # Compute exact distances to candidates in pools. As in the brute force search, the distances of queried
+            # examples to themselves are infinite (so that they are selected last if the class does not have k other examples).
+            dists = _pair_distances(self.dist_func, queries, self.data, idx_query, rows_class[idx_cand])
+            dists[np.isinf(approx[idx_query, idx_cand])] = np.inf
+            k_class = min(k, n_class)
+
+            # If guaranteeing exact results, add candidates whose approximate distances are within the error bound
+            # of the k-th exact distance in pool (with a tolerance for rounding errors of the approximate distances).
+            # Only the queries whose bounds exceed the thresholds of their pools can have additional candidates.
+            if self.exact:
+                _, dists_pool = _select_pairs(idx_query, idx_cand, dists, idx_block.size, k_class)
+                bound = dists_pool[:, -1]*(1.0 + ABANDON_RTOL)
+                if self._squared:
+                    bound = np.square((np.sqrt(bound) if self._sqrt else bound) + 2.0*self.error) + self._rounding
+                else:
+                    bound = bound + 2.0*self.error + self._rounding
+                bound = np.minimum(bound, np.finfo(approx.dtype).max)
+                idx_extend = np.where(bound > threshold)[0]
+                idx_query_extra, idx_cand_extra = np.nonzero(approx[idx_extend, :] <= bound[idx_extend, np.newaxis])
+                idx_query_extra = idx_extend[idx_query_extra]
+                msk_extra = approx[idx_query_extra, idx_cand_extra] > threshold[idx_query_extra]
+                idx_query_extra, idx_cand_extra = idx_query_extra[msk_extra], idx_cand_extra[msk_extra]
+                dists_extra = _pair_distances(self.dist_func, queries, self.data, idx_query_extra, rows_class[idx_cand_extra])
+                order = np.lexsort((np.hstack((idx_cand, idx_cand_extra)), np.hstack((idx_query, idx_query_extra))))
+                idx_query, idx_cand, dists = (np.hstack(pairs)[order] for pairs in
+                        ((idx_query, idx_query_extra), (idx_cand, idx_cand_extra), (dists, dists_extra)))
+
+            # Find k closest examples.
+            idx_c, dists_c = _select_pairs(idx_query, idx_cand, dists, idx_block.size, k_class)
+            idx_closest.append(idx_c)
+            dists_closest.append(dists_c)
+
+        return idx_closest, dists_closest
+
+
+class RandomProjectionTree:
+
+    """Random projection tree over a matrix of examples
+
+    Each internal node splits its examples at the median of their projections onto a random
+    direction. Queries are routed to a single leaf whose examples are the candidate neighbours.
+    """
+
+    def __init__(self, data, leaf_size):
+        """
+        Build random projection tree.
+
+        Args:
+            data : Array[np.float64] -- matrix containing examples' data as rows
+            leaf_size : int -- maximal number of examples in a leaf
+        """
+
+        # Initialize lists of hyperplanes, thresholds and children of internal nodes and list of leaves.
+        # Children with negative values -(l+1) refer to leaf l.
+        hyperplanes, thresholds, children, self.leaves = [], [], [], []
+
+        # Initialize stack of (indices of examples, index of parent node, side).
+        stack = [(np.arange(data.shape[0]), -1, 0)]
+        while stack:
+            idx, parent, side = stack.pop()
+
+            # Split examples at median of projections onto random direction.
+            if idx.size > leaf_size:
+                hyperplane = np.random.randn(data.shape[1])
+                proj = data[idx, :].dot(hyperplane)
+                order = np.argsort(proj)
+                mid = idx.size // 2
+                threshold = (proj[order[mid-1]] + proj[order[mid]])/2.0
+            
+            # Make a leaf if the node is small enough or the examples cannot be split.
+            if idx.size <= leaf_size or proj[order[mid-1]] == proj[order[mid]]:
+                node = -(len(self.leaves) + 1)
+                self.leaves.append(idx)
+            else:
+                node = len(hyperplanes)
+                hyperplanes.append(hyperplane)
+                thresholds.append(threshold)
+                children.append([0, 0])
+                stack.append((idx[order[:mid]], node, 0))
+                stack.append((idx[order[mid:]], node, 1))
+
+            # Link node to parent.
+            if parent >= 0:
+                children[parent][side] = node
+
+        self.hyperplanes = np.array(hyperplanes).reshape(-1, data.shape[1])
+        self.thresholds = np.array(thresholds)
+        self.children = np.array(children, dtype=np.int64).reshape(-1, 2)
+
+
+    def query_leaves(self, queries):
+        """
+        Route queries to leaves.
+
+        Args:
+            queries : Array[np.float64] -- matrix of queried examples
+
+        Returns:
+            Array[np.int] -- index of leaf for each query
+        """
+        
+        # If root is a leaf, all queries end in it.
+        if self.thresholds.size == 0:
+            return np.zeros(queries.shape[0], dtype=np.int64)
+
+        # Route queries until all reach a leaf.
+        node = np.zeros(queries.shape[0], dtype=np.int64)
+        active = np.arange(queries.shape[0])
+        while active.size > 0:
+            right = np.sum(queries[active, :]*self.hyperplanes[node[active], :], 1) > self.thresholds[node[active]]
+            node[active] = self.children[node[active], right.astype(np.int64)]
+            active = active[node[active] >= 0]
+        return -node - 1
+
+
+class RandomProjectionNeighbours:
+
+    """Approximate search for nearest neighbours from each class using a forest of random projection trees
+
+    A forest of random projection trees is built for each class. The candidate neighbours of a query
+    are the examples in the leaves that the query reaches in each tree. The candidates are ranked by
+    their exact distances to the query. More trees and larger leaves give higher recall at the cost
+    of speed.
+    """
+
+    def __init__(self, partition, dist_func, n_trees=10, leaf_size=32):
+        """
+        Args:
+            partition : ClassPartition -- examples grouped by class
+            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            distances between examples. The function should accept an example and a matrix of examples and return the distances.
+            n_trees : int -- number of trees built for each class
+            leaf_size : int -- maximal number of examples in a leaf
+        """
+        self.partition = partition
+        self.dist_func = dist_func
+        self.exact = False
+        self.forests = [[RandomProjectionTree(partition.block(c), leaf_size) for _ in np.arange(n_trees)]
+                for c in np.arange(partition.classes.size)]
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find (approximately) k nearest neighbours from each class for each queried example. The
+        queried examples are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the original data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+        queries = self.partition.data[self.partition.position[idx_block], :]
+        idx_closest, dists_closest = [], []
+        for c, forest in enumerate(self.forests):
+            block = self.partition.block(c)
+            idx_c = np.empty((idx_block.size, k), dtype=np.int64)
+            dists_c = np.empty((idx_block.size, k), dtype=float_dtype(block))
+
+            # Get leaves reached by queries in each tree.
+            leaves = [tree.query_leaves(queries) for tree in forest]
+            self_pos = np.where(self.partition.class_idx[idx_block] == c, self.partition.idx_in_class(idx_block), -1)
+            for i in np.arange(idx_block.size):
+
+                # Get candidates from reached leaves. If there are too few candidates, use all examples.
+                candidates = np.unique(np.hstack([tree.leaves[leaves_t[i]] for tree, leaves_t in zip(forest, leaves)]))
+                if candidates.size < k + 1:
+                    candidates = np.arange(block.shape[0])
+
+                # Rank candidates by exact distances. Distance of queried example to itself is set to infinity.
+                dists = self.dist_func(queries[i, :], block[candidates, :])
+                dists[candidates == self_pos[i]] = np.inf
+                sel = np.argpartition(dists, k-1)[:k]
+                idx_c[i, :] = candidates[sel]
+                dists_c[i, :] = dists[sel]
+
+            idx_closest.append(idx_c)
+            dists_closest.append(dists_c)
+
+        return idx_closest, dists_closest
+
+
+def measure_recall(neighbours, idx_sampled, k, sample_size=RECALL_SAMPLE_SIZE):
+    """
+    Measure recall of nearest neighbours search against exact search on a sample of queries.
+    The recall is the fraction of exact k nearest neighbours that are also found by the search.
+
+    Args:
+        neighbours : Union[BruteForceNeighbours, TreeNeighbours, RandomProjectionNeighbours, EarlyAbandonNeighbours, PivotNeighbours,
+        QuantisedNeighbours] -- nearest neighbours search
+        idx_sampled : Array[np.int] -- indices of (randomly ordered) sampled examples in the original data matrix
+        k : int -- number of nearest neighbours from each class
+        sample_size : int -- number of sampled examples to use as queries
+
+    Returns:
+        np.float64 -- measured recall
+    """
+
+    # Exact searches have recall 1.
+    if neighbours.exact:
+        return 1.0
+
+    # Find nearest neighbours using the search and using brute force search (the quantised search may read the
+    # examples from the data matrix if the partition holds only their indices).
+    idx_sample = idx_sampled[:sample_size]
+    idx_found, _ = neighbours.kneighbours(idx_sample, k)
+    idx_exact, _ = get_neighbours('brute', neighbours.partition, neighbours.dist_func, data=getattr(neighbours, 'data', None)).kneighbours(idx_sample, k)
+
+    # Count exact nearest neighbours that were found.
+    n_found = sum(np.intersect1d(found, exact).size for found_c, exact_c in zip(idx_found, idx_exact) 
+            for found, exact in zip(found_c, exact_c))
+    return n_found/np.float64(sum(exact_c.size for exact_c in idx_exact))
+
+
+def measure_pruning_rate(neighbours):
+    """
+    Get fraction of distance computations skipped by the early abandoning or pivot-based search. The
+    fraction is computed from the counts of computations gathered by the searches since the search was
+    initialized (or its counts were reset), e.g. during fitting of an estimator.
+
+    Args:
+        neighbours : Union[BruteForceNeighbours, TreeNeighbours, RandomProjectionNeighbours, EarlyAbandonNeighbours,
+        PivotNeighbours] -- nearest neighbours search
+
+    Returns:
+        np.float64 -- pruning rate (0 for searches that do not skip candidates)
+    """
+    if not isinstance(neighbours, (EarlyAbandonNeighbours, PivotNeighbours)):
+        return 0.0
+    return neighbours.pruning_rate
+
+
+def get_neighbours(backend, partition, dist_func, params=None, data=None, **kwargs):
+    """
+    Initialize search for nearest neighbours from each class.
+
+    The tree-based search is used only if the distance function is specified by the name of a
+    Minkowski metric ('manhattan', 'euclidean' or 'chebyshev'), the early abandoning search only if it is specified by
+    the name of a metric that is a sum of per-feature terms ('manhattan', 'euclidean', 'sqeuclidean' or 'hamming') and
+    the pivot-based search only if it is specified by the name of a true metric ('manhattan', 'euclidean', 'chebyshev' or
+    'hamming'). The quantised search is used only if it is specified by the name of a metric of feature value differences
+    ('manhattan', 'euclidean', 'sqeuclidean' or 'chebyshev'). The approximate search can be used with any distance function. All fall back to the brute force search if a learned
+    metric is used or if the data matrix is sparse. If the data matrix is given, the quantised search reads the examples from it
+    and the partition can hold only the indices of examples (the other searches then group the data by class).
+
+    Args:
+        backend : str -- 'brute' for brute force search, 'tree' for search using spatial indices, 'approximate'
+        for approximate search using random projection trees, 'early_abandon' for search accumulating distances
+        feature block by feature block, 'pivot' for search skipping candidates using distances to pivots or 'quantised'
+        for search filtering candidates using a quantised copy of the data
+        partition : ClassPartition -- examples grouped by class
+        dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- name of metric
+        or distance function
+        params : dict -- additional parameters of search (leaf_size for 'tree', n_trees and leaf_size for 'approximate',
+        feature_block_size and order_by_variance for 'early_abandon', n_pivots for 'pivot', pool_multiplier, guarantee and
+        quantised_dtype for 'quantised')
+        data : Array[np.float64] -- data matrix (if None, the examples are taken from the partition)
+        **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
+        function and indices of two training examples and returns the distance between the examples in the learned
+        metric space.
+
+    Returns:
+        Union[BruteForceNeighbours, TreeNeighbours, RandomProjectionNeighbours, EarlyAbandonNeighbours, PivotNeighbours,
+        QuantisedNeighbours] -- initialized nearest neighbours search
+
+    Raises:
+        ValueError : if the backend parameter does not have an allowed value ('brute', 'tree', 'approximate', 'early_abandon',
+        'pivot' or 'quantised')
+    """
+    if backend not in ('brute', 'tree', 'approximate', 'early_abandon', 'pivot', 'quantised'):
+        raise ValueError('Unknown neighbour backend {0}'.format(backend))
+    params = {} if params is None else params
+    dense = not sp.issparse(partition.data if data is None else data)
+    if backend == 'quantised' and dist_func in QUANTISED_METRICS and 'learned_metric_func' not in kwargs and dense:
+        return QuantisedNeighbours(partition, dist_func, data=data, **params)
+
+    # Group data by class if the partition holds only the indices of examples.
+    if partition.data is None:
+        partition = ClassPartition(data, partition.classes[partition.class_idx])
+    if 'learned_metric_func' in kwargs or backend == 'brute' or not dense:
+        return BruteForceNeighbours(partition, get_metric(dist_func), **kwargs)
+    elif backend == 'tree' and dist_func in TREE_METRICS:
+        return TreeNeighbours(partition, dist_func, **params)
+    elif backend == 'early_abandon' and dist_func in PARTIAL_DISTANCE_METRICS:
+        return EarlyAbandonNeighbours(partition, dist_func, **params)
+    elif backend == 'pivot' and dist_func in PIVOT_METRICS:
+        return PivotNeighbours(partition, dist_func, **params)
+    elif backend == 'approximate':
+        return RandomProjectionNeighbours(partition, get_metric(dist_func), **params)
+    else:
+        return BruteForceNeighbours(partition, get_metric(dist_func))
+
@@ -0,0 +1,174 @@
+import numpy as np
+from algorithms.utils.metrics import Metric
+from algorithms.utils.neighbours import smallest_k
+
+
+def open_data(data, n_examples):
+    """
+    Open data matrix stored in a file as a read-only memory-mapped array. Files with the .npy extension
+    are opened as numpy arrays. Other files are treated as raw row-major matrices of np.float64 values
+    with n_examples rows.
+
+    Args:
+        data : Union[str, Array[np.float64]] -- path to file or matrix of examples
+        n_examples : int -- number of examples (rows) in the data matrix
+
+    Returns:
+        Array[np.float64] -- memory-mapped data matrix (or passed matrix if data is not a path)
+    """
+    if not isinstance(data, str):
+        return data
+    elif data.endswith('.npy'):
+        return np.load(data, mmap_mode='r')
+    else:
+        return np.memmap(data, dtype=np.float64, mode='r').reshape(n_examples, -1)
+
+
+def is_out_of_core(data):
+    """
+    Check if data matrix should be processed out of core.
+
+    Args:
+        data : Union[str, Array[np.float64]] -- path to file or matrix of examples
+
+    Returns:
+        bool -- True if data is a path to a file or a memory-mapped array and False otherwise
+    """
+    return isinstance(data, (str, np.memmap))
+
+
+def iter_chunks(data, chunk_size, dtype=np.float64):
+    """
+    Read data matrix in chunks of consecutive rows.
+
+    Args:
+        data : Array[np.float64] -- (memory-mapped) data matrix
+        chunk_size : int -- maximal number of rows in a chunk
+        dtype : type -- floating point type of returned chunks
+
+    Returns:
+        Iterator[Tuple[int, Array[np.float64]]] -- iterator over indices of first rows of chunks and chunks
+    """
+    for start in np.arange(0, data.shape[0], chunk_size):
+        yield start, np.array(data[start:start+chunk_size, :], dtype=dtype)
+
+
+def streaming_min_max(data, chunk_size):
+    """
+    Compute maximal and minimal values of each feature in a single pass over chunks of rows.
+
+    Args:
+        data : Array[np.float64] -- (memory-mapped) data matrix
+        chunk_size : int -- maximal number of rows in a chunk
+
+    Returns:
+        Array[np.float64], Array[np.float64] -- maximal feature values, minimal feature values
+    """
+    max_f_vals = np.full(data.shape[1], -np.inf)
+    min_f_vals = np.full(data.shape[1], np.inf)
+    for _, chunk in iter_chunks(data, chunk_size):
+        np.maximum(max_f_vals, np.amax(chunk, 0), out=max_f_vals)
+        np.minimum(min_f_vals, np.amin(chunk, 0), out=min_f_vals)
+    return max_f_vals, min_f_vals
+
+
+class ChunkedNeighbours:
+
+    """Exact search for nearest neighbours from each class by scanning the data matrix in chunks of rows
+
+    Only the queried examples, a single chunk of rows and the nearest neighbours found so far are held
+    in memory. The nearest neighbours are selected by distance and (for equal distances) index, so the
+    results are identical to the results of BruteForceNeighbours.
+    """
+
+    def __init__(self, data, partition, dist_func, chunk_size, dtype=np.float64, **kwargs):
+        """
+        Args:
+            data : Array[np.float64] -- (memory-mapped) data matrix
+            partition : ClassPartition -- example indices grouped by class
+            dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- metric or
+            function for evaluating distances between examples. The function should accept an example and a matrix of
+            examples and return the distances.
+            chunk_size : int -- maximal number of rows in a chunk
+            dtype : type -- floating point type used for computing distances
+            **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
+            function and indices of two training examples and returns the distance between the examples in the learned
+            metric space.
+        """
+        self.data = data
+        self.partition = partition
+        self.dist_func = dist_func
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.learned_metric_func = kwargs.get('learned_metric_func', None)
+        self.exact = True
+
+
+    def _distances(self, idx_block, queries, start, chunk):
+        """
+        Compute distances from queried examples to examples in chunk.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples
+            queries : Array[np.float64] -- queried examples
+            start : int -- index of first row of chunk
+            chunk : Array[np.float64] -- chunk of rows of data matrix
+
+        Returns:
+            Array[np.float64] -- matrix of distances with a row for each queried example
+        """
+        if isinstance(self.dist_func, Metric) and self.learned_metric_func is None:
+            return self.dist_func.pairwise(queries, chunk)
+        dists = np.empty((idx_block.size, chunk.shape[0]), dtype=self.dtype)
+        if self.learned_metric_func is not None:
+            idx_chunk = np.arange(start, start + chunk.shape[0])
+            for i, idx in enumerate(idx_block):
+                dists[i, :] = self.learned_metric_func(self.dist_func, int(idx), idx_chunk)
+        else:
+            for i in np.arange(idx_block.size):
+                dists[i, :] = self.dist_func(queries[i, :], chunk)
+        return dists
+
+
+    def kneighbours(self, idx_block, k):
+        """
+        Find k nearest neighbours from each class for each queried example. The queried examples
+        are not considered to be their own neighbours.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples in the data matrix
+            k : int -- number of nearest neighbours to find from each class
+
+        Returns:
+            list[Array[np.int]], list[Array[np.float64]] -- for each class, matrix of indices of nearest neighbours
+            in the class block (a row for each queried example) and matrix of distances to the nearest neighbours
+        """
+
+        # Read queried examples and initialize nearest neighbours found so far.
+        queries = np.array(self.data[idx_block, :], dtype=self.dtype)
+        n_classes = self.partition.classes.size
+        idx_closest = [np.empty((idx_block.size, 0), dtype=np.int64) for _ in np.arange(n_classes)]
+        dists_closest = [np.empty((idx_block.size, 0), dtype=self.dtype) for _ in np.arange(n_classes)]
+
+        # Go over chunks of rows.
+        for start, chunk in iter_chunks(self.data, self.chunk_size, self.dtype):
+
+            # Compute distances and set distances of examples to themselves to infinity.
+            dists = self._distances(idx_block, queries, start, chunk)
+            in_chunk = np.logical_and(idx_block >= start, idx_block < start + chunk.shape[0])
+            dists[np.where(in_chunk)[0], idx_block[in_chunk] - start] = np.inf
+
+            # Merge examples from chunk with nearest neighbours from each class found so far. The indices
+            # of examples in chunk are larger than the indices of previously found neighbours.
+            class_chunk = self.partition.class_idx[start:start + chunk.shape[0]]
+            for c in np.arange(n_classes):
+                cols = np.where(class_chunk == c)[0]
+                dists_c = np.hstack((dists_closest[c], dists[:, cols]))
+                idx_c = np.hstack((idx_closest[c], np.tile(cols + start, (idx_block.size, 1))))
+                sel = smallest_k(dists_c, k)
+                idx_closest[c] = np.take_along_axis(idx_c, sel, 1)
+                dists_closest[c] = np.take_along_axis(dists_c, sel, 1)
+
+        # Convert indices of neighbours to indices in class blocks.
+        return [self.partition.position[idx_closest[c]] - self.partition.offsets[c] for c in np.arange(n_classes)], dists_closest
+
@@ -0,0 +1,152 @@
+import numpy as np
+from algorithms.utils.metrics import POPCOUNT_TABLE
+
+
+# Maximal number of distinct values of features stored in packed representation (binary or ternary genotypes).
+MAX_PACKED_VALUES = 3
+
+# Little-endian 64-bit words (bit j of word w holds feature 64*w + j).
+WORD_DTYPE = np.dtype('<u8')
+
+
+def popcount(words):
+    """
+    Count set bits of 64-bit words along the last axis.
+
+    Args:
+        words : Array[np.uint64] -- packed words
+
+    Returns:
+        Array[np.int64] -- number of set bits along the last axis
+    """
+    return np.sum(POPCOUNT_TABLE[words.view(np.uint16)], -1, dtype=np.int64)
+
+
+def column_popcounts(words, n_bits):
+    """
+    Count set bits at each bit position over rows of packed words. The rows are summed pairwise using
+    bit-sliced addition so that the counts are accumulated in planes of packed words (plane k holds bit k
+    of each count) and only the final planes are unpacked.
+
+    Args:
+        words : Array[np.uint64] -- matrix of packed words with a row for each packed vector
+        n_bits : int -- number of bit positions to count (length of packed vectors)
+
+    Returns:
+        Array[np.int64] -- number of rows with a set bit at each position
+    """
+    counts = np.zeros(n_bits, dtype=np.int64)
+    if words.shape[0] == 0:
+        return counts
+    planes = [words]
+    while planes[0].shape[0] > 1:
+
+        # Pad odd number of rows with a zero row and add pairs of rows bit by bit with carry.
+        if planes[0].shape[0] % 2 == 1:
+            planes = [np.vstack((plane, np.zeros((1, plane.shape[1]), dtype=plane.dtype))) for plane in planes]
+        carry = np.zeros_like(planes[0][0::2])
+        planes_sum = []
+        for plane in planes:
+            half_sum = plane[0::2] ^ plane[1::2]
+            planes_sum.append(half_sum ^ carry)
+            carry = (plane[0::2] & plane[1::2]) | (carry & half_sum)
+        planes_sum.append(carry)
+        planes = planes_sum
+
+    # Unpack planes and add their bits weighted by powers of two.
+    for k, plane in enumerate(planes):
+        counts += np.unpackbits(plane[0].view(np.uint8), bitorder='little')[:n_bits].astype(np.int64) << k
+    return counts
+
+
+class PackedGenotypes:
+
+    """Matrix of discrete features (e.g. SNP genotypes) packed into 64-bit words
+
+    Each distinct value except the first is stored as a bit plane of packed words indicating which
+    features have that value (the first value is implied where no plane bit is set). Binary features
+    therefore take 1 bit and ternary features 2 bits. Two examples differ in a feature if the feature's
+    bit differs in any plane so that hamming distances are computed by counting set bits of
+    XOR-ed words.
+    """
+
+    def __init__(self, data):
+        """
+        Args:
+            data : Array[np.float64] -- matrix of examples with at most MAX_PACKED_VALUES distinct values
+
+        Raises:
+            ValueError : if the matrix has more than MAX_PACKED_VALUES distinct values
+        """
+        self.values = np.unique(data)
+        if self.values.size > MAX_PACKED_VALUES:
+            raise ValueError('Packed representation supports at most {0} distinct values'.format(MAX_PACKED_VALUES))
+        self.n_features = data.shape[1]
+        n_bytes = 8*((data.shape[1] + 63)//64)
+        self.planes = np.zeros((max(self.values.size - 1, 1), data.shape[0], n_bytes), dtype=np.uint8)
+        for plane_idx, val in enumerate(self.values[1:]):
+            self.planes[plane_idx, :, :(data.shape[1] + 7)//8] = np.packbits(data == val, axis=1, bitorder='little')
+        self.planes = self.planes.view(WORD_DTYPE)
+
+
+    @staticmethod
+    def can_pack(data):
+        """
+        Check if matrix of examples can be stored in packed representation.
+
+        Args:
+            data : Array[np.float64] -- matrix of examples
+
+        Returns:
+            bool -- True if the matrix has at most MAX_PACKED_VALUES distinct values and False otherwise
+        """
+        return np.unique(data).size <= MAX_PACKED_VALUES
+
+
+    @property
+    def nbytes(self):
+        return self.planes.nbytes
+
+
+    def diff_words(self, idx, rows):
+        """
+        Get packed masks of features in which examples differ from example.
+
+        Args:
+            idx : int -- index of example
+            rows : Array[np.int] -- indices of compared examples
+
+        Returns:
+            Array[np.uint64] -- matrix of packed masks with a row for each compared example
+        """
+        words = self.planes[0, rows, :] ^ self.planes[0, idx, :]
+        for plane in self.planes[1:]:
+            words |= plane[rows, :] ^ plane[idx, :]
+        return words
+
+
+    def distances(self, idx):
+        """
+        Get hamming distances from example to all examples.
+
+        Args:
+            idx : int -- index of example
+
+        Returns:
+            Array[np.float64] -- vector of distances
+        """
+        return popcount(self.diff_words(idx, np.arange(self.planes.shape[1]))).astype(np.float64)
+
+
+    def diff_counts(self, idx, rows):
+        """
+        Count examples that differ from example in each feature.
+
+        Args:
+            idx : int -- index of example
+            rows : Array[np.int] -- indices of compared examples
+
+        Returns:
+            Array[np.int64] -- number of compared examples with a different value of each feature
+        """
+        return column_popcounts(self.diff_words(idx, rows), self.n_features)
@@ -0,0 +1,98 @@
+import numpy as np
+import multiprocessing
+import os
+from algorithms.utils.nearest_hit_miss import iter_blocks
+
+
+# Number of sampled examples in a shard for algorithms that do not process examples in blocks.
+SHARD_SIZE = 256
+
+# Task executed by worker processes. Worker processes are forked and inherit the task (together
+# with the data it references) so that nothing but the shard index is sent to them.
+_task = None
+
+
+def get_n_workers(n_jobs):
+    """
+    Get number of worker processes for value of n_jobs parameter.
+
+    Args:
+        n_jobs : int -- number of worker processes (-1 to use all processors)
+
+    Returns:
+        int -- number of worker processes
+
+    Raises:
+        ValueError : if n_jobs is not a positive integer or -1
+    """
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    elif n_jobs >= 1:
+        return int(n_jobs)
+    else:
+        raise ValueError('Invalid number of jobs {0}'.format(n_jobs))
+
+
+def _run_shard(shard_idx):
+    """
+    Compute partial weight updates for shard of sampled examples in worker process.
+
+    Args:
+        shard_idx : int -- index of shard
+
+    Returns:
+        Array[np.float64], Array[np.float64], Array[np.int] -- partial sum of penalties, partial sum of rewards,
+        increments of counters (None if no counters are passed)
+    """
+    process_shard, shards, accumulator, counts = _task
+    partial = accumulator.empty()
+    counts_before = None if counts is None else counts.copy()
+    process_shard(shards[shard_idx], partial)
+    return partial.penalty, partial.reward, None if counts is None else counts - counts_before
+
+
+def accumulate_shards(process_shard, idx_sampled, shard_size, accumulator, n_jobs=1, counts=None):
+    """
+    Split sampled examples into shards of fixed size, compute partial weight updates for each shard and
+    add them to accumulator in order of shards.
+
+    The shards and the order of the reduction do not depend on the number of worker processes so the
+    results are identical for any value of n_jobs. Worker processes are forked and share the data with
+    the parent process. If forking is not supported, the shards are processed in the calling process.
+    Counters incremented by process_shard in worker processes are added to the counters of the calling process.
+
+    Args:
+        process_shard : Callable[[Array[np.int], WeightAccumulator], None] -- function that adds weight updates
+        for sampled examples with specified indices to accumulator
+        idx_sampled : Array[np.int] -- indices of sampled examples
+        shard_size : int -- number of sampled examples in a shard
+        accumulator : WeightAccumulator -- accumulator of feature weights updates
+        n_jobs : int -- number of worker processes (-1 to use all processors)
+        counts : Array[np.int] -- counters incremented in place by process_shard, e.g. counts of computed distances
+        (None if there are no counters)
+    """
+    global _task
+
+    # Split sampled examples into shards.
+    shards = list(iter_blocks(idx_sampled, shard_size))
+    n_workers = min(get_n_workers(n_jobs), len(shards))
+
+    # If using a single process, process shards in order.
+    if n_workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for shard in shards:
+            partial = accumulator.empty()
+            process_shard(shard, partial)
+            accumulator.add(partial.penalty, partial.reward)
+        return
+
+    # Process shards in worker processes and add partial updates in order of shards.
+    _task = (process_shard, shards, accumulator, counts)
+    try:
+        with multiprocessing.get_context('fork').Pool(n_workers) as pool:
+            for penalty, reward, counts_shard in pool.imap(_run_shard, np.arange(len(shards)), chunksize=1):
+                accumulator.add(penalty, reward)
+                if counts is not None:
+                    counts += counts_shard
+    finally:
+        _task = None
+
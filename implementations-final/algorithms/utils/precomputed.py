@@ -0,0 +1,93 @@
+import numpy as np
+from algorithms.utils.condensed import CondensedDistances
+
+
+# Value of the dist_func parameter specifying that distances between training examples are passed to fit.
+PRECOMPUTED = 'precomputed'
+
+
+def _no_distances(*args):
+    raise ValueError('Distances between examples are precomputed and cannot be computed from examples')
+
+
+class PrecomputedDistances:
+
+    """Learned metric function that looks up precomputed distances between training examples
+
+    The distances are given as a square matrix (which can be memory-mapped) or as a condensed vector of
+    distances (the ordering used by scipy's pdist function) or CondensedDistances. Only the distances
+    between referenced pairs of examples are read so that a memory-mapped matrix is never loaded as a
+    whole. The instance is called like learned metric functions with a distance function (which is
+    ignored) and indices of two examples or an index and an array of indices.
+    """
+
+    def __init__(self, distances, n):
+        """
+        Args:
+            distances : Union[Array[np.float64], CondensedDistances] -- square matrix or condensed vector of distances
+            n : int -- number of training examples
+
+        Raises:
+            ValueError : if the shape of distances does not match the number of training examples
+        """
+        if isinstance(distances, CondensedDistances):
+            distances = distances.values
+        distances = distances if isinstance(distances, np.ndarray) else np.asarray(distances)
+        if distances.shape != (n, n) and distances.shape != (n*(n-1)//2,):
+            raise ValueError('Precomputed distances of shape {0} do not match {1} training examples'.format(distances.shape, n))
+        self.distances = distances
+        self.n = n
+
+
+    def __call__(self, dist_func, i1, i2):
+        """
+        Get distances between examples referenced by their indices.
+
+        Args:
+            dist_func : Callable -- distance function (ignored)
+            i1 : Union[int, Array[np.int]] -- index (indices) of first example(s)
+            i2 : Union[int, Array[np.int]] -- index (indices) of second example(s)
+
+        Returns:
+            Union[np.float64, Array[np.float64]] -- distance(s) between examples
+        """
+        if self.distances.ndim == 2:
+            return self.distances[i1, i2]
+
+        # Get index of distance between examples i < j in condensed vector (distances to examples themselves are 0).
+        i, j = np.minimum(i1, i2), np.maximum(i1, i2)
+        pos = np.where(i == j, 0, self.n*i - i*(i+1)//2 + j - i - 1)
+        return np.where(i == j, 0.0, self.distances[pos])
+
+
+def resolve_precomputed(dist_func, learned_metric_func, n, distances):
+    """
+    Get distance function and learned metric function to use when fitting an estimator. If the distance function
+    is 'precomputed', the learned metric function looks up the passed precomputed distances so that no distances
+    are computed from examples (distance weights of algorithms that reweight distances are not applied).
+
+    Args:
+        dist_func : Union[str, Callable] -- name of metric, distance function or 'precomputed'
+        learned_metric_func : Callable[[Array[np.float64], Array[np.int]], Callable] -- learned metric function
+        (None if not using metric learning)
+        n : int -- number of training examples
+        distances : Union[Array[np.float64], CondensedDistances] -- precomputed distances between training examples
+        (None if distances are not precomputed)
+
+    Returns:
+        Union[str, Callable], Callable -- distance function, learned metric function
+
+    Raises:
+        ValueError : if distances are passed without the 'precomputed' distance function or vice versa or if
+        precomputed distances are used with a learned metric function
+    """
+    if not (isinstance(dist_func, str) and dist_func == PRECOMPUTED):
+        if distances is not None:
+            raise ValueError("Distances can only be passed to fit if dist_func is '{0}'".format(PRECOMPUTED))
+        return dist_func, learned_metric_func
+    if distances is None:
+        raise ValueError("Distances must be passed to fit if dist_func is '{0}'".format(PRECOMPUTED))
+    if learned_metric_func is not None:
+        raise ValueError('Precomputed distances cannot be used with a learned metric function')
+    precomputed = PrecomputedDistances(distances, n)
+    return _no_distances, lambda data, target: precomputed
@@ -0,0 +1,106 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial.distance import cdist
+from scipy.stats import norm
+from sklearn.neighbors import KDTree, BallTree
+from algorithms.utils.metrics import Metric, BLOCK_ELEMENTS
+from algorithms.utils.neighbours import TREE_METRICS, KD_TREE_MAX_DIM
+
+
+def estimate_mean_distance(data, dist_func, sample_size, confidence=0.95):
+    """
+    Estimate mean of the square distance matrix (including the zero distances of examples to themselves) from
+    distances between randomly sampled pairs of examples. The pairs are sampled uniformly with replacement so
+    that the estimate is unbiased and the bound of its confidence interval is computed using the normal
+    approximation of the distribution of the sample mean.
+
+    Args:
+        data : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of examples
+        dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], np.float64]] -- metric or
+        function computing the distance between two examples
+        sample_size : int -- number of sampled pairs of examples
+        confidence : float -- confidence level of the confidence interval
+
+    Returns:
+        np.float64, np.float64 -- estimated mean distance, half-width of the confidence interval of the estimate
+
+    Raises:
+        ValueError : if the sample size is not positive
+    """
+    if sample_size < 1:
+        raise ValueError('Sample size must be positive, got {0}'.format(sample_size))
+    idx1 = np.random.randint(0, data.shape[0], sample_size)
+    idx2 = np.random.randint(0, data.shape[0], sample_size)
+
+    # Compute distances between sampled pairs with the vectorised kernel if possible.
+    if isinstance(dist_func, Metric) and not sp.issparse(data):
+        dists = np.asarray(dist_func(data[idx1, :], data[idx2, :]), dtype=np.float64)
+    else:
+        dists = np.array([np.ravel(dist_func(data[i, :], data[j, :]))[0] for i, j in zip(idx1, idx2)], dtype=np.float64)
+
+    bound = norm.ppf(0.5 + confidence/2.0)*np.std(dists, ddof=1 if sample_size > 1 else 0)/np.sqrt(sample_size)
+    return np.mean(dists), bound
+
+
+class RadiusNeighbours:
+
+    """Search for examples within a radius of each example
+
+    A KD-tree (or a ball tree for high-dimensional data) is queried for Minkowski metrics (manhattan, euclidean
+    and chebyshev) so that only the indices of neighbours within the radius are stored. Rows of distances to all
+    examples are computed for blocks of examples for other metrics and distance functions (and sparse data).
+    """
+
+    def __init__(self, data, dist_func, leaf_size=40):
+        """
+        Args:
+            data : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of examples
+            dist_func : Union[Metric, Callable[[Array[np.float64], Array[np.float64]], np.float64]] -- metric or
+            function computing the distance between two examples
+            leaf_size : int -- leaf size of spatial index
+        """
+        self.data = data
+        self.dist_func = dist_func
+        if isinstance(dist_func, Metric) and dist_func.name in TREE_METRICS and not sp.issparse(data):
+            tree = KDTree if data.shape[1] <= KD_TREE_MAX_DIM else BallTree
+            self.tree = tree(data, leaf_size=leaf_size, metric=dist_func.name)
+        else:
+            self.tree = None
+
+
+    def query(self, idx_block, radius):
+        """
+        Find examples within radius (distance at most radius) of each queried example. The queried examples
+        are included in the results.
+
+        Args:
+            idx_block : Array[np.int] -- indices of queried examples
+            radius : float -- radius
+
+        Returns:
+            list[Array[np.int]] -- for each queried example, sorted indices of examples within radius
+        """
+        if self.tree is not None:
+            return [np.sort(neigh) for neigh in self.tree.query_radius(self.data[idx_block, :], radius)]
+        if isinstance(self.dist_func, Metric):
+            dists = self.dist_func.pairwise(self.data[idx_block, :], self.data)
+        else:
+            dists = cdist(self.data[idx_block, :], self.data, self.dist_func)
+        return [np.flatnonzero(row <= radius) for row in dists]
+
+
+    def iter_query(self, radius):
+        """
+        Iterate over examples within radius of each example in order of examples. The examples are queried
+        in blocks so that at most a block of rows of distances is stored at a time.
+
+        Args:
+            radius : float -- radius
+
+        Returns:
+            Iterator[Array[np.int]] -- iterator over sorted indices of examples within radius of each example
+        """
+        block_size = max(1, BLOCK_ELEMENTS//max(self.data.shape[0], 1))
+        for start in np.arange(0, self.data.shape[0], block_size):
+            for neigh in self.query(np.arange(start, min(start + block_size, self.data.shape[0])), radius):
+                yield neigh
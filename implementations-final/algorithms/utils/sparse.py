@@ -0,0 +1,96 @@
+import numpy as np
+import scipy.sparse as sp
+from algorithms.utils.metrics import Metric, get_metric
+
+
+def check_sparse_input(data, dist_func, learned_metric_func=None):
+    """
+    Check that a sparse data matrix is used with a metric from the metrics registry that has a sparse
+    kernel ('manhattan', 'euclidean' or 'sqeuclidean').
+
+    Args:
+        data : Union[Array[np.float64], scipy.sparse.spmatrix] -- matrix of examples
+        dist_func : Union[str, Callable] -- name of metric or distance function
+        learned_metric_func : Callable -- learned metric function (None if not using metric learning)
+
+    Raises:
+        ValueError : if the data matrix is sparse and the metric does not support sparse matrices or a learned metric is used
+    """
+    if not sp.issparse(data):
+        return
+    if learned_metric_func is not None:
+        raise ValueError('Sparse data cannot be used with a learned metric function')
+    metric = get_metric(dist_func)
+    if not isinstance(metric, Metric) or not metric.supports_sparse:
+        raise ValueError('Sparse data requires a metric from the metrics registry with a sparse kernel')
+
+
+def max_min(data):
+    """
+    Get maximal and minimal values of each feature. For sparse matrices, the implicit zeros are taken
+    into account without converting the matrix to a dense matrix.
+
+    Args:
+        data : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of examples
+
+    Returns:
+        Array[np.float64], Array[np.float64] -- maximal feature values, minimal feature values
+    """
+    if sp.issparse(data):
+        return data.max(0).toarray().ravel(), data.min(0).toarray().ravel()
+    else:
+        return np.amax(data, 0), np.amin(data, 0)
+
+
+def abs_diffs(e, examples):
+    """
+    Compute absolute feature value differences between example (or matrix of examples) and matrix of
+    examples. For sparse matrices, the example is repeated for each row of the matrix of examples and
+    the differences are returned as a sparse matrix.
+
+    Args:
+        e : Union[Array[np.float64], scipy.sparse.csr_matrix] -- example or matrix of examples with a row for each row of examples
+        examples : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of examples
+
+    Returns:
+        Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of differences with a row for each row of examples
+    """
+    if sp.issparse(examples):
+        if e.shape[0] != examples.shape[0]:
+            e = e[np.zeros(examples.shape[0], dtype=np.int64), :]
+        return abs(e - examples).tocsr()
+    else:
+        return np.abs(e - examples)
+
+
+def scale_rows(diffs, weights_mult):
+    """
+    Multiply rows of matrix of differences by weights.
+
+    Args:
+        diffs : Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of differences
+        weights_mult : Array[np.float64] -- weight of each row
+
+    Returns:
+        Union[Array[np.float64], scipy.sparse.csr_matrix] -- matrix of weighted differences
+    """
+    if sp.issparse(diffs):
+        return sp.diags(weights_mult).dot(diffs).tocsr()
+    else:
+        return weights_mult[np.newaxis].T*diffs
+
+
+def vstack_rows(blocks):
+    """
+    Stack matrices of examples vertically.
+
+    Args:
+        blocks : list[Union[Array[np.float64], scipy.sparse.csr_matrix]] -- matrices of examples
+
+    Returns:
+        Union[Array[np.float64], scipy.sparse.csr_matrix] -- stacked matrix
+    """
+    if sp.issparse(blocks[0]):
+        return sp.vstack(blocks, format='csr')
+    else:
+        return np.vstack(blocks)
@@ -0,0 +1,119 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def _column_sums(diffs):
+    """
+    Sum vector or matrix of differences over rows in double precision.
+
+    Args:
+        diffs : Union[Array[Union[np.float32, np.float64]], scipy.sparse.csr_matrix] -- vector or matrix of differences
+
+    Returns:
+        Array[np.float64] -- sums of differences for each feature
+    """
+    if sp.issparse(diffs):
+        return np.asarray(diffs.sum(0, dtype=np.float64)).ravel()
+    else:
+        return np.sum(np.atleast_2d(diffs), 0, dtype=np.float64)
+
+
+class WeightAccumulator:
+
+    """Accumulator of feature weight updates
+
+    Penalties (from nearest hits) and rewards (from nearest misses) are summed into
+    preallocated buffers as unnormalized feature value differences. The differences are
+    normalized by the feature value ranges once, when the final weights are computed.
+    Differences computed in single precision are summed in double precision. Sparse matrices
+    of differences are summed without converting them to dense matrices.
+    """
+
+    def __init__(self, max_f_vals, min_f_vals):
+        """
+        Args:
+            max_f_vals : Array[np.float64] -- maximal feature values
+            min_f_vals : Array[np.float64] -- minimal feature values
+        """
+        self.max_f_vals = np.asarray(max_f_vals, dtype=np.float64)
+        self.min_f_vals = np.asarray(min_f_vals, dtype=np.float64)
+        self.f_range = self.max_f_vals - self.min_f_vals + np.finfo(np.float64).eps
+        self.penalty = np.zeros(self.f_range.size, dtype=np.float64)
+        self.reward = np.zeros(self.f_range.size, dtype=np.float64)
+
+
+    def add_penalty(self, diffs, scale=1.0):
+        """
+        Add scaled sum of feature value differences to penalty buffer.
+
+        Args:
+            diffs : Union[Array[Union[np.float32, np.float64]], scipy.sparse.csr_matrix] -- vector or matrix of (unnormalized) feature
+            value differences with a row for each neighbour
+            scale : float -- scaling factor of differences
+        """
+        self.penalty += scale*_column_sums(diffs)
+
+
+    def add_reward(self, diffs, scale=1.0):
+        """
+        Add scaled sum of feature value differences to reward buffer.
+
+        Args:
+            diffs : Union[Array[Union[np.float32, np.float64]], scipy.sparse.csr_matrix] -- vector or matrix of (unnormalized) feature
+            value differences with a row for each neighbour
+            scale : float -- scaling factor of differences
+        """
+        self.reward += scale*_column_sums(diffs)
+
+
+    def empty(self):
+        """
+        Create accumulator with the same feature value ranges and empty buffers.
+
+        Returns:
+            WeightAccumulator -- new accumulator
+        """
+        accumulator = WeightAccumulator.__new__(WeightAccumulator)
+        accumulator.max_f_vals = self.max_f_vals
+        accumulator.min_f_vals = self.min_f_vals
+        accumulator.f_range = self.f_range
+        accumulator.penalty = np.zeros_like(self.penalty)
+        accumulator.reward = np.zeros_like(self.reward)
+        return accumulator
+
+
+    def add(self, penalty, reward):
+        """
+        Add partial penalty and reward sums (e.g. computed by another accumulator) to buffers.
+
+        Args:
+            penalty : Array[np.float64] -- partial sum of penalties
+            reward : Array[np.float64] -- partial sum of rewards
+        """
+        self.penalty += penalty
+        self.reward += reward
+
+
+    def update_ranges(self, max_f_vals, min_f_vals):
+        """
+        Extend feature value ranges with ranges of new examples. As the buffers hold unnormalized
+        differences, the accumulated updates remain valid.
+
+        Args:
+            max_f_vals : Array[np.float64] -- maximal feature values of new examples
+            min_f_vals : Array[np.float64] -- minimal feature values of new examples
+        """
+        self.max_f_vals = np.maximum(self.max_f_vals, max_f_vals)
+        self.min_f_vals = np.minimum(self.min_f_vals, min_f_vals)
+        self.f_range = self.max_f_vals - self.min_f_vals + np.finfo(np.float64).eps
+
+
+    def weights(self):
+        """
+        Compute feature weights from accumulated penalties and rewards.
+
+        Returns:
+            Array[np.float64] -- feature weights
+        """
+        return (self.reward - self.penalty)/self.f_range
+
@@ -4,6 +4,7 @@ from functools import partial
 from scipy.stats import rankdata
 from sklearn.base import BaseEstimator, TransformerMixin
 from algorithms.relieff import Relieff
+from algorithms.utils.precomputed import resolve_precomputed
 
 
 class VLSRelief(BaseEstimator, TransformerMixin):
@@ -18,7 +19,8 @@ class VLSRelief(BaseEstimator, TransformerMixin):
 
     def __init__(self, n_features_to_select=10, num_partitions_to_select=10, 
             num_subsets=10, partition_size=5, m=-1, k=5, 
-            dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None):
+            dist_func=lambda x1, x2 : np.sum(np.abs(x1-x2), 1), learned_metric_func=None, neighbour_backend='brute', neighbour_params=None,
+            dtype=np.float64):
         self.n_features_to_select = n_features_to_select  # number of features to select
         self.num_partitions_to_select = num_partitions_to_select  # number of partitions to combine to form subset of features
         self.num_subsets = num_subsets  # number of subsets to evaluate
@@ -27,27 +29,35 @@ class VLSRelief(BaseEstimator, TransformerMixin):
         self.k = k                            # the k parameter for ReliefF algorithm (number of closest examples from each class to consider)
         self.dist_func = dist_func            # distance function to use
         self.learned_metric_func = learned_metric_func  # learned metric function
+        self.neighbour_backend = neighbour_backend  # nearest neighbours search backend used by ReliefF
+        self.neighbour_params = neighbour_params  # additional parameters of nearest neighbours search
+        self.dtype = dtype                    # floating point type used by ReliefF for computing distances and differences
 
 
-    def fit(self, data, target):
+    def fit(self, data, target, distances=None):
         """
         Rank features using vlsRelief feature selection algorithm
 
         Args:
             data : Array[np.float64] -- matrix of examples
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
 
         Returns:
             self
         """
 
+        # Get learned metric function looking up distances between examples if distances are precomputed.
+        dist_func, learned_metric_func = resolve_precomputed(self.dist_func, self.learned_metric_func, len(target), distances)
+
         # Run VLSRelief feature selection algorithm.
-        if self.learned_metric_func != None:
+        if learned_metric_func != None:
             self.rank, self.weights = self._vlsrelief(data, target, self.num_partitions_to_select, 
-                    self.num_subsets, self.partition_size, self.m, self.k, self.dist_func, learned_metric_func=self.learned_metric_func)
+                    self.num_subsets, self.partition_size, self.m, self.k, dist_func, learned_metric_func=learned_metric_func)
         else:
             self.rank, self.weights = self._vlsrelief(data, target, self.num_partitions_to_select, 
-                    self.num_subsets, self.partition_size, self.m, self.k, self.dist_func)
+                    self.num_subsets, self.partition_size, self.m, self.k, dist_func)
         return self
 
 
@@ -67,19 +77,21 @@ class VLSRelief(BaseEstimator, TransformerMixin):
         return data[:, msk]  # Perform feature selection.
 
 
-    def fit_transform(self, data, target):
+    def fit_transform(self, data, target, distances=None):
 
         """
         Compute ranks of features and perform feature selection
         Args:
             data : Array[np.float64] -- matrix of examples on which to perform feature selection
             target : Array[np.int] -- vector of target values of examples
+            distances : Union[Array[np.float64], CondensedDistances] -- distances between examples as a square (possibly memory-mapped) matrix
+            or condensed vector (used if dist_func is 'precomputed')
         
         Returns:
             Array[np.float64] -- result of performing feature selection 
         """
 
-        self.fit(data, target)  # Fit data
+        self.fit(data, target, distances)  # Fit data
         return self.transform(data)  # Perform feature selection
 
 
@@ -96,8 +108,10 @@ class VLSRelief(BaseEstimator, TransformerMixin):
             partition_size : int -- size of feature partitions
             m : int -- Sample size to use when evaluating the feature scores
             k : int -- Number of closest examples from each class to use
-            dist_func : Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]] -- function for evaluating
+            dist_func : Union[str, Callable[[Array[np.float64], Array[np.float64]], Array[np.float64]]] -- function for evaluating
             distances between examples. The function should acept two examples or two matrices of examples and return the dictances.
+            Can also be the name of a metric from the metrics registry ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'
+            or 'hamming').
             **kwargs: can contain argument with key 'learned_metric_func' that maps to a function that accepts a distance
             function and indices of two training examples and returns the distance between the examples in the learned
             metric space.
@@ -119,10 +133,12 @@ class VLSRelief(BaseEstimator, TransformerMixin):
         # Initialize ReliefF algorithm.
         if 'learned_metric_func' in kwargs:
             relieff = Relieff(n_features_to_select=self.n_features_to_select, 
-                    m=m, k=k, dist_func=dist_func, learned_metric_func=kwargs['learned_metric_func'])
+                    m=m, k=k, dist_func=dist_func, learned_metric_func=kwargs['learned_metric_func'], neighbour_backend=self.neighbour_backend,
+                    neighbour_params=self.neighbour_params, dtype=self.dtype)
         else:
             relieff = Relieff(n_features_to_select=self.n_features_to_select, 
-                    m=m, k=k, dist_func=dist_func)
+                    m=m, k=k, dist_func=dist_func, neighbour_backend=self.neighbour_backend, neighbour_params=self.neighbour_params,
+                    dtype=self.dtype)
 
         # Go over subsets and compute local ReliefF scores.
         for i in np.arange(num_subsets):
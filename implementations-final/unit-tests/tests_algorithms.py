@@ -1,11 +1,15 @@
 import unittest
 from functools import partial
+import os
+import tempfile
 import numpy as np
 from numpy.testing import assert_array_almost_equal, assert_array_equal
 
 ## RELIEF ALGORITHM IMPLEMENTATION UNIT TESTS ##########
 
 from algorithms.relief import Relief
+from algorithms.utils.nearest_hit_miss import nearest_hit_miss, iter_blocks
+from algorithms.utils.weight_accumulator import WeightAccumulator
 
 class TestRelief(unittest.TestCase):
 
@@ -16,6 +20,9 @@ class TestRelief(unittest.TestCase):
         self.assertEqual(relief.m, -1)
         self.assertNotEqual(relief.dist_func, None)
         self.assertEqual(relief.learned_metric_func, None)
+        self.assertEqual(relief.block_size, 256)
+        self.assertEqual(relief.neighbour_backend, 'brute')
+        self.assertEqual(relief.neighbour_params, None)
 
     # Test initialization with explicit parameters.
     def test_init_custom(self):
@@ -50,12 +57,43 @@ class TestRelief(unittest.TestCase):
         min_f_vals = np.min(data, 0)  # Min value of each feature
 
         # Compute weights update
-        res = relief._update_weights(data, e, closest_same, closest_other, weights, m, max_f_vals, min_f_vals)
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+        relief._update_weights(accumulator, e, closest_same, closest_other, m)
+        res = weights + accumulator.weights()
 
         # Compare with results computed by hand.
         correct_res = np.array([1.004167277552613, 1.0057086828870614, 1.01971232778099])
         assert_array_almost_equal(res, correct_res, decimal=5)
 
+    # Test batched search for nearest hits and misses.
+    def test_nearest_hit_miss(self):
+
+        # Initialize parameter values.
+        data = np.array([[2.09525, 0.26961, 3.99627],
+                         [9.86248, 6.22487, 8.77424],
+                         [7.03015, 9.24269, 3.02136],
+                         [8.95009, 8.52854, 0.16166],
+                         [3.41438, 4.03548, 7.88157],
+                         [2.01185, 0.84564, 6.16909],
+                         [2.79316, 1.71541, 2.97578],
+                         [3.22177, 0.16564, 5.79036],
+                         [1.81406, 2.74643, 2.13259],
+                         [4.77481, 8.01036, 7.57880]])
+        target = np.array([1, 2, 2, 2, 1, 1, 3, 3, 3, 1])
+        dist_func = lambda x1, x2: np.sum(np.abs(x1-x2), 1)
+
+        # Find nearest hits and misses for a block of examples.
+        res_hit, res_miss = nearest_hit_miss(data, target, np.array([0, 2, 6, 9]), dist_func)
+
+        # Compare with results computed by hand.
+        assert_array_equal(res_hit, np.array([5, 3, 8, 4]))
+        assert_array_equal(res_miss, np.array([7, 9, 0, 2]))
+
+        # Results should not depend on the block size.
+        res = [nearest_hit_miss(data, target, idx_block, dist_func) for idx_block in iter_blocks(np.arange(10), 3)]
+        assert_array_equal(np.hstack([r[0] for r in res]), np.array([5, 2, 3, 2, 9, 0, 8, 6, 6, 4]))
+        assert_array_equal(np.hstack([r[1] for r in res]), np.array([7, 9, 9, 9, 7, 7, 0, 5, 0, 2]))
+
     # Test relief algorithm
     def test_relief(self):
 
@@ -81,6 +119,16 @@ class TestRelief(unittest.TestCase):
 
         assert_array_almost_equal(res_rank, correct_res_rank)
         assert_array_almost_equal(res_weights, correct_res_weights)
+
+
+    # Test that incremental weights updates with a single batch match weights computed using all examples.
+    def test_partial_fit(self):
+        np.random.seed(0)
+        data = np.random.rand(40, 3)
+        target = np.random.randint(0, 2, 40)
+        relief = Relief().partial_fit(data, target)
+        assert_array_almost_equal(relief.weights, Relief().fit(data, target).weights)
+        assert_array_equal(relief.rank, np.argsort(np.argsort(-relief.weights, kind='stable')) + 1)
         
 
 ########################################################
@@ -102,6 +150,9 @@ class TestRelieff(unittest.TestCase):
         self.assertEqual(relieff.k, 5)
         self.assertNotEqual(relieff.dist_func, None)
         self.assertEqual(relieff.learned_metric_func, None)
+        self.assertEqual(relieff.neighbour_backend, 'brute')
+        self.assertEqual(relieff.block_size, 256)
+        self.assertEqual(relieff.n_jobs, 1)
 
     # Test initialization with explicit parameters.
     def test_init_custom(self):
@@ -139,7 +190,9 @@ class TestRelieff(unittest.TestCase):
         min_f_vals = np.min(data, 0)  # Min value of each feature
 
         # Compute weights update
-        res = relieff._update_weights(data, e[np.newaxis], closest_same, closest_other, weights[np.newaxis], weights_mult[np.newaxis].T, m, k, max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+        relieff._update_weights(accumulator, e, closest_same, closest_other, weights_mult, m, k)
+        res = weights + accumulator.weights()
 
         # Compare with results computed by hand.
         correct_res = np.array([0.01648752,  0.03281824, -0.01643311])
@@ -173,6 +226,861 @@ class TestRelieff(unittest.TestCase):
         assert_array_equal(res_rank, correct_res_rank)
         assert_array_almost_equal(res_weights, correct_res_weights, decimal=5)
 
+    # Test relieff algorithm using spatial indices for nearest neighbours search.
+    def test_relieff_tree(self):
+
+        # Training examples
+        data = np.array([[2.09525, 0.26961, 3.99627],
+                         [3.41438, 4.03548, 7.88157],
+                         [2.01185, 0.84564, 6.16909],
+                         [2.79316, 1.71541, 2.97578],
+                         [3.22177, 0.16564, 5.79036],
+                         [4.77481, 8.01036, 7.57880]])
+
+        # Class values
+        target = np.array([1, 2, 2, 1, 2, 1])
+
+        relieff = Relieff(n_features_to_select=2, k=2, m=data.shape[0], dist_func='manhattan', neighbour_backend='tree')
+        relieff = relieff.fit(data, target)
+
+        # Compare with results computed by hand.
+        assert_array_equal(relieff.rank, np.array([2, 3, 1]))
+        assert_array_almost_equal(relieff.weights, np.array([-0.19887, -0.23507,  0.00803]), decimal=5)
+
+
+    # Test that weights computed in worker processes are identical to weights computed in a single process.
+    def test_relieff_n_jobs(self):
+        np.random.seed(0)
+        data = np.random.rand(50, 4)
+        target = np.random.randint(0, 3, 50)
+        weights = []
+        for n_jobs in (1, 3):
+            np.random.seed(1)
+            weights.append(Relieff(k=3, block_size=8, n_jobs=n_jobs).fit(data, target).weights)
+        assert_array_equal(weights[0], weights[1])
+
+
+    # Test that weights computed out of core are identical to weights computed in memory.
+    def test_relieff_out_of_core(self):
+        np.random.seed(0)
+        data = np.random.randint(0, 3, (60, 4)).astype(np.float64)
+        target = np.random.randint(0, 3, 60)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            np.save(os.path.join(tmp_dir, 'data.npy'), data)
+            data.tofile(os.path.join(tmp_dir, 'data.raw'))
+            weights = []
+            for data_src in (data, os.path.join(tmp_dir, 'data.npy'), os.path.join(tmp_dir, 'data.raw')):
+                np.random.seed(1)
+                weights.append(Relieff(k=3, dist_func='manhattan', chunk_size=7).fit(data_src, target).weights)
+        assert_array_equal(weights[0], weights[1])
+        assert_array_equal(weights[0], weights[2])
+
+
+    # Test incremental weights updates with batches of examples and a bounded reference set.
+    def test_partial_fit(self):
+        np.random.seed(0)
+        data = np.random.rand(60, 4)
+        target = np.random.randint(0, 3, 60)
+        data[:, 0] += target
+
+        # Single batch matches weights computed using all examples.
+        relieff = Relieff(k=3).partial_fit(data, target)
+        assert_array_almost_equal(relieff.weights, Relieff(k=3).fit(data, target).weights)
+
+        # Updates for batches are accumulated and the reference set is bounded.
+        relieff = Relieff(k=3, reference_size=20)
+        for start in np.arange(0, 60, 15):
+            relieff.partial_fit(data[start:start+15, :], target[start:start+15])
+        self.assertEqual(relieff._n_updates, 60)
+        self.assertEqual(len(relieff._reference), 20)
+        self.assertEqual(relieff._reference.n_seen, 60)
+        self.assertEqual(relieff.rank[0], 1)
+
+        # Learned metric functions are not supported.
+        with self.assertRaises(ValueError):
+            Relieff(learned_metric_func=lambda data, target: None).partial_fit(data, target)
+
+#########################################################
+
+
+
+## CLASS PARTITION UNIT TESTS ###########################
+
+
+from algorithms.utils.class_partition import ClassPartition
+
+class TestClassPartition(unittest.TestCase):
+
+    # Test grouping of examples by class.
+    def test_partition(self):
+
+        # Training examples
+        data = np.array([[2.09525, 0.26961, 3.99627],
+                         [3.41438, 4.03548, 7.88157],
+                         [2.01185, 0.84564, 6.16909],
+                         [2.79316, 1.71541, 2.97578],
+                         [3.22177, 0.16564, 5.79036],
+                         [4.77481, 8.01036, 7.57880]])
+
+        # Class values
+        target = np.array([2, 1, 3, 2, 1, 2])
+
+        partition = ClassPartition(data, target)
+
+        # Compare with results computed by hand.
+        assert_array_equal(partition.classes, np.array([1, 2, 3]))
+        assert_array_equal(partition.offsets, np.array([0, 2, 5, 6]))
+        assert_array_equal(partition.original_idx(1), np.array([0, 3, 5]))
+        assert_array_equal(partition.block(1), data[target == 2, :])
+        assert_array_equal([partition.idx_in_class(idx) for idx in np.arange(data.shape[0])], np.array([0, 0, 0, 1, 1, 2]))
+        assert_array_equal(partition.other_classes(1), np.array([0, 2]))
+
+    # Test probability weights of other classes.
+    def test_p_weights(self):
+        target = np.array([2, 1, 3, 2, 1, 2])
+        partition = ClassPartition(np.zeros((target.size, 2)), target)
+        assert_array_almost_equal(partition.p_weights(0), np.array([0.75, 0.25]))
+        assert_array_almost_equal(partition.p_weights(1), np.array([2.0/3.0, 1.0/3.0]))
+
+#########################################################
+
+
+
+## NEAREST NEIGHBOURS SEARCH UNIT TESTS #################
+
+
+from algorithms.utils.neighbours import get_neighbours, measure_recall, smallest_k, BruteForceNeighbours, TreeNeighbours, \
+        RandomProjectionNeighbours, RandomProjectionTree, EarlyAbandonNeighbours, PivotNeighbours, QuantisedNeighbours, measure_pruning_rate
+from algorithms.utils.nearest_hit_miss import nearest_hit_miss_neighbours
+from algorithms.relieff3 import Relieff3
+from algorithms.reliefmss import ReliefMSS
+
+class TestNeighbours(unittest.TestCase):
+
+    # Training examples
+    data = np.array([[2.09525, 0.26961, 3.99627],
+                     [9.86248, 6.22487, 8.77424],
+                     [7.03015, 9.24269, 3.02136],
+                     [8.95009, 8.52854, 0.16166],
+                     [3.41438, 4.03548, 7.88157],
+                     [2.01185, 0.84564, 6.16909],
+                     [2.79316, 1.71541, 2.97578],
+                     [3.22177, 0.16564, 5.79036],
+                     [1.81406, 2.74643, 2.13259],
+                     [4.77481, 8.01036, 7.57880]])
+
+    # Class values
+    target = np.array([1, 2, 2, 2, 1, 1, 3, 3, 3, 1])
+
+    # Test selection of nearest neighbours search backend.
+    def test_get_neighbours(self):
+        partition = ClassPartition(self.data, self.target)
+        self.assertIsInstance(get_neighbours('brute', partition, 'manhattan'), BruteForceNeighbours)
+        self.assertIsInstance(get_neighbours('tree', partition, 'manhattan'), TreeNeighbours)
+        self.assertIsInstance(get_neighbours('tree', partition, lambda x1, x2: np.sum(np.abs(x1-x2), 1)), BruteForceNeighbours)
+        self.assertIsInstance(get_neighbours('approximate', partition, 'manhattan'), RandomProjectionNeighbours)
+        self.assertIsInstance(get_neighbours('early_abandon', partition, 'manhattan'), EarlyAbandonNeighbours)
+        self.assertIsInstance(get_neighbours('early_abandon', partition, 'chebyshev'), BruteForceNeighbours)
+        self.assertIsInstance(get_neighbours('pivot', partition, 'chebyshev'), PivotNeighbours)
+        self.assertIsInstance(get_neighbours('pivot', partition, 'sqeuclidean'), BruteForceNeighbours)
+        self.assertIsInstance(get_neighbours('quantised', partition, 'sqeuclidean'), QuantisedNeighbours)
+        self.assertIsInstance(get_neighbours('quantised', partition, 'hamming'), BruteForceNeighbours)
+        self.assertIsInstance(get_neighbours('approximate', partition, 'manhattan', 
+            learned_metric_func=lambda metric, i1, i2: metric(self.data[i1, :], self.data[i2, :])), BruteForceNeighbours)
+        self.assertRaises(ValueError, get_neighbours, 'graph', partition, 'manhattan')
+
+    # Test selection of smallest distances with ties broken by index.
+    def test_smallest_k(self):
+        dists = np.array([[3.0, 1.0, 2.0, 1.0], [0.0, 5.0, 5.0, 5.0]])
+        assert_array_equal(smallest_k(dists, 2), np.array([[1, 3], [0, 1]]))
+        assert_array_equal(smallest_k(dists, 3), np.array([[1, 3, 2], [0, 1, 2]]))
+        assert_array_equal(smallest_k(dists, 4), np.array([[1, 3, 2, 0], [0, 1, 2, 3]]))
+
+
+    # Test finding k nearest neighbours from each class.
+    def test_kneighbours(self):
+        partition = ClassPartition(self.data, self.target)
+        for backend in ('brute', 'tree', 'early_abandon', 'pivot'):
+            neighbours = get_neighbours(backend, partition, 'manhattan')
+            idxs_closest, dists_closest = neighbours.kneighbours(np.array([0, 2, 6, 9]), 2)
+
+            # Compare with results computed by hand.
+            assert_array_equal(np.sort(idxs_closest[0], 1), np.array([[1, 2], [1, 3], [0, 2], [1, 2]]))
+            assert_array_equal(np.sort(idxs_closest[1], 1), np.array([[0, 1], [0, 2], [1, 2], [0, 1]]))
+            assert_array_equal(np.sort(idxs_closest[2], 1), np.array([[0, 1], [0, 2], [1, 2], [0, 1]]))
+            assert_array_almost_equal(np.sort(dists_closest[0], 1), 
+                    np.array([[2.83225, 8.97030], [8.04511, 13.68319], [3.16420, 4.84439], [5.63808, 11.33739]]), decimal=5)
+
+    # Test that the tree-based search breaks ties by index and handles classes without k other examples as brute force search.
+    def test_tree_ties_small_class(self):
+        np.random.seed(0)
+        data = np.random.randint(0, 3, (80, 4)).astype(np.float64)
+        target = np.hstack((np.zeros(3, dtype=int), np.random.randint(1, 3, 77)))
+        partition = ClassPartition(data, target)
+        for metric in ('manhattan', 'euclidean', 'chebyshev'):
+            for k in (2, 3, 5):
+                idxs_tree, dists_tree = get_neighbours('tree', partition, metric).kneighbours(np.arange(80), k)
+                idxs_brute, dists_brute = get_neighbours('brute', partition, metric).kneighbours(np.arange(80), k)
+                for c in (0, 1, 2):
+                    assert_array_equal(idxs_tree[c], idxs_brute[c])
+                    assert_array_almost_equal(dists_tree[c], dists_brute[c])
+
+        # Weights of estimators are the same as with brute force search.
+        for estimator in (Relieff(k=3, dist_func='manhattan'), Relieff3(k=3, dist_func='manhattan')):
+            weights = estimator.fit(data, target).weights
+            assert_array_almost_equal(estimator.set_params(neighbour_backend='tree').fit(data, target).weights, weights)
+
+    # Test finding nearest hits and misses using nearest neighbours search.
+    def test_nearest_hit_miss_neighbours(self):
+        partition = ClassPartition(self.data, self.target)
+        for backend in ('brute', 'tree', 'early_abandon', 'pivot'):
+            res_hit, res_miss = nearest_hit_miss_neighbours(get_neighbours(backend, partition, 'manhattan'), np.arange(10))
+
+            # Compare with results computed by hand.
+            assert_array_equal(res_hit, np.array([5, 2, 3, 2, 9, 0, 8, 6, 6, 4]))
+            assert_array_equal(res_miss, np.array([7, 9, 9, 9, 7, 7, 0, 5, 0, 2]))
+
+    # Test construction of random projection tree.
+    def test_random_projection_tree(self):
+        np.random.seed(0)
+        data = np.random.rand(100, 3)
+        tree = RandomProjectionTree(data, 8)
+
+        # Leaves should partition the examples into groups of at most leaf_size examples.
+        assert_array_equal(np.sort(np.hstack(tree.leaves)), np.arange(100))
+        self.assertTrue(all(leaf.size <= 8 for leaf in tree.leaves))
+
+        # Each example should be routed to the leaf containing it.
+        leaves = tree.query_leaves(data)
+        self.assertTrue(all(idx in tree.leaves[leaf] for idx, leaf in enumerate(leaves)))
+
+    # Test approximate nearest neighbours search and measurement of its recall.
+    def test_approximate(self):
+        np.random.seed(0)
+        partition = ClassPartition(self.data, self.target)
+
+        # If leaves contain all examples of a class, the search is exact.
+        neighbours = get_neighbours('approximate', partition, 'manhattan', {'n_trees': 2, 'leaf_size': 4})
+        idxs_closest, _ = neighbours.kneighbours(np.array([0, 2, 6, 9]), 2)
+        assert_array_equal(np.sort(idxs_closest[0], 1), np.array([[1, 2], [1, 3], [0, 2], [1, 2]]))
+        self.assertEqual(measure_recall(neighbours, np.arange(10), 2), 1.0)
+
+        # Recall should be a fraction.
+        data = np.random.rand(500, 4)
+        partition = ClassPartition(data, np.random.randint(0, 2, 500))
+        recall = measure_recall(get_neighbours('approximate', partition, 'euclidean', {'n_trees': 1, 'leaf_size': 8}), np.arange(500), 5)
+        self.assertTrue(0 < recall < 1)
+
+    # Test that early abandoning search finds the same neighbours as brute force search and measurement of its pruning rate.
+    def test_early_abandon(self):
+        np.random.seed(0)
+        centers = 5.0*np.random.randn(4, 300)
+        data = centers[np.random.randint(0, 4, 120), :] + np.random.randn(120, 300)
+        partition = ClassPartition(data, np.random.randint(0, 2, 120))
+        for metric in ('manhattan', 'euclidean', 'sqeuclidean'):
+            for order_by_variance in (True, False):
+                neighbours = get_neighbours('early_abandon', partition, metric, {'feature_block_size': 32, 'order_by_variance': order_by_variance})
+                idxs_closest, dists_closest = neighbours.kneighbours(np.arange(120), 3)
+                idxs_brute, dists_brute = get_neighbours('brute', partition, metric).kneighbours(np.arange(120), 3)
+                for c in (0, 1):
+                    assert_array_equal(idxs_closest[c], idxs_brute[c])
+                    assert_array_almost_equal(dists_closest[c], dists_brute[c])
+                self.assertTrue(0 < measure_pruning_rate(neighbours) < 1)
+        self.assertEqual(measure_pruning_rate(get_neighbours('brute', partition, 'manhattan')), 0.0)
+
+        # Pruning rate of estimators is counted while finding the neighbours (also in worker processes).
+        target = np.random.randint(0, 2, 120)
+        rates = [Relieff(k=3, dist_func='manhattan', neighbour_backend='early_abandon', neighbour_params={'feature_block_size': 32}, block_size=16,
+                n_jobs=n_jobs).fit(data, target).neighbour_pruning_rate for n_jobs in (1, 2)]
+        self.assertTrue(0 < rates[0] < 1)
+        self.assertEqual(rates[0], rates[1])
+
+        # Hamming distances of discrete data have many ties.
+        data = np.random.randint(0, 3, (60, 100)).astype(np.float64)
+        partition = ClassPartition(data, np.random.randint(0, 2, 60))
+        idxs_closest, _ = get_neighbours('early_abandon', partition, 'hamming', {'feature_block_size': 16}).kneighbours(np.arange(60), 4)
+        idxs_brute, _ = get_neighbours('brute', partition, 'hamming').kneighbours(np.arange(60), 4)
+        for c in (0, 1):
+            assert_array_equal(idxs_closest[c], idxs_brute[c])
+
+    # Test that pivot-based search finds the same neighbours as brute force search and measurement of its pruning rate.
+    def test_pivot(self):
+        np.random.seed(0)
+        centers = 5.0*np.random.randn(4, 10)
+        data = centers[np.random.randint(0, 4, 300), :] + np.random.randn(300, 10)
+        partition = ClassPartition(data, np.random.randint(0, 2, 300))
+        for metric in ('manhattan', 'euclidean', 'chebyshev'):
+            neighbours = get_neighbours('pivot', partition, metric, {'n_pivots': 4})
+            self.assertEqual(neighbours.pivot_dists[0].shape, (partition.block(0).shape[0], 4))
+            idxs_closest, dists_closest = neighbours.kneighbours(np.arange(300), 5)
+            idxs_brute, dists_brute = get_neighbours('brute', partition, metric).kneighbours(np.arange(300), 5)
+            for c in (0, 1):
+                assert_array_equal(idxs_closest[c], idxs_brute[c])
+                assert_array_almost_equal(dists_closest[c], dists_brute[c])
+            self.assertTrue(0.5 < measure_pruning_rate(neighbours) < 1)
+
+    # Test search filtering candidates using quantised data and measure its recall against exact search.
+    def test_quantised(self):
+        np.random.seed(0)
+        data = np.random.randn(400, 20)
+        target = np.random.randint(0, 3, 400)
+        partition = ClassPartition(data, target)
+        for quantised_dtype in (np.uint8, np.int8):
+            neighbours = get_neighbours('quantised', partition, 'euclidean', {'quantised_dtype': quantised_dtype})
+            self.assertEqual(neighbours.quantised[0].dtype, quantised_dtype)
+            self.assertTrue(np.all(np.abs(neighbours.quantised[0]*1.0 - np.iinfo(quantised_dtype).min - 
+                (partition.block(0) - neighbours.offset)/neighbours.step) <= 0.5 + 1e-9))
+
+        # Recall is measured against brute force search. Recall of re-ranked pools should be high and increase with the pool multiplier.
+        recalls = []
+        for metric in ('manhattan', 'sqeuclidean', 'chebyshev'):
+            idxs_brute, _ = get_neighbours('brute', partition, metric).kneighbours(np.arange(100), 5)
+            for pool_multiplier in (1, 4):
+                neighbours = get_neighbours('quantised', partition, metric, {'pool_multiplier': pool_multiplier})
+                idxs_closest, _ = neighbours.kneighbours(np.arange(100), 5)
+                n_found = sum(np.intersect1d(found, exact).size for c in (0, 1, 2) for found, exact in zip(idxs_closest[c], idxs_brute[c]))
+                recalls.append(measure_recall(neighbours, np.arange(400), 5))
+                self.assertEqual(recalls[-1], n_found/1500.0)
+        self.assertTrue(all(recall > 0.9 for recall in recalls))
+        self.assertTrue(any(recall < 1.0 for recall in recalls))
+        self.assertTrue(all(recalls[i] <= recalls[i+1] for i in (0, 2, 4)))
+
+        # With the guarantee, the search finds the same neighbours as brute force search.
+        for metric in ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev'):
+            neighbours = get_neighbours('quantised', partition, metric, {'pool_multiplier': 1, 'guarantee': True})
+            idxs_closest, _ = neighbours.kneighbours(np.arange(400), 5)
+            idxs_brute, _ = get_neighbours('brute', partition, metric).kneighbours(np.arange(400), 5)
+            for c in (0, 1, 2):
+                assert_array_equal(idxs_closest[c], idxs_brute[c])
+
+        # Given the data matrix, the search reads the examples from it and does not need the data grouped by class (as in
+        # estimators using the search).
+        partition_idx = ClassPartition(None, target)
+        neighbours = get_neighbours('quantised', partition_idx, 'manhattan', {'guarantee': True}, data=data)
+        self.assertIs(neighbours.data, data)
+        idxs_closest, _ = neighbours.kneighbours(np.arange(400), 5)
+        idxs_brute, _ = get_neighbours('brute', partition, 'manhattan').kneighbours(np.arange(400), 5)
+        for c in (0, 1, 2):
+            assert_array_equal(idxs_closest[c], idxs_brute[c])
+        self.assertIsInstance(get_neighbours('quantised', partition_idx, 'hamming', data=data), BruteForceNeighbours)
+        relieff = Relieff(k=5, dist_func='manhattan', neighbour_backend='quantised', neighbour_params={'guarantee': True}).fit(data, target)
+        assert_array_almost_equal(relieff.weights, Relieff(k=5, dist_func='manhattan').fit(data, target).weights)
+        self.assertEqual(Relieff(k=5, dist_func='manhattan', neighbour_backend='quantised', neighbour_params={'pool_multiplier': 1},
+            m=100).fit(data, target).neighbour_recall, recalls[0])
+
+        # Queried examples are their own last neighbours with infinite distance if their class has only k examples (as with
+        # brute force search) so that the weights of estimators are the same.
+        target_small = np.hstack((np.zeros(5, dtype=int), np.random.randint(1, 3, 395)))
+        partition_small = ClassPartition(data, target_small)
+        idxs_closest, dists_closest = get_neighbours('quantised', partition_small, 'manhattan', {'guarantee': True}).kneighbours(np.arange(400), 5)
+        idxs_brute, dists_brute = get_neighbours('brute', partition_small, 'manhattan').kneighbours(np.arange(400), 5)
+        for c in (0, 1, 2):
+            assert_array_equal(idxs_closest[c], idxs_brute[c])
+            assert_array_almost_equal(dists_closest[c], dists_brute[c])
+        for estimator in (Relieff(k=5, dist_func='manhattan'), Relieff3(k=5, dist_func='manhattan'), ReliefMSS(k=5, dist_func='manhattan')):
+            weights = estimator.fit(data, target_small).weights
+            estimator.set_params(neighbour_backend='quantised', neighbour_params={'guarantee': True})
+            assert_array_almost_equal(estimator.fit(data, target_small).weights, weights)
+
+#########################################################
+
+
+
+## WEIGHT ACCUMULATOR UNIT TESTS ########################
+
+from algorithms.utils.group_sums import group_sums
+
+class TestWeightAccumulator(unittest.TestCase):
+
+    # Test accumulation of penalties and rewards and computation of weights.
+    def test_weights(self):
+        max_f_vals = np.array([4.0, 2.0, 1.0])
+        min_f_vals = np.array([0.0, 0.0, 0.0])
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+
+        # Add penalties and rewards for two updates.
+        accumulator.add_penalty(np.array([[1.0, 1.0, 0.5], [3.0, 1.0, 0.0]]), 0.5)
+        accumulator.add_reward(np.array([2.0, 0.0, 1.0]), 0.5)
+        accumulator.add_reward(np.array([[4.0, 2.0, 1.0]]))
+
+        # Compare with results computed by hand.
+        assert_array_almost_equal(accumulator.penalty, np.array([2.0, 1.0, 0.25]))
+        assert_array_almost_equal(accumulator.reward, np.array([5.0, 2.0, 1.5]))
+        assert_array_almost_equal(accumulator.weights(), np.array([0.75, 0.5, 1.25]))
+
+        # Add partial sums computed by an empty accumulator.
+        partial = accumulator.empty()
+        assert_array_equal(partial.penalty, np.zeros(3))
+        partial.add_reward(np.array([4.0, 0.0, 0.0]))
+        accumulator.add(partial.penalty, partial.reward)
+        assert_array_almost_equal(accumulator.weights(), np.array([1.75, 0.5, 1.25]))
+
+        # Extend feature value ranges.
+        accumulator.update_ranges(np.array([2.0, 4.0, 1.0]), np.array([1.0, 0.0, -1.0]))
+        assert_array_almost_equal(accumulator.weights(), np.array([1.75, 0.25, 0.625]))
+
+
+    # Test sums of rows for groups of rows.
+    def test_group_sums(self):
+        values = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]])
+        sums, counts = group_sums(values, np.array([1, -1, 1, 0]), 3)
+        assert_array_equal(sums, np.array([[7.0, 8.0], [6.0, 8.0], [0.0, 0.0]]))
+        assert_array_equal(counts, np.array([1, 2, 0]))
+
+        # Sums are identical to summing the rows of each group separately in order.
+        np.random.seed(0)
+        values = np.random.rand(200, 5).astype(np.float32)
+        groups = np.random.randint(-1, 4, 200)
+        sums, counts = group_sums(values, groups, 4)
+        for group in np.arange(4):
+            assert_array_equal(sums[group], np.sum(values[groups == group], 0, dtype=np.float64))
+
+#########################################################
+
+
+
+## METRICS REGISTRY UNIT TESTS ##########################
+
+
+from algorithms.utils.metrics import get_metric, pairwise_distance_matrix, Metric, WeightedMetric
+
+class TestMetrics(unittest.TestCase):
+
+    # Test examples
+    data = np.array([[1.0, 2.0],
+                     [4.0, 6.0],
+                     [1.0, 0.0]])
+
+    # Binary test examples
+    data_binary = np.array([[0, 1, 0, 1, 1, 0, 0, 1, 1],
+                            [1, 1, 0, 0, 1, 0, 0, 1, 0],
+                            [0, 0, 1, 1, 1, 1, 1, 1, 1]], dtype=np.float64)
+
+    # Test getting metrics by name.
+    def test_get_metric(self):
+        self.assertIsInstance(get_metric('manhattan'), Metric)
+        self.assertIsInstance(get_metric('weighted_hamming', weighted=True), WeightedMetric)
+        dist_func = lambda x1, x2: np.sum(np.abs(x1-x2), 1)
+        self.assertIs(get_metric(dist_func), dist_func)
+        with self.assertRaises(ValueError):
+            get_metric('minkowski')
+        with self.assertRaises(ValueError):
+            get_metric('weighted_manhattan')
+        with self.assertRaises(ValueError):
+            get_metric('manhattan', weighted=True)
+
+
+    # Test pairwise distance kernels.
+    def test_pairwise(self):
+
+        # Compare with results computed by hand.
+        correct_res = {
+            'manhattan' : np.array([[0.0, 7.0, 2.0], [7.0, 0.0, 9.0], [2.0, 9.0, 0.0]]),
+            'euclidean' : np.array([[0.0, 5.0, 2.0], [5.0, 0.0, 6.70820], [2.0, 6.70820, 0.0]]),
+            'sqeuclidean' : np.array([[0.0, 25.0, 4.0], [25.0, 0.0, 45.0], [4.0, 45.0, 0.0]]),
+            'chebyshev' : np.array([[0.0, 4.0, 2.0], [4.0, 0.0, 6.0], [2.0, 6.0, 0.0]]),
+            'hamming' : np.array([[0.0, 2.0, 1.0], [2.0, 0.0, 2.0], [1.0, 2.0, 0.0]]),
+        }
+        for name, res in correct_res.items():
+            metric = get_metric(name)
+            assert_array_almost_equal(metric.pairwise(self.data), res, decimal=5)
+            assert_array_almost_equal(metric.pairwise(self.data[:1, :], self.data), res[:1, :], decimal=5)
+            assert_array_almost_equal(metric(self.data[0, :], self.data), res[0, :], decimal=5)
+            assert_array_almost_equal(pairwise_distance_matrix(self.data, metric), res, decimal=5)
+
+        # Compare hamming distances between binary examples (packed into bits) with results computed by hand.
+        assert_array_equal(get_metric('hamming').pairwise(self.data_binary),
+                np.array([[0.0, 3.0, 4.0], [3.0, 0.0, 7.0], [4.0, 7.0, 0.0]]))
+        assert_array_equal(get_metric('hamming')(self.data_binary[1, :], self.data_binary[2, :]), 7.0)
+
+        # Distances to an empty matrix of examples form an empty matrix.
+        for name in correct_res:
+            self.assertEqual(get_metric(name).pairwise(self.data_binary, self.data_binary[:0, :]).shape, (self.data_binary.shape[0], 0))
+
+
+    # Test weighted pairwise distance kernels.
+    def test_pairwise_weighted(self):
+        w = np.array([2.0, 0.5])
+        assert_array_almost_equal(get_metric('weighted_manhattan', weighted=True).pairwise(w, self.data),
+                np.array([[0.0, 8.0, 1.0], [8.0, 0.0, 9.0], [1.0, 9.0, 0.0]]))
+        assert_array_almost_equal(get_metric('weighted_manhattan', weighted=True)(w, self.data[0, :], self.data),
+                np.array([0.0, 8.0, 1.0]))
+        w_binary = np.arange(1, 10, dtype=np.float64)
+        assert_array_almost_equal(get_metric('weighted_hamming', weighted=True).pairwise(w_binary, self.data_binary),
+                np.array([[0.0, 14.0, 18.0], [14.0, 0.0, 32.0], [18.0, 32.0, 0.0]]))
+        assert_array_almost_equal(get_metric('weighted_hamming', weighted=True).pairwise(w, self.data),
+                np.array([[0.0, 2.5, 0.5], [2.5, 0.0, 2.5], [0.5, 2.5, 0.0]]))
+
+
+    # Test that algorithms give the same results with metric names and equivalent distance functions.
+    def test_estimators(self):
+        np.random.seed(0)
+        data = np.random.rand(30, 4)
+        target = np.random.randint(0, 2, 30)
+        weights_name = SURF(dist_func='euclidean').fit(data, target).weights
+        weights_func = SURF(dist_func=lambda x1, x2: np.sqrt(np.sum((x1-x2)**2))).fit(data, target).weights
+        assert_array_almost_equal(weights_name, weights_func)
+        np.random.seed(1)
+        weights_name = Relieff(k=3, dist_func='manhattan').fit(data, target).weights
+        np.random.seed(1)
+        weights_func = Relieff(k=3).fit(data, target).weights
+        assert_array_almost_equal(weights_name, weights_func)
+
+#########################################################
+
+
+
+## COMPUTE DTYPE UNIT TESTS #############################
+
+
+from algorithms.utils.dtypes import as_compute_dtype, float_dtype
+
+class TestDtypes(unittest.TestCase):
+
+    # Test conversion of data to floating point type used for computations.
+    def test_as_compute_dtype(self):
+        data = np.random.rand(5, 3)
+        self.assertIs(as_compute_dtype(data, np.float64), data)
+        self.assertEqual(as_compute_dtype(data, np.float32).dtype, np.float32)
+        self.assertEqual(float_dtype(data.astype(np.float32)), np.float32)
+        self.assertEqual(float_dtype(data.astype(np.int64)), np.float64)
+        with self.assertRaises(ValueError):
+            as_compute_dtype(data, np.int32)
+
+
+    # Test that pairwise kernels return single precision distances for single precision examples.
+    def test_pairwise_float32(self):
+        np.random.seed(0)
+        data = np.random.randint(0, 2, (20, 6)).astype(np.float64)
+        w = np.random.rand(6)
+        for name in ('manhattan', 'euclidean', 'sqeuclidean', 'chebyshev', 'hamming'):
+            dists = get_metric(name).pairwise(data.astype(np.float32))
+            self.assertEqual(dists.dtype, np.float32)
+            assert_array_almost_equal(dists, get_metric(name).pairwise(data), decimal=5)
+            dists = get_metric('weighted_' + name, weighted=True).pairwise(w, data.astype(np.float32))
+            self.assertEqual(dists.dtype, np.float32)
+            assert_array_almost_equal(dists, get_metric('weighted_' + name, weighted=True).pairwise(w, data), decimal=5)
+
+
+    # Test that squared euclidean distances between nearly identical single precision examples do not cancel.
+    def test_sqeuclidean_float32_near_duplicates(self):
+        np.random.seed(0)
+        data = (1e4 + 1e3*np.random.rand(30, 8)).astype(np.float32)
+        near = data.copy()
+        near[:, 0] += np.float32(0.01)
+        expected = np.sum((data.astype(np.float64) - near.astype(np.float64))**2, 1)
+        dists = get_metric('sqeuclidean').pairwise(data, near)
+        self.assertEqual(dists.dtype, np.float32)
+        assert_array_almost_equal(np.diag(dists)/expected, np.ones(30), decimal=4)
+        assert_array_equal(np.diag(get_metric('sqeuclidean').pairwise(data, data)), np.zeros(30))
+
+
+    # Test that feature rankings computed in single precision agree with rankings computed in double precision.
+    def test_rank_parity(self):
+        np.random.seed(0)
+        data = np.random.rand(80, 6)
+        target = np.random.randint(0, 3, 80)
+        data[:, 0] += 0.5*target
+        data[:, 1] += 0.3*target
+        for estimator in (Relief(), Relieff(k=3), ReliefMSS(k=3), SWRFStar(), SURF(dist_func='manhattan'), 
+                SURFStar(dist_func='euclidean'), MultiSURF(dist_func='manhattan'), IterativeRelief(dist_func='weighted_euclidean', max_iter=3), 
+                IRelief(max_iter=5)):
+            results = []
+            for dtype in (np.float64, np.float32):
+                np.random.seed(1)
+                estimator.set_params(dtype=dtype).fit(data, target)
+                results.append((estimator.rank, estimator.weights))
+            self.assertLessEqual(np.max(np.abs(results[0][0] - results[1][0])), 1)
+            self.assertEqual(results[1][1].dtype, np.float64)
+            assert_array_almost_equal(results[0][1], results[1][1], decimal=4)
+
+#########################################################
+
+
+
+## DISTANCE CACHE UNIT TESTS ############################
+
+
+from algorithms.utils.distance_cache import DistanceCache, DISTANCE_CACHE, DEFAULT_MAX_BYTES, fingerprint, iter_distance_rows
+
+class TestDistanceCache(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.data = np.random.rand(10, 3)
+        self.metric = get_metric('manhattan')
+
+
+    # Test fingerprints of data matrices.
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint(self.data), fingerprint(self.data.copy()))
+        self.assertNotEqual(fingerprint(self.data), fingerprint(self.data.astype(np.float32)))
+        self.assertNotEqual(fingerprint(self.data), fingerprint(self.data.reshape(5, 6)))
+
+
+    # Test hits, misses and eviction of least recently used matrices.
+    def test_lru(self):
+        cache = DistanceCache(max_bytes=2*self.data.shape[0]**2*8)
+        self.assertIsNone(cache.get(self.data, self.metric))
+        dists = cache.pairwise(self.data, self.metric, lambda: self.metric.pairwise(self.data))
+        self.assertFalse(dists.flags.writeable)
+        self.assertIs(cache.pairwise(self.data, self.metric, None), dists)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # Adding two more matrices evicts the least recently used matrix.
+        cache.put(self.data, get_metric('euclidean'), get_metric('euclidean').pairwise(self.data))
+        cache.put(self.data, get_metric('chebyshev'), get_metric('chebyshev').pairwise(self.data))
+        self.assertIsNone(cache.get(self.data, self.metric))
+        self.assertIsNotNone(cache.get(self.data, get_metric('chebyshev')))
+
+
+    # Test spilling of evicted matrices to cache directory.
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DistanceCache(max_bytes=0, cache_dir=cache_dir)
+            dists = cache.pairwise(self.data, self.metric, lambda: self.metric.pairwise(self.data))
+            spilled = cache.get(self.data, self.metric)
+            self.assertIsInstance(spilled, np.memmap)
+            assert_array_equal(spilled, dists)
+            del spilled
+
+
+    # Test that rows of distance matrix are computed once and read from the cache afterwards.
+    def test_iter_distance_rows(self):
+        cache = DistanceCache()
+        dist_rows = iter_distance_rows(self.data, self.metric, cache)
+        rows = [next(dist_rows) for _ in np.arange(self.data.shape[0])]
+        assert_array_equal(cache.get(self.data, self.metric), np.vstack(rows))
+        assert_array_equal(np.vstack(list(iter_distance_rows(self.data, self.metric, cache))), np.vstack(rows))
+
+
+    # Test that distances computed with functions that are not metrics from the registry are not cached.
+    def test_not_cacheable(self):
+        cache = DistanceCache()
+        dist_func = lambda x1, x2: np.sum(np.abs(x1 - x2), -1)
+        dists = cache.pairwise(self.data, dist_func, lambda: self.metric.pairwise(self.data))
+        self.assertTrue(dists.flags.writeable)
+        self.assertIsNone(cache.get(self.data, dist_func))
+        self.assertIsNone(cache.get(self.data, Metric('manhattan', self.metric._dist, self.metric._pairwise)))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+    # Test that the shared cache is disabled by default and that enabled caches are cleared.
+    def test_enable_clear(self):
+        self.assertFalse(DISTANCE_CACHE.enabled)
+        dists = DISTANCE_CACHE.pairwise(self.data, self.metric, lambda: self.metric.pairwise(self.data))
+        self.assertTrue(dists.flags.writeable)
+        self.assertIsNone(DISTANCE_CACHE.get(self.data, self.metric))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DistanceCache(enabled=False)
+            cache.enable(max_bytes=0, cache_dir=cache_dir)
+            cache.pairwise(self.data, self.metric, lambda: self.metric.pairwise(self.data))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cache.clear(spilled=True)
+            self.assertEqual((len(os.listdir(cache_dir)), cache.hits, cache.misses), (0, 0, 0))
+            cache.enable(max_bytes=DEFAULT_MAX_BYTES)
+            cache.pairwise(self.data, self.metric, lambda: self.metric.pairwise(self.data))
+            cache.disable()
+            self.assertIsNone(cache.get(self.data, self.metric))
+
+
+    # Test that estimators share distance matrices.
+    def test_estimators(self):
+        DISTANCE_CACHE.enable()
+        try:
+            target = np.random.randint(0, 2, self.data.shape[0])
+            weights = SURF(dist_func='manhattan').fit(self.data, target).weights
+            hits = DISTANCE_CACHE.hits
+            SURFStar(dist_func='manhattan').fit(self.data, target)
+            MultiSURF(dist_func='manhattan').fit(self.data, target)
+            MultiSURF(dist_func='manhattan').fit(self.data, target)
+            self.assertEqual(DISTANCE_CACHE.hits, hits + 2)
+            assert_array_equal(SURF(dist_func='manhattan').fit(self.data, target).weights, weights)
+        finally:
+            DISTANCE_CACHE.disable()
+
+#########################################################
+
+
+
+## CONDENSED DISTANCES UNIT TESTS #######################
+
+
+from scipy.spatial.distance import squareform
+from algorithms.utils.condensed import CondensedDistances, condensed_distances, condensed_index_distances
+
+class TestCondensedDistances(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.data = np.random.rand(11, 4)
+
+
+    # Test rows, mean and expansion of condensed vector of distances.
+    def test_rows(self):
+        dist_mat = get_metric('manhattan').pairwise(self.data)
+        dists = CondensedDistances(squareform(dist_mat, checks=False), self.data.shape[0])
+        for idx in np.arange(self.data.shape[0]):
+            assert_array_almost_equal(dists.row(idx), dist_mat[idx, :])
+        self.assertAlmostEqual(dists.mean(), np.mean(dist_mat))
+        assert_array_almost_equal(np.asarray(dists), dist_mat)
+
+
+    # Test computation of condensed vectors with metrics and distance functions.
+    def test_condensed_distances(self):
+        for name in ('manhattan', 'euclidean', 'hamming'):
+            assert_array_almost_equal(squareform(condensed_distances(self.data, get_metric(name))),
+                    get_metric(name).pairwise(self.data))
+        assert_array_almost_equal(condensed_distances(self.data, lambda x1, x2: np.sum(np.abs(x1-x2))),
+                condensed_distances(self.data, get_metric('manhattan')))
+        values = condensed_distances(self.data, get_metric('manhattan'), np.float32)
+        self.assertEqual(values.dtype, np.float32)
+        self.assertEqual(values.size, self.data.shape[0]*(self.data.shape[0]-1)//2)
+
+
+    # Test computation of condensed vectors of distances between examples referenced by their indices.
+    def test_condensed_index_distances(self):
+        calls = []
+        def dist_func_learned(i1, i2):
+            calls.append(i2)
+            return get_metric('manhattan')(self.data[i1, :], self.data[i2, :])
+        values = condensed_index_distances(self.data.shape[0], dist_func_learned)
+        assert_array_almost_equal(values, condensed_distances(self.data, get_metric('manhattan')))
+        self.assertEqual(len(calls), self.data.shape[0] - 1)
+
+        # Distance functions that only accept pairs of indices are called for each pair.
+        dist_func_pairs = lambda i1, i2: np.sum(np.abs(self.data[i1, :]-self.data[i2, :]))
+        assert_array_almost_equal(condensed_index_distances(self.data.shape[0], dist_func_pairs), values)
+
+
+    # Test that SURF stores single precision distances if specified.
+    def test_distance_dtype(self):
+        target = np.random.randint(0, 2, self.data.shape[0])
+        dists = SURF()._get_pairwise_distances(self.data, get_metric('manhattan'), mode='example')
+        dists32 = SURF(distance_dtype=np.float32)._get_pairwise_distances(self.data, get_metric('manhattan'), mode='example')
+        self.assertEqual(dists32.dtype, np.float32)
+        self.assertEqual(2*dists32.nbytes, dists.nbytes)
+        assert_array_equal(SURF(dist_func='manhattan', distance_dtype=np.float32).fit(self.data, target).rank,
+                SURF(dist_func='manhattan').fit(self.data, target).rank)
+
+#########################################################
+
+
+
+## SPARSE DATA UNIT TESTS ###############################
+
+
+import scipy.sparse as sp
+from algorithms.utils.sparse import check_sparse_input, max_min, abs_diffs
+
+class TestSparse(unittest.TestCase):
+
+    def setUp(self):
+        self.data = sp.random(40, 25, density=0.2, format='csr', random_state=0)
+        self.data.data = 4.0*self.data.data - 2.0
+        self.target = np.random.RandomState(0).randint(0, 3, self.data.shape[0])
+
+
+    # Test sparse kernels of metrics.
+    def test_metrics(self):
+        for name in ('manhattan', 'euclidean', 'sqeuclidean'):
+            metric = get_metric(name)
+            assert_array_almost_equal(metric.pairwise(self.data), metric.pairwise(self.data.toarray()))
+            assert_array_almost_equal(metric(self.data[3, :], self.data), metric(self.data.toarray()[3, :], self.data.toarray()))
+        self.assertRaises(ValueError, get_metric('chebyshev').pairwise, self.data)
+
+
+    # Test feature value ranges and differences of sparse matrices.
+    def test_max_min_diffs(self):
+        max_f_vals, min_f_vals = max_min(self.data)
+        assert_array_equal(max_f_vals, np.max(self.data.toarray(), 0))
+        assert_array_equal(min_f_vals, np.min(self.data.toarray(), 0))
+        diffs = abs_diffs(self.data[0, :], self.data[1:5, :])
+        self.assertTrue(sp.issparse(diffs))
+        assert_array_almost_equal(diffs.toarray(), np.abs(self.data.toarray()[0, :] - self.data.toarray()[1:5, :]))
+
+
+    # Test that estimators compute the same weights for sparse and dense data.
+    def test_estimators(self):
+        for estimator in (Relief(dist_func='manhattan'), Relieff(dist_func='euclidean', k=3), SURF(dist_func='manhattan'),
+                SURFStar(dist_func='euclidean'), MultiSURF(dist_func='manhattan')):
+            np.random.seed(0)
+            weights = estimator.fit(self.data.toarray(), self.target).weights
+            np.random.seed(0)
+            assert_array_almost_equal(estimator.fit(self.data, self.target).weights, weights)
+
+
+    # Test that sparse data requires a metric with a sparse kernel.
+    def test_check_sparse_input(self):
+        check_sparse_input(self.data.toarray(), lambda x1, x2: np.sum(np.abs(x1-x2), 1))
+        check_sparse_input(self.data, 'manhattan')
+        self.assertRaises(ValueError, check_sparse_input, self.data, lambda x1, x2: np.sum(np.abs(x1-x2), 1))
+        self.assertRaises(ValueError, check_sparse_input, self.data, 'hamming')
+        self.assertRaises(ValueError, SURF().fit, self.data, self.target)
+
+#########################################################
+
+
+
+## PRECOMPUTED DISTANCES UNIT TESTS #####################
+
+
+from scipy.spatial.distance import pdist
+from algorithms.utils.precomputed import PrecomputedDistances, resolve_precomputed
+from algorithms.turf import TuRF
+
+class TestPrecomputed(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = rng.rand(40, 6)
+        self.target = rng.randint(0, 2, self.data.shape[0])
+        self.data[:, 0] += self.target
+        self.dist_mat = get_metric('manhattan').pairwise(self.data)
+
+
+    # Test looking up distances in square matrix and condensed vector.
+    def test_precomputed_distances(self):
+        for distances in (self.dist_mat, pdist(self.data, 'cityblock'), CondensedDistances(pdist(self.data, 'cityblock'), self.data.shape[0])):
+            precomputed = PrecomputedDistances(distances, self.data.shape[0])
+            assert_array_almost_equal(precomputed(None, 3, np.arange(self.data.shape[0])), self.dist_mat[3, :])
+            self.assertAlmostEqual(precomputed(None, 7, 2), self.dist_mat[7, 2])
+        self.assertRaises(ValueError, PrecomputedDistances, self.dist_mat[:10, :10], self.data.shape[0])
+
+
+    # Test that estimators compute the same weights from precomputed square, condensed and memory-mapped distances as from computed distances.
+    def test_estimators(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'distances.npy')
+            np.save(path, self.dist_mat)
+            for estimator, dist_func in ((SURF(), 'manhattan'), (MultiSURF(), 'manhattan'), (Relieff(k=3), 'manhattan')):
+                np.random.seed(0)
+                weights = estimator.set_params(dist_func=dist_func).fit(self.data, self.target).weights
+                estimator.set_params(dist_func='precomputed')
+                for distances in (self.dist_mat, pdist(self.data, 'cityblock'), np.load(path, mmap_mode='r')):
+                    np.random.seed(0)
+                    assert_array_almost_equal(estimator.fit(self.data, self.target, distances).weights, weights)
+                self.assertEqual(estimator.fit_transform(self.data, self.target, self.dist_mat).shape, (self.data.shape[0], 6))
+
+        # Precomputed distances are not reweighted by algorithms that reweight distances and do not change when TuRF removes features.
+        learned_metric_func = lambda data, target: lambda dist_func, i1, i2: self.dist_mat[i1, i2]
+        np.random.seed(0)
+        weights = IterativeRelief(max_iter=3, dist_func='weighted_manhattan', learned_metric_func=learned_metric_func).fit(self.data, self.target).weights
+        np.random.seed(0)
+        assert_array_almost_equal(IterativeRelief(max_iter=3, dist_func='precomputed').fit(self.data, self.target, self.dist_mat).weights, weights)
+        np.random.seed(0)
+        weights = TuRF(num_it=2, rba=Relieff(k=3, learned_metric_func=learned_metric_func)).fit(self.data, self.target).weights
+        np.random.seed(0)
+        assert_array_almost_equal(TuRF(num_it=2, rba=Relieff(k=3, dist_func='precomputed')).fit(self.data, self.target, self.dist_mat).weights, weights)
+
+
+    # Test that precomputed distances must be passed with the 'precomputed' distance function.
+    def test_resolve_precomputed(self):
+        self.assertRaises(ValueError, resolve_precomputed, 'precomputed', None, self.data.shape[0], None)
+        self.assertRaises(ValueError, resolve_precomputed, 'manhattan', None, self.data.shape[0], self.dist_mat)
+        self.assertRaises(ValueError, resolve_precomputed, 'precomputed', lambda data, target: None, self.data.shape[0], self.dist_mat)
+        self.assertRaises(ValueError, SURF(dist_func='precomputed').fit, self.data, self.target)
+
 #########################################################
 
 
@@ -503,6 +1411,7 @@ class TestIRelief(unittest.TestCase):
 ## SURF ALGORITHM IMPLEMENTATION UNIT TESTS ########
 
 from algorithms.surf import SURF
+from algorithms.utils.radius_neighbours import RadiusNeighbours, estimate_mean_distance
 
 class TestSURF(unittest.TestCase):
 
@@ -553,6 +1462,31 @@ class TestSURF(unittest.TestCase):
 
         assert_array_almost_equal(dist_mat, correct_res, decimal=5)
 
+    # Test radius queries against rows of pairwise distance matrix.
+    def test_radius_neighbours(self):
+        data = np.random.RandomState(0).randint(0, 3, (60, 5)).astype(np.float64)
+        for metric in ('manhattan', 'euclidean', 'hamming'):
+            dist_mat = get_metric(metric).pairwise(data)
+            radius = np.mean(dist_mat)
+            neighbours = list(RadiusNeighbours(data, get_metric(metric)).iter_query(radius))
+            for idx in np.arange(data.shape[0]):
+                assert_array_equal(neighbours[idx], np.flatnonzero(dist_mat[idx, :] <= radius))
+
+    # Test estimation of mean distance from sampled pairs of examples and weights computed using estimated mean distance.
+    def test_mean_sample_size(self):
+        np.random.seed(0)
+        data = np.random.rand(100, 6)
+        target = np.random.randint(0, 2, data.shape[0])
+        data[:, 0] += target
+        surf_exact = SURF(dist_func='manhattan').fit(data, target)
+        self.assertEqual(surf_exact.mean_dist_bound, 0.0)
+        mean_dist, bound = estimate_mean_distance(data, get_metric('manhattan'), 50000, confidence=0.999)
+        self.assertLessEqual(abs(mean_dist - surf_exact.mean_dist), bound)
+        surf_sampled = SURF(dist_func='manhattan', mean_sample_size=50000).fit(data, target)
+        self.assertEqual(surf_sampled.rank[0], 1)
+        assert_array_almost_equal(surf_sampled.weights, surf_exact.weights, decimal=2)
+        self.assertRaises(ValueError, SURF(mean_sample_size=10, learned_metric_func=lambda data, target: None).fit, data, target)
+
 
     # Test computation of pairwise distance matrix using distance function that references examples
     # by their indices.
@@ -606,6 +1540,8 @@ class TestVlsRelief(unittest.TestCase):
         self.assertEqual(vlsrelief.k, 5)
         self.assertNotEqual(vlsrelief.dist_func, None)
         self.assertEqual(vlsrelief.learned_metric_func, None)
+        self.assertEqual(vlsrelief.neighbour_backend, 'brute')
+        self.assertEqual(vlsrelief.neighbour_params, None)
 
     # Test initialization with explicit parameters.
     def test_init_custom(self):
@@ -783,6 +1719,25 @@ class TestBoostedSURF(unittest.TestCase):
         assert_array_almost_equal(weights, np.array([1, 1, 1]))
 
 
+    # Test that weighting cached per-feature distance terms gives the same weights as recomputing distances.
+    def test_linear_terms(self):
+        data = np.random.RandomState(0).randint(0, 3, (50, 20)).astype(np.float64)
+        target = np.random.RandomState(0).randint(0, 2, 50)
+        for dist_func in ('weighted_hamming', 'weighted_manhattan'):
+            weights = BoostedSURF(dist_func=dist_func, phi=7, max_terms_bytes=0).fit(data, target).weights
+            assert_array_equal(BoostedSURF(dist_func=dist_func, phi=7).fit(data, target).weights, weights)
+            assert_array_equal(BoostedSURF(dist_func=dist_func, phi=7, max_terms_bytes=3*data.nbytes).fit(data, target).weights, weights)
+        self.assertEqual(get_metric('weighted_euclidean', weighted=True).linear_terms, None)
+
+    # Test that weights computed from numbers of differences to all examples are equal to weights computed by enumerating all neighbours.
+    def test_max_sums_bytes(self):
+        data = np.random.RandomState(0).randint(0, 3, (50, 20)).astype(np.float64)
+        target = np.random.RandomState(0).randint(0, 3, 50)
+        for max_terms_bytes in (0, 2**27):
+            weights = BoostedSURF(dist_func='weighted_hamming', phi=7, max_terms_bytes=max_terms_bytes, max_sums_bytes=0).fit(data, target).weights
+            assert_array_equal(BoostedSURF(dist_func='weighted_hamming', phi=7, max_terms_bytes=max_terms_bytes).fit(data, target).weights, weights)
+
+
 
 ######################################################
 
@@ -894,6 +1849,25 @@ class TestMultiSURF(unittest.TestCase):
         # Assert equality to results computed by hand.
         assert_array_equal(critical_neighbours, np.array([0, 4]))
 
+    # Test that neighbours in compressed sparse row format found from tiles of the distance matrix are equal to
+    # neighbours found from the full matrix.
+    def test_neighbours_csr(self):
+        np.random.seed(0)
+        data = np.random.rand(23, 4)
+        target = np.random.randint(0, 3, data.shape[0])
+        dist_mat = MultiSURF()._get_pairwise_distances(data=data, dist_func=get_metric('manhattan'), mode='example')
+        for tile_size in (1, 5, 100):
+            multisurf = MultiSURF(tile_size=tile_size)
+            offsets, indices, hit_mask = multisurf._neighbours_csr(target, multisurf._iter_distance_tiles(data, get_metric('manhattan')))
+            self.assertEqual(indices.dtype, np.int32)
+            hits = np.unpackbits(hit_mask)[:indices.size].astype(bool)
+            for idx in np.arange(data.shape[0]):
+                r1 = multisurf._critical_neighbours(idx, dist_mat)
+                assert_array_equal(indices[offsets[idx]:offsets[idx+1]], r1)
+                assert_array_equal(hits[offsets[idx]:offsets[idx+1]], target[r1] == target[idx])
+            assert_array_equal(MultiSURF(dist_func='manhattan', tile_size=tile_size).fit(data, target).weights,
+                    MultiSURF(dist_func='manhattan').fit(data, target).weights)
+
     def test_weights_update(self):
 
         # test data
@@ -941,8 +1915,10 @@ class TestMultiSURF(unittest.TestCase):
         max_f_vals = np.max(data, 0)
         min_f_vals = np.min(data, 0)
 
-        weights = multisurf._update_weights(data, data[ex_idx, :][np.newaxis], (data[neigh_data[0, :], :])[neigh_data[1, :].astype(np.bool), :],\
-                (data[neigh_data[0, :], :])[np.logical_not(neigh_data[1, :].astype(np.bool)), :], weights[np.newaxis], weights_mult[np.newaxis].T, max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+        multisurf._update_weights(accumulator, data[ex_idx, :], (data[neigh_data[0, :], :])[neigh_data[1, :].astype(np.bool), :],\
+                (data[neigh_data[0, :], :])[np.logical_not(neigh_data[1, :].astype(np.bool)), :], weights_mult, data.shape[0])
+        weights = weights + accumulator.weights()
         correct_res = np.array([0.01445232, -0.03071705, -0.02560835])
 
         # Assert equality to results computed by hand.
@@ -955,6 +1931,7 @@ class TestMultiSURF(unittest.TestCase):
 ## SURFSTAR ALGORITHM IMPLEMENTATION UNIT TESTS ######
 
 from algorithms.surfstar import SURFStar
+from algorithms.utils.class_diff_sums import ClassDiffSums
 
 class TestSURFStar(unittest.TestCase):
 
@@ -1039,12 +2016,70 @@ class TestSURFStar(unittest.TestCase):
         assert_array_almost_equal(dist_mat, correct_res, decimal=5)
 
 
+    # Test that weights computed from sums of differences for groups of neighbours are equal to weights
+    # computed from neighbours' differences.
+    def test_weights(self):
+        np.random.seed(0)
+        data = np.random.rand(30, 4)
+        target = np.random.randint(0, 3, data.shape[0])
+        dist_mat = get_metric('manhattan').pairwise(data)
+        mean_dist = np.mean(dist_mat)
+        weights = np.zeros(data.shape[1])
+        for idx in np.arange(data.shape[0]):
+            e = data[idx, :]
+            msk_near = dist_mat[idx, :] <= mean_dist
+            msk_near[idx] = False
+            msk_far = dist_mat[idx, :] > mean_dist
+            for msk, sgn in ((msk_near, 1.0), (msk_far, -1.0)):
+                msk_hit = np.logical_and(msk, target == target[idx])
+                msk_miss = np.logical_and(msk, target != target[idx])
+                u, c = np.unique(target[msk_miss], return_counts=True)
+                weights_mult = np.array([dict(zip(u, c/np.sum(c)))[cls] for cls in target[msk_miss]])
+                weights -= sgn*np.sum(np.abs(e - data[msk_hit, :]), 0)/(data.shape[0]*np.sum(msk_hit) + np.finfo(np.float64).eps)
+                weights += sgn*np.sum(weights_mult[np.newaxis].T*np.abs(e - data[msk_miss, :]), 0)/(data.shape[0]*np.sum(msk_miss) + np.finfo(np.float64).eps)
+        weights = weights/(np.max(data, 0) - np.min(data, 0) + np.finfo(np.float64).eps)
+        assert_array_almost_equal(SURFStar(dist_func='manhattan').fit(data, target).weights, weights)
+
+    # Test sums of differences to all examples of each class and sums for bands of examples.
+    def test_class_diff_sums(self):
+        rng = np.random.RandomState(0)
+        data = np.vstack((rng.rand(30, 6), rng.randint(0, 3, (30, 6)))).astype(np.float64)
+        class_idx = rng.randint(0, 3, data.shape[0])
+        class_diff_sums = ClassDiffSums(data, class_idx, 3)
+        for idx in (0, 31, 59):
+            assert_array_almost_equal(class_diff_sums.abs_diff_sums(idx), np.array([np.sum(np.abs(data[idx, :] - data[class_idx == c, :]), 0) for c in np.arange(3)]))
+            assert_array_equal(class_diff_sums.diff_counts(idx), np.array([np.sum(data[idx, :] != data[class_idx == c, :], 0) for c in np.arange(3)]))
+
+            # Sums for band with most examples are computed from sums for all examples.
+            bands = np.where(np.arange(data.shape[0]) % 5 == 0, 0, np.where(np.arange(data.shape[0]) % 5 == 1, 1, 2))
+            bands[idx] = -1
+            groups = np.where(bands >= 0, 3*bands + class_idx, -1)
+            sums_func = lambda rows, groups, n_groups: group_sums(np.abs(data[idx, :] - data[rows, :]), groups, n_groups)
+            sums, counts = class_diff_sums.band_sums(idx, bands, 3, sums_func)
+            sums_expected, counts_expected = group_sums(np.abs(data[idx, :] - data), groups, 9)
+            assert_array_almost_equal(sums, sums_expected)
+            assert_array_equal(counts, counts_expected)
+            sums, counts = class_diff_sums.band_sums(idx, bands, 3, sums_func, unused=2)
+            assert_array_almost_equal(sums[:6], sums_expected[:6])
+            assert_array_equal(counts[:6], counts_expected[:6])
+
+    # Test that all neighbours are enumerated by default and that weights computed from sums of differences to all examples agree
+    # with weights computed by enumerating all neighbours up to rounding.
+    def test_max_sums_bytes(self):
+        data = np.random.RandomState(0).rand(50, 8)
+        target = np.random.RandomState(0).randint(0, 3, 50)
+        weights = SURFStar(dist_func='manhattan', max_sums_bytes=0).fit(data, target).weights
+        assert_array_equal(SURFStar(dist_func='manhattan').fit(data, target).weights, weights)
+        assert_array_almost_equal(SURFStar(dist_func='manhattan', max_sums_bytes=2**28).fit(data, target).weights, weights, decimal=12)
+
+
 ######################################################
 
 
 ## MULTISURFSTAR ALGORITHM IMPLEMENTATION UNIT TESTS #
 
 from algorithms.multisurfstar import MultiSURFStar
+from algorithms.utils.packed import PackedGenotypes, column_popcounts, popcount
 
 class TestMultiSURFStar(unittest.TestCase):
 
@@ -1062,6 +2097,40 @@ class TestMultiSURFStar(unittest.TestCase):
         self.assertNotEqual(multisurfstar.dist_func, None)
         self.assertNotEqual(multisurfstar.learned_metric_func, None)
 
+
+    # Test counting set bits of packed words.
+    def test_column_popcounts(self):
+        words = np.random.RandomState(0).randint(0, 2**63, (37, 3)).astype(np.uint64)
+        bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+        assert_array_equal(column_popcounts(words, 150), np.sum(bits, 0)[:150])
+        assert_array_equal(popcount(words), np.sum(bits, 1))
+        assert_array_equal(column_popcounts(words[:0, :], 150), np.zeros(150))
+
+    # Test distances and counts of differing features of packed ternary genotypes.
+    def test_packed_genotypes(self):
+        data = np.random.RandomState(0).randint(0, 3, (30, 100)).astype(np.float64)
+        genotypes = PackedGenotypes(data)
+        self.assertEqual(genotypes.nbytes, 2*30*16)
+        assert_array_equal(genotypes.distances(4), np.sum(data[4, :] != data, 1))
+        assert_array_equal(genotypes.diff_counts(4, np.arange(10, 20)), np.sum(data[4, :] != data[10:20, :], 0))
+        self.assertRaises(ValueError, PackedGenotypes, np.arange(8.0).reshape(2, 4))
+
+    # Test that weights computed using packed representation are equal to weights computed using unpacked data.
+    def test_packed(self):
+        data = np.random.RandomState(1).randint(0, 3, (80, 70)).astype(np.float64)
+        target = np.random.RandomState(1).randint(0, 2, 80)
+        weights = MultiSURFStar(dist_func='hamming', packed=False).fit(data, target).weights
+        assert_array_equal(MultiSURFStar(dist_func='hamming').fit(data, target).weights, weights)
+        self.assertRaises(ValueError, MultiSURFStar(packed=True).fit, data, target)
+
+    # Test that weights computed from numbers of differences to all examples are equal to weights computed by enumerating all neighbours.
+    def test_max_sums_bytes(self):
+        data = np.random.RandomState(1).randint(0, 3, (80, 70)).astype(np.float64)
+        target = np.random.RandomState(1).randint(0, 3, 80)
+        for packed in (False, None):
+            weights = MultiSURFStar(dist_func='hamming', packed=packed, max_sums_bytes=0).fit(data, target).weights
+            assert_array_equal(MultiSURFStar(dist_func='hamming', packed=packed).fit(data, target).weights, weights)
+
 ######################################################
 
 
@@ -1183,8 +2252,9 @@ class TestSWRFStar(unittest.TestCase):
        
 
         # Compute updated weights using method.
-        weights = swrfstar._update_weights(data, e[np.newaxis], same, other, weights[np.newaxis], weights_mult[np.newaxis].T, 
-                neigh_weights_same[np.newaxis].T, neigh_weights_other[np.newaxis].T, m, max_f_vals[np.newaxis], min_f_vals[np.newaxis])
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+        swrfstar._update_weights(accumulator, e, same, other, weights_mult, neigh_weights_same, neigh_weights_other, m)
+        weights = weights + accumulator.weights()
         
         # results computed by hand
         correct_res = np.array([0.00444562, -0.01373921, -0.03862486])
@@ -1370,9 +2440,15 @@ class TestReliefMSS(unittest.TestCase):
         min_f_vals = np.min(data, 0)
 
         
+        # Compare DM values computed using method with values computed by hand.
+        assert_array_almost_equal(reliefmss._dm_vals(e, closest_same, max_f_vals, min_f_vals), dm_vals_same, decimal=5)
+        assert_array_almost_equal(reliefmss._dm_vals(e, closest_other, max_f_vals, min_f_vals), dm_vals_other, decimal=5)
+
         # Compute results using method
-        weights = reliefmss._update_weights(data, e[np.newaxis], closest_same, closest_other, weights[np.newaxis], weights_mult[np.newaxis].T, m, k,
-                max_f_vals[np.newaxis], min_f_vals[np.newaxis], dm_vals_same, dm_vals_other, features_msk_same, features_msk_other)
+        accumulator = WeightAccumulator(max_f_vals, min_f_vals)
+        reliefmss._update_weights(accumulator, e, closest_same, closest_other, weights_mult, m, k,
+                dm_vals_same, dm_vals_other, features_msk_same, features_msk_other)
+        weights = weights + accumulator.weights()
         
         # Assert equality with results computed by "hand"
         correct_results = [0.0, -0.02179696, -0.03737824]